@@ -0,0 +1,183 @@
+"""
+SQLite connection profiles, selected with the EXPENSES_DB_PROFILE
+environment variable (see settings.py).
+
+``development`` is Django's stock SQLite setup. ``production`` makes SQLite
+hold up under a multi-threaded server:
+
+* WAL journal, so readers never block the writer or each other, with
+  ``synchronous=NORMAL`` (durable at checkpoints, no fsync per commit),
+  a larger page cache and memory-mapped reads;
+* ``BEGIN IMMEDIATE`` transactions and a busy timeout, so concurrent
+  writers queue for the lock instead of failing with "database is locked"
+  when a read transaction tries to upgrade;
+* persistent connections (CONN_MAX_AGE) with health checks;
+* a ``replica`` alias on the same file opened read-only, which
+  ``ReadWriteRouter`` sends reads to.
+"""
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+from django.db import OperationalError, connections, transaction
+
+
+PROFILES = ('development', 'production')
+
+# pages are 4 KiB; a negative cache_size is in KiB
+SHARED_PRAGMAS = [
+    'PRAGMA cache_size=-65536',
+    'PRAGMA mmap_size=268435456',
+    'PRAGMA temp_store=MEMORY',
+]
+WRITER_PRAGMAS = ['PRAGMA journal_mode=WAL', 'PRAGMA synchronous=NORMAL', *SHARED_PRAGMAS]
+READER_PRAGMAS = ['PRAGMA query_only=ON', *SHARED_PRAGMAS]
+
+BUSY_TIMEOUT = 20
+CONN_MAX_AGE = 600
+
+
+def sqlite_databases(path, profile='development'):
+    """DATABASES for the SQLite file at ``path`` under ``profile``."""
+    if profile not in PROFILES:
+        raise ValueError(f'Unknown database profile {profile!r}; expected one of {", ".join(PROFILES)}')
+    if profile == 'development':
+        return {
+            'default': {
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': path,
+            }
+        }
+
+    common = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'CONN_MAX_AGE': CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': True,
+    }
+    return {
+        'default': {
+            **common,
+            'NAME': path,
+            'OPTIONS': {
+                'timeout': BUSY_TIMEOUT,
+                'transaction_mode': 'IMMEDIATE',
+                'init_command': ';'.join(WRITER_PRAGMAS),
+            },
+        },
+        'replica': {
+            **common,
+            'NAME': f'{Path(path).resolve().as_uri()}?mode=ro',
+            'OPTIONS': {
+                'timeout': BUSY_TIMEOUT,
+                'init_command': ';'.join(READER_PRAGMAS),
+            },
+            # tests see one database, so reads find rows written in the test
+            'TEST': {'MIRROR': 'default'},
+        },
+    }
+
+
+class ReadWriteRouter:
+    """
+    Reads go to ``replica`` and writes to ``default``, except inside a
+    transaction on ``default``: reads there must see its uncommitted rows
+    (rollup upserts, bulk writes) and belong to the same snapshot.
+    """
+    read_alias = 'replica'
+    write_alias = 'default'
+
+    def db_for_read(self, model, **hints):
+        if connections[self.write_alias].in_atomic_block:
+            return self.write_alias
+        return self.read_alias
+
+    def db_for_write(self, model, **hints):
+        return self.write_alias
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # both aliases are the same database
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == self.write_alias
+
+
+def stress(directory, profile='production', writers=8, readers=8, seconds=3.0):
+    """
+    Hammer a scratch SQLite file in ``directory`` configured with ``profile``
+    from ``writers`` + ``readers`` threads for ``seconds``. Writers run
+    read-then-write transactions (the pattern that deadlocks into "database
+    is locked" under SQLite's default deferred transactions); readers query
+    through the read alias. Returns operation counts, errors by message and
+    whether every write saw the one before it.
+    """
+    path = Path(directory) / 'stress.sqlite3'
+    aliases = {f'stress_{alias}': config for alias, config in sqlite_databases(path, profile).items()}
+    configured = connections.configure_settings({'default': connections.settings['default'], **aliases})
+    for alias in aliases:
+        connections.settings[alias] = configured[alias]
+    write_alias = 'stress_default'
+    read_alias = 'stress_replica' if 'stress_replica' in aliases else write_alias
+
+    lock = threading.Lock()
+    counts = {'writes': 0, 'reads': 0}
+    errors = Counter()
+    deadline = time.monotonic() + seconds
+
+    def write():
+        with transaction.atomic(using=write_alias):
+            with connections[write_alias].cursor() as cursor:
+                cursor.execute('SELECT COALESCE(MAX(n), 0) FROM stress')
+                n = cursor.fetchone()[0]
+                cursor.execute('INSERT INTO stress (n) VALUES (%s)', [n + 1])
+        return 'writes'
+
+    def read():
+        with connections[read_alias].cursor() as cursor:
+            cursor.execute('SELECT COUNT(*), MAX(n) FROM stress')
+            cursor.fetchone()
+        return 'reads'
+
+    def worker(operation):
+        try:
+            while time.monotonic() < deadline:
+                try:
+                    kind = operation()
+                except OperationalError as exc:
+                    with lock:
+                        errors[str(exc)] += 1
+                else:
+                    with lock:
+                        counts[kind] += 1
+        finally:
+            connections.close_all()
+
+    try:
+        with connections[write_alias].cursor() as cursor:
+            cursor.execute('CREATE TABLE IF NOT EXISTS stress (id INTEGER PRIMARY KEY, n INTEGER NOT NULL)')
+        threads = [threading.Thread(target=worker, args=(write,)) for _ in range(writers)]
+        threads += [threading.Thread(target=worker, args=(read,)) for _ in range(readers)]
+        started = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started
+
+        with connections[write_alias].cursor() as cursor:
+            cursor.execute('SELECT COUNT(*), COALESCE(MAX(n), 0) FROM stress')
+            rows, highest = cursor.fetchone()
+    finally:
+        for alias in aliases:
+            connections[alias].close()
+            del connections[alias]
+            del connections.settings[alias]
+
+    return {
+        **counts,
+        'writes_per_sec': counts['writes'] / elapsed,
+        'reads_per_sec': counts['reads'] / elapsed,
+        'errors': dict(errors),
+        'consistent': rows == highest == counts['writes'],
+    }
@@ -10,8 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/6.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
+from .database import sqlite_databases
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -44,6 +47,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'expenses.instrumentation.InstrumentationMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -77,13 +81,61 @@ WSGI_APPLICATION = 'expense_project.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/6.0/ref/settings/#databases
 
-DATABASES = {
+# EXPENSES_DB_PROFILE=production turns on WAL, tuned pragmas, persistent
+# connections and the read-only replica alias (expense_project/database.py).
+EXPENSES_DB_PROFILE = os.environ.get('EXPENSES_DB_PROFILE', 'development')
+
+DATABASES = sqlite_databases(BASE_DIR / 'db.sqlite3', EXPENSES_DB_PROFILE)
+
+if 'replica' in DATABASES:
+    DATABASE_ROUTERS = ['expense_project.database.ReadWriteRouter']
+
+
+# Cache
+# https://docs.djangoproject.com/en/6.0/topics/cache/
+# Summary/analytics responses are cached per user here (expenses/caching.py).
+# Point EXPENSES_CACHE_ALIAS at a shared backend (Redis, Memcached) when
+# running more than one worker process.
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'expenses',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
     }
 }
 
+EXPENSES_CACHE_ALIAS = 'default'
+EXPENSES_CACHE_TIMEOUT = 300
+
+# Let the async views (expenses/asyncviews.py) run independent queries on
+# separate connections at once. Only worth it on a server database; SQLite
+# serializes them anyway.
+EXPENSES_ASYNC_PARALLEL_QUERIES = False
+
+# /api/sync/ tokens older than this get a full snapshot instead of a delta
+EXPENSES_TOMBSTONE_RETENTION_DAYS = 90
+
+# API tokens (expenses/authentication.py): lookups are cached in-process
+# for EXPENSES_AUTH_CACHE_TTL seconds; tokens older than EXPENSES_TOKEN_TTL
+# seconds are refused until the user logs in again or rotates them.
+EXPENSES_AUTH_CACHE_TTL = 300
+EXPENSES_AUTH_CACHE_SIZE = 4096
+EXPENSES_TOKEN_TTL = 30 * 24 * 3600
+
+# Sessions (the browsable API) are read from the cache, not the table
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
+# Request instrumentation (expenses/instrumentation.py): query count, DB,
+# serializer and render time per request in a Server-Timing header and in
+# per-route histograms (manage.py perf_stats, /api/perf/stats/). Queries
+# slower than EXPENSES_SLOW_QUERY_MS are logged with their SQL to the
+# expenses.slow_queries logger; None turns that off.
+EXPENSES_INSTRUMENTATION = True
+EXPENSES_SERVER_TIMING = True
+EXPENSES_INSTRUMENTATION_FLUSH = 10
+EXPENSES_SLOW_QUERY_MS = 200
+
 
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
@@ -121,6 +173,9 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# Job output (exports) waiting to be downloaded; served only through the API
+MEDIA_ROOT = BASE_DIR / 'media'
+
 
 LOGIN_REDIRECT_URL = '/api/expenses/'
 LOGOUT_REDIRECT_URL = '/api-auth/login'
@@ -134,10 +189,14 @@ CORS_ALLOWED_ORIGINS = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'expenses.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
-    ]
+    ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'expenses.instrumentation.TimedJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
 }
\ No newline at end of file
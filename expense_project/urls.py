@@ -17,8 +17,8 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from rest_framework.authtoken import views
-from expenses.views import ExpenseViewSet, IncomeViewSet, CategoryViewSet, BudgetViewset, BudgetProgressView
+from expenses import asyncviews
+from expenses.views import ExpenseViewSet, IncomeViewSet, CategoryViewSet, BudgetViewset, BudgetProgressView, BudgetAlertViewSet, JobViewSet, RecurringTransactionViewSet, CategoryRuleViewSet, StatementImportView, TransactionSearchView, LedgerView, LedgerExportView, CacheStatsView, PerfStatsView, SyncView, LoginView, TokenRotateView
 
 
 router = DefaultRouter()
@@ -26,12 +26,30 @@ router.register(r'expenses', ExpenseViewSet, basename='expense')
 router.register(r'income',IncomeViewSet, basename='income')
 router.register(r'category',CategoryViewSet, basename='category')
 router.register(r'budgets',BudgetViewset, basename='budget')
+router.register(r'alerts', BudgetAlertViewSet, basename='budget-alert')
+router.register(r'jobs', JobViewSet, basename='job')
+router.register(r'recurring', RecurringTransactionViewSet, basename='recurring')
+router.register(r'category-rules', CategoryRuleViewSet, basename='category-rule')
 
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api-auth/', include('rest_framework.urls')),
     path('api/budgets/progress/', BudgetProgressView.as_view(), name="budget-progress"),
-    path('api/login', views.obtain_auth_token),
+    path('api/search/', TransactionSearchView.as_view(), name="transaction-search"),
+    path('api/ledger/', LedgerView.as_view(), name="ledger"),
+    path('api/ledger/export_csv/', LedgerExportView.as_view(), name="ledger-export"),
+    path('api/cache/stats/', CacheStatsView.as_view(), name="cache-stats"),
+    path('api/perf/stats/', PerfStatsView.as_view(), name="perf-stats"),
+    path('api/sync/', SyncView.as_view(), name="sync"),
+    path('api/import/', StatementImportView.as_view(), name="statement-import"),
+    path('api/login', LoginView.as_view()),
+    path('api/token/rotate/', TokenRotateView.as_view(), name="token-rotate"),
+    # async (ASGI) versions of the read-heavy endpoints
+    path('api/async/expenses/', asyncviews.AsyncExpenseListView.as_view(), name="async-expense-list"),
+    path('api/async/expenses/summary_stats/', asyncviews.AsyncExpenseSummaryView.as_view(), name="async-expense-summary"),
+    path('api/async/income/', asyncviews.AsyncIncomeListView.as_view(), name="async-income-list"),
+    path('api/async/income/summary/', asyncviews.AsyncIncomeSummaryView.as_view(), name="async-income-summary"),
+    path('api/async/budgets/progress/', asyncviews.AsyncBudgetProgressView.as_view(), name="async-budget-progress"),
     path('api/', include(router.urls)),
 ]
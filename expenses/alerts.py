@@ -0,0 +1,115 @@
+"""
+Budget threshold alerts. The write path only records which expense buckets
+(user, category, month) went up, through the rollup updates in
+``rollups``; the worker in ``process()`` later compares those buckets'
+running totals against the budgets and writes a BudgetAlert the first time
+each threshold is reached in a month.
+"""
+from decimal import Decimal
+from functools import reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .caching import bump_version
+from .models import AlertEvent, Budget, BudgetAlert, Category, MonthlyRollup
+
+
+THRESHOLDS = (80, 100)
+BATCH_SIZE = 500
+# (pk, enqueued_at) pairs per DELETE; SQLite nests each OR one level deeper
+DELETE_CHUNK = 100
+
+
+def enqueue(buckets):
+    """
+    Queue (user_id, category_id, month) buckets for checking: one upsert,
+    so a burst of writes to the same bucket leaves a single queue row.
+    """
+    events = [
+        AlertEvent(user_id=user_id, category_id=category_id, month=month)
+        for user_id, category_id, month in set(buckets) if category_id is not None
+    ]
+    if events:
+        AlertEvent.objects.bulk_create(
+            events, update_conflicts=True,
+            unique_fields=['user', 'category', 'month'], update_fields=['enqueued_at'],
+        )
+
+
+def crossed(spent, limit, already):
+    return [
+        threshold for threshold in THRESHOLDS
+        if threshold not in already and limit > 0 and spent * 100 >= limit * threshold
+    ]
+
+
+def process(batch_size=BATCH_SIZE):
+    """
+    Check one batch of queued buckets and write the alerts they earned.
+    Returns the number of queue rows handled; 0 means the queue is empty.
+    """
+    with transaction.atomic():
+        events = list(
+            AlertEvent.objects.select_for_update(skip_locked=True).order_by('enqueued_at', 'id')[:batch_size]
+        )
+        if not events:
+            return 0
+
+        users = {event.user_id for event in events}
+        months = {event.month for event in events}
+        budgets = {
+            (budget.user_id, budget.category_id): budget
+            for budget in Budget.objects.filter(user_id__in=users, category_id__in={event.category_id for event in events})
+        }
+        totals = dict(
+            ((user_id, category_id, month), total)
+            for user_id, category_id, month, total in MonthlyRollup.objects.filter(
+                user_id__in=users, transaction_type=Category.CategoryType.EXPENSE, month__in=months,
+                category_id__in={category_id for _, category_id in budgets},
+            ).values_list('user_id', 'category_id', 'month', 'total')
+        )
+        sent = {}
+        for budget_id, month, threshold in BudgetAlert.objects.filter(
+            budget__in=budgets.values(), month__in=months,
+        ).values_list('budget_id', 'month', 'threshold'):
+            sent.setdefault((budget_id, month), set()).add(threshold)
+
+        alerts = []
+        for event in events:
+            budget = budgets.get((event.user_id, event.category_id))
+            if budget is None:
+                continue
+            spent = totals.get((event.user_id, event.category_id, event.month), Decimal('0'))
+            for threshold in crossed(spent, budget.amount, sent.get((budget.id, event.month), set())):
+                alerts.append(BudgetAlert(
+                    user_id=event.user_id, budget=budget, month=event.month,
+                    threshold=threshold, spent=spent, limit=budget.amount,
+                ))
+        BudgetAlert.objects.bulk_create(alerts, ignore_conflicts=True)
+
+        # a row re-enqueued since it was read no longer has the enqueued_at it
+        # was read with and stays. Its new stamp may still be older than other
+        # rows of the batch, so each row is matched on its own.
+        for start in range(0, len(events), DELETE_CHUNK):
+            AlertEvent.objects.filter(reduce(or_, (
+                Q(pk=event.pk, enqueued_at=event.enqueued_at) for event in events[start:start + DELETE_CHUNK]
+            ))).delete()
+
+    for user_id in {alert.user_id for alert in alerts}:
+        bump_version(user_id)
+    return len(events)
+
+
+def drain(batch_size=BATCH_SIZE):
+    """Process batches until the queue is empty; returns the rows handled."""
+    handled = 0
+    while processed := process(batch_size):
+        handled += processed
+    return handled
+
+
+def mark_read(queryset):
+    return queryset.filter(read_at__isnull=True).update(read_at=timezone.now())
@@ -1,5 +1,10 @@
 from django.apps import AppConfig
+from django.core import checks
 
 
 class ExpensesConfig(AppConfig):
     name = 'expenses'
+
+    def ready(self):
+        from . import search, signals  # noqa: F401
+        checks.register(search.check_triggers, checks.Tags.database)
@@ -0,0 +1,211 @@
+"""
+Async versions of the read-heavy endpoints, for deployments served over
+ASGI (``expense_project.asgi``). They return the same JSON as their sync
+counterparts in ``views`` but await the database instead of holding a
+worker thread, and run independent queries side by side.
+"""
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.timezone import now
+from django.views import View
+from rest_framework import exceptions, permissions
+from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from . import budgets, caching, summary
+from .fastread import values_reader
+from .instrumentation import TimedJSONRenderer
+from .models import Expense, Income
+from .pagination import KeysetPagination
+from .serializers import ExpenseSerializer, IncomeSerializer
+from .views import date_range, expense_summary_data, filter_by_date, income_summary_data
+
+
+def in_own_connection(func):
+    def run():
+        try:
+            return func()
+        finally:
+            # worker threads outlive the request: give back what CONN_MAX_AGE says to
+            close_old_connections()
+    return run
+
+
+async def run_queries(*funcs):
+    """
+    Results of independent, synchronous query functions. With
+    EXPENSES_ASYNC_PARALLEL_QUERIES each runs on its own thread and database
+    connection at the same time; otherwise they run one after another on the
+    thread Django's async ORM uses, which is all SQLite can do anyway.
+    """
+    if getattr(settings, 'EXPENSES_ASYNC_PARALLEL_QUERIES', False):
+        return await asyncio.gather(*(
+            sync_to_async(in_own_connection(func), thread_sensitive=False)() for func in funcs
+        ))
+    return [await sync_to_async(func)() for func in funcs]
+
+
+class AsyncAPIView(View):
+    """
+    Read-only JSON view with DRF's authentication and permission checks,
+    the per-user response cache (``cache_responses``) and the same
+    ETag handling as ``caching.ConditionalGetMixin``.
+    Handlers return data to render or an ``HttpResponse``.
+    """
+    authentication_classes = api_settings.DEFAULT_AUTHENTICATION_CLASSES
+    permission_classes = [permissions.IsAuthenticated]
+    renderer = TimedJSONRenderer()
+    cache_responses = False
+    http_method_names = ['get', 'head', 'options']
+
+    def render(self, data, status=200):
+        return HttpResponse(self.renderer.render(data), status=status, content_type=self.renderer.media_type)
+
+    def check_permissions(self, request):
+        for permission in (permission() for permission in self.permission_classes):
+            if not permission.has_permission(request, self):
+                if request.authenticators and not request.successful_authenticator:
+                    raise exceptions.NotAuthenticated()
+                raise exceptions.PermissionDenied(getattr(permission, 'message', None))
+
+    def handle_exception(self, request, exc):
+        response = self.render({'detail': exc.detail}, status=exc.status_code)
+        if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+            header = request.authenticators[0].authenticate_header(request) if request.authenticators else None
+            if header:
+                response['WWW-Authenticate'] = header
+            else:
+                response.status_code = 403
+        return response
+
+    async def dispatch(self, request, *args, **kwargs):
+        method = request.method.lower()
+        handler = getattr(self, method, None) if method in self.http_method_names else None
+        if handler is None:
+            return await self.http_method_not_allowed(request, *args, **kwargs)
+        if method == 'options':
+            return await self.options(request, *args, **kwargs)
+
+        request = Request(request, authenticators=[auth() for auth in self.authentication_classes])
+        self.request = request
+        try:
+            # authenticators may hit the database (tokens, sessions)
+            await sync_to_async(self.check_permissions)(request)
+        except exceptions.APIException as exc:
+            return self.handle_exception(request, exc)
+
+        cache = caching.get_cache()
+        version = await sync_to_async(caching.get_version)(request.user.pk)
+        headers = caching.conditional_headers(request, version, self.renderer.format)
+        response = get_conditional_response(request, etag=headers['ETag'])
+
+        if response is None and self.cache_responses:
+            key = caching.response_key(request, version)
+            data = await cache.aget(key)
+            caching.record(type(self).__qualname__, hit=data is not None)
+            if data is not None:
+                response = self.render(data)
+                response['X-Cache'] = 'HIT'
+
+        if response is None:
+            result = await handler(request, *args, **kwargs)
+            response = result if isinstance(result, HttpResponse) else self.render(result)
+            if self.cache_responses:
+                if response.status_code == 200:
+                    await cache.aset(key, result, getattr(settings, 'EXPENSES_CACHE_TIMEOUT', 300))
+                response['X-Cache'] = 'MISS'
+
+        if response.status_code in (200, 304):
+            for name, value in headers.items():
+                response[name] = value
+        return response
+
+
+class AsyncTransactionListView(AsyncAPIView):
+    """``list`` of a transaction viewset, read through the values reader."""
+    model = None
+    serializer_class = None
+
+    async def get(self, request):
+        reader = values_reader(self.serializer_class)
+        queryset = filter_by_date(self.model.objects.filter(user=request.user), request.query_params).order_by("-date", "-id")
+
+        paginator = KeysetPagination()
+        try:
+            page = await sync_to_async(paginator.paginate_queryset)(
+                queryset.values_list(*reader.lookups, named=True), request, self,
+            )
+        except exceptions.NotFound as exc:
+            return self.handle_exception(request, exc)
+        if page is not None:
+            return paginator.get_paginated_response(reader.rows(page)).data
+        return reader.rows([row async for row in queryset.values_list(*reader.lookups)])
+
+
+class AsyncExpenseListView(AsyncTransactionListView):
+    model = Expense
+    serializer_class = ExpenseSerializer
+
+
+class AsyncIncomeListView(AsyncTransactionListView):
+    model = Income
+    serializer_class = IncomeSerializer
+
+
+class AsyncSummaryView(AsyncAPIView):
+    cache_responses = True
+
+    async def summarize(self, request):
+        """
+        Both tables' stats: one UNION query, or one query per table run
+        concurrently when parallel queries are enabled.
+        """
+        start, end = date_range(request.query_params)
+        if not getattr(settings, 'EXPENSES_ASYNC_PARALLEL_QUERIES', False):
+            return await sync_to_async(summary.summarize)(request.user, start, end)
+
+        parts = await run_queries(*(
+            lambda source=source: summary.summarize(request.user, start, end, (source,)) for source in summary.SOURCES
+        ))
+        return {kind: stats for part in parts for kind, stats in part.items()}
+
+    async def get(self, request):
+        try:
+            stats = await self.summarize(request)
+        except ValueError as exc:
+            return self.render({'detail': str(exc)}, status=400)
+        return self.summary_data(stats)
+
+
+class AsyncExpenseSummaryView(AsyncSummaryView):
+    summary_data = staticmethod(expense_summary_data)
+
+
+class AsyncIncomeSummaryView(AsyncSummaryView):
+    summary_data = staticmethod(income_summary_data)
+
+
+class AsyncBudgetProgressView(AsyncAPIView):
+    cache_responses = True
+
+    async def get(self, request):
+        try:
+            start, end = budgets.parse_period(request.query_params, now().date())
+            history = budgets.parse_history(request.query_params)
+        except ValueError as exc:
+            return self.render({'detail': str(exc)}, status=400)
+
+        # a single query already: nothing to run side by side
+        data = await sync_to_async(budgets.progress)(request.user, start, end, history)
+
+        paginator = LimitOffsetPagination()
+        page = paginator.paginate_queryset(data, request, self)
+        if page is not None:
+            return paginator.get_paginated_response(page).data
+        return data
@@ -0,0 +1,142 @@
+"""
+Token authentication without a query per request. DRF's
+TokenAuthentication joins the token and user tables on every call;
+``CachedTokenAuthentication`` keeps recent (token -> user) lookups in an
+in-process LRU for EXPENSES_AUTH_CACHE_TTL seconds. Entries are checked
+against a per-user version counter in the shared cache, bumped when one
+of the user's tokens is deleted or the user row changes (deactivation,
+password change), so revoking access takes effect on the next request.
+
+Tokens older than EXPENSES_TOKEN_TTL are refused; ``rotate()`` replaces a
+user's token with a fresh one, which is what logging in again does once
+the old one has expired.
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.timezone import now
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from .caching import get_cache, record
+
+
+MAX_TOKENS = 4096
+CACHE_TTL = 300
+
+_entries = OrderedDict()
+_lock = threading.Lock()
+
+
+def version_key(user_id):
+    return f'expenses:auth:{user_id}'
+
+
+def version(user_id):
+    cache = get_cache()
+    key = version_key(user_id)
+    current = cache.get(key)
+    if current is None:
+        # reseeded after eviction so it never matches a stale in-process entry
+        cache.add(key, time.time_ns(), timeout=None)
+        current = cache.get(key)
+    return current
+
+
+def invalidate(user_id):
+    """Call after revoking a user's token or changing the user."""
+    cache = get_cache()
+    try:
+        cache.incr(version_key(user_id))
+    except ValueError:
+        cache.set(version_key(user_id), time.time_ns(), timeout=None)
+
+
+def clear():
+    with _lock:
+        _entries.clear()
+
+
+def token_ttl():
+    seconds = getattr(settings, 'EXPENSES_TOKEN_TTL', None)
+    return timedelta(seconds=seconds) if seconds else None
+
+
+def expired(token):
+    ttl = token_ttl()
+    return ttl is not None and token.created + ttl <= now()
+
+
+def rotate(user):
+    """Replace the user's token with a new one and return it."""
+    with transaction.atomic():
+        Token.objects.filter(user=user).delete()
+        return Token.objects.create(user=user)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication whose hits cost one shared-cache read and no query.
+    A miss reads the token's user id, then that user's version, then does
+    DRF's lookup and caches the result; unknown tokens and inactive users
+    are never cached. Expiry is checked on every request.
+    """
+
+    def authenticate_credentials(self, key):
+        entry = self.cached(key)
+        if entry is None:
+            # the version is read before the lookup it is stored with, so a
+            # revocation that bumps it later voids the entry. Reading it
+            # afterwards could pick up the bump of a revocation the lookup
+            # had not seen, and keep the revoked token cached.
+            user_id = Token.objects.filter(key=key).values_list('user_id', flat=True).first()
+            if user_id is None:
+                raise exceptions.AuthenticationFailed('Invalid token.')
+            stamp = version(user_id)
+            try:
+                token = Token.objects.select_related('user').get(key=key)
+            except Token.DoesNotExist:
+                raise exceptions.AuthenticationFailed('Invalid token.')
+            if not token.user.is_active:
+                raise exceptions.AuthenticationFailed('User inactive or deleted.')
+            entry = self.store(key, token, stamp)
+            record('CachedTokenAuthentication', hit=False)
+        else:
+            record('CachedTokenAuthentication', hit=True)
+
+        _, _, user, token = entry
+        if expired(token):
+            raise exceptions.AuthenticationFailed('Token has expired.')
+        # a copy: views may set attributes on request.user
+        return copy.copy(user), token
+
+    def cached(self, key):
+        with _lock:
+            entry = _entries.get(key)
+        if entry is None:
+            return None
+        stored_version, stored_at, user, _ = entry
+        ttl = getattr(settings, 'EXPENSES_AUTH_CACHE_TTL', CACHE_TTL)
+        if time.monotonic() - stored_at > ttl or version(user.pk) != stored_version:
+            with _lock:
+                _entries.pop(key, None)
+            return None
+        with _lock:
+            if key in _entries:
+                _entries.move_to_end(key)
+        return entry
+
+    def store(self, key, token, stamp):
+        entry = (stamp, time.monotonic(), token.user, token)
+        with _lock:
+            _entries[key] = entry
+            _entries.move_to_end(key)
+            while len(_entries) > getattr(settings, 'EXPENSES_AUTH_CACHE_SIZE', MAX_TOKENS):
+                _entries.popitem(last=False)
+        return entry
@@ -0,0 +1,499 @@
+"""
+Micro-benchmarks run by ``manage.py benchmark <suite>``. Each suite seeds
+synthetic rows for a scratch user inside a transaction that is rolled back
+afterwards, so they can run against any database without leaving data.
+
+``replay()`` is the whole-API counterpart used by ``manage.py
+benchmark_api``: it sends endpoint traffic for users made by
+``manage.py generate_data`` and compares the latencies with a baseline.
+"""
+import asyncio
+import random
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import date, timedelta
+from decimal import Decimal
+from types import SimpleNamespace
+
+from django.contrib.auth.models import User
+from django.db import connection, connections, transaction
+from django.db.models import Q, Sum
+from django.test import AsyncClient, Client
+from django.test.utils import CaptureQueriesContext
+from rest_framework import serializers
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+
+from . import authentication, fastread, recurring, rollups, rules, summary
+from .models import Budget, Category, CategoryRule, Expense, Income, RecurringTransaction
+from .serializers import ExpenseSerializer
+
+
+SUITES = {}
+
+
+def suite(name):
+    def register(func):
+        SUITES[name] = func
+        return func
+    return register
+
+
+class Rollback(Exception):
+    pass
+
+
+@contextmanager
+def scratch():
+    """Run a block inside a transaction that is always rolled back."""
+    try:
+        with transaction.atomic():
+            yield
+            raise Rollback
+    except Rollback:
+        pass
+
+
+def seed(rows, incomes=None, categories=8, seed_value=0):
+    """A scratch user with ``rows`` expenses and ``incomes`` income rows."""
+    rng = random.Random(seed_value)
+    user = User.objects.create_user(f"bench-{time.time_ns()}")
+    expense_categories = Category.objects.bulk_create([
+        Category(user=user, name=f"Expense {i}", transaction_type="EXPENSE") for i in range(categories)
+    ])
+    income_categories = Category.objects.bulk_create([
+        Category(user=user, name=f"Income {i}", transaction_type="INCOME") for i in range(max(1, categories // 4))
+    ])
+    start = date.today() - timedelta(days=3 * 365)
+
+    def build(model, count, pool, scale):
+        return [
+            model(
+                user=user, category=rng.choice(pool), title=f"row {i}",
+                amount=Decimal(rng.lognormvariate(3, 1) * scale).quantize(Decimal("0.01")),
+                date=start + timedelta(days=rng.randrange(3 * 365)),
+            )
+            for i in range(count)
+        ]
+
+    Expense.objects.bulk_create(build(Expense, rows, expense_categories, 1), batch_size=1000)
+    Income.objects.bulk_create(build(Income, rows // 10 if incomes is None else incomes, income_categories, 20), batch_size=1000)
+    return user
+
+
+def measure(func, repeat):
+    """Run ``func`` ``repeat`` times; query count of one run and latency stats in ms."""
+    func()  # warm up
+    with CaptureQueriesContext(connection) as ctx:
+        func()
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000)
+    return {
+        "queries": len(ctx.captured_queries),
+        "mean_ms": statistics.mean(timings),
+        "p50_ms": statistics.median(timings),
+        "max_ms": max(timings),
+    }
+
+
+# --- summary ---------------------------------------------------------------
+
+def legacy_summary_stats(user):
+    # summary_stats as it was before the single-query engine
+    expenses = Expense.objects.filter(user=user)
+    total = expenses.aggregate(Sum('amount'))['amount__sum'] or 0
+    count = expenses.count()
+    list(expenses.values("category__name").annotate(total=Sum("amount")).order_by("-total"))
+    return total, count
+
+
+def legacy_income_summary(user):
+    total_income = Income.objects.filter(user=user).aggregate(Sum('amount'))['amount__sum'] or 0
+    total_expenses = Expense.objects.filter(user=user).aggregate(Sum('amount'))['amount__sum'] or 0
+    return total_income - total_expenses
+
+
+@suite("summary")
+def summary_suite(rows, repeat):
+    """Old multi-query summaries against the single-query summary engine."""
+    user = seed(rows)
+    return {
+        "legacy summary_stats + income summary": measure(
+            lambda: (legacy_summary_stats(user), legacy_income_summary(user)), repeat,
+        ),
+        "summary.summarize (both, plus min/max/median)": measure(lambda: summary.summarize(user), repeat),
+    }
+
+
+# --- writes ----------------------------------------------------------------
+
+class LegacyExpenseSerializer(ExpenseSerializer):
+    # ExpenseSerializer as it was before the category resolver
+    category_name = serializers.ReadOnlyField(source='category.name')
+    category = serializers.PrimaryKeyRelatedField(queryset=Category.objects.all())
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        self.fields['category'].queryset = Category.objects.filter(
+            Q(user=request.user) | Q(user__isnull=True), transaction_type='EXPENSE',
+        )
+
+
+@suite("writes")
+def writes_suite(rows, repeat):
+    """Expense creation through the serializer, one row per request as the API does it."""
+    user = seed(0, incomes=0)
+    request = SimpleNamespace(user=user)
+    pks = list(Category.objects.filter(user=user, transaction_type="EXPENSE").values_list("pk", flat=True))
+    batch = [
+        {"title": f"row {i}", "category": pks[i % len(pks)], "amount": "12.34", "date": date.today().isoformat()}
+        for i in range(min(rows, 200))
+    ]
+
+    def post_all(serializer_class):
+        for row in batch:
+            serializer = serializer_class(data=row, context={"request": request})
+            serializer.is_valid(raise_exception=True)
+            serializer.save(user=user)
+            serializer.data
+
+    results = {}
+    for name, serializer_class in (
+        ("legacy ExpenseSerializer", LegacyExpenseSerializer),
+        ("ExpenseSerializer (category resolver)", ExpenseSerializer),
+    ):
+        result = measure(lambda: post_all(serializer_class), repeat)
+        result["queries_per_row"] = result["queries"] / len(batch)
+        result["rows_per_sec"] = len(batch) / result["mean_ms"] * 1000
+        results[name] = result
+    return results
+
+
+# --- serialization ---------------------------------------------------------
+
+@suite("serialization")
+def serialization_suite(rows, repeat):
+    """Rendering a user's whole expense list through the serializer and through the values reader."""
+    user = seed(rows, incomes=0)
+    request = SimpleNamespace(user=user)
+    queryset = Expense.objects.filter(user=user).order_by("-date", "-id")
+    reader = fastread.values_reader(ExpenseSerializer)
+    renderer = JSONRenderer()
+
+    cases = {
+        "ExpenseSerializer(many=True)": lambda: renderer.render(
+            ExpenseSerializer(queryset.select_related("category"), many=True, context={"request": request}).data
+        ),
+        "fastread.ValuesReader": lambda: renderer.render(reader.rows(queryset.values_list(*reader.lookups))),
+    }
+    results = {}
+    for name, func in cases.items():
+        result = measure(func, repeat)
+        result["rows_per_sec"] = rows / result["mean_ms"] * 1000
+        results[name] = result
+    return results
+
+
+# --- recurring -------------------------------------------------------------
+
+@suite("recurring")
+def recurring_suite(rows, repeat):
+    """
+    One scheduler run over ``rows`` rules spread across users, a day behind
+    (mostly monthly, some weekly and daily). ``repeat`` is unused: a second
+    run has nothing left to write.
+    """
+    rng = random.Random(0)
+    users = [seed(0, incomes=0, categories=2) for _ in range(max(1, rows // 50))]
+    pools = {user.pk: list(Category.objects.filter(user=user, transaction_type="EXPENSE")) for user in users}
+    today = date.today()
+    frequencies = [RecurringTransaction.Frequency.MONTHLY] * 8 + [RecurringTransaction.Frequency.WEEKLY, RecurringTransaction.Frequency.DAILY]
+    rules = []
+    for i in range(rows):
+        user = users[i % len(users)]
+        rule = RecurringTransaction(
+            user=user, transaction_type="EXPENSE", category=rng.choice(pools[user.pk]), title=f"rule {i}",
+            amount=Decimal("9.99"), frequency=rng.choice(frequencies), start_date=today - timedelta(days=1),
+        )
+        recurring.reschedule(rule)
+        rules.append(rule)
+    RecurringTransaction.objects.bulk_create(rules, batch_size=1000)
+
+    with CaptureQueriesContext(connection) as ctx:
+        stats = recurring.materialize(today)
+    return {
+        "recurring.materialize": {
+            "rules": stats["rules"],
+            "rows": stats["created"],
+            "batches": stats["batches"],
+            "queries": len(ctx.captured_queries),
+            "elapsed_s": stats["elapsed"],
+            "rules_per_sec": stats["rules"] / stats["elapsed"],
+        },
+    }
+
+
+# --- categorize ------------------------------------------------------------
+
+MERCHANT_WORDS = (
+    "coffee", "market", "grill", "pharmacy", "fuel", "books", "cinema", "bakery", "garden", "hardware",
+    "taxi", "hotel", "airline", "pizza", "sushi", "gym", "insurance", "telecom", "electric", "water",
+)
+
+
+def naive_match(compiled, title, amount):
+    # one search per rule, in priority order: what the matcher replaces
+    for pattern, category_id, low, high in compiled:
+        if low is not None and amount < low or high is not None and amount > high:
+            continue
+        if pattern.search(title):
+            return category_id
+    return None
+
+
+@suite("categorize")
+def categorize_suite(rows, repeat):
+    """
+    500 rules (keywords, regexes, amount ranges) over ``rows`` synthetic
+    statement titles, one rule at a time against the compiled Matcher,
+    then ``rules.recategorize`` over a user's whole history.
+    """
+    rng = random.Random(0)
+    merchants = [f"{rng.choice(MERCHANT_WORDS)} {rng.choice(MERCHANT_WORDS)} {i}" for i in range(400)]
+    specs = [(CategoryRule.Kind.KEYWORD, name, None, None) for name in merchants]
+    specs += [(CategoryRule.Kind.REGEX, rf"\b{word}\b.*#\d{{3,}}", None, None) for word in MERCHANT_WORDS]
+    specs += [(CategoryRule.Kind.REGEX, rf"^{word}\s+\w+ {i}$", None, None) for i, word in enumerate(MERCHANT_WORDS * 3)]
+    specs += [(CategoryRule.Kind.KEYWORD, word, Decimal(i), Decimal(i + 50)) for i, word in enumerate(MERCHANT_WORDS)]
+    rng.shuffle(specs)
+    rule_rows = [(kind, pattern, i % 8, low, high) for i, (kind, pattern, low, high) in enumerate(specs)]
+    compiled = [(rules.compile_rule(kind, pattern), category_id, low, high) for kind, pattern, category_id, low, high in rule_rows]
+    matcher = rules.Matcher(rule_rows)
+
+    titles = [
+        (f"POS {rng.choice(merchants).upper()} #{rng.randrange(10**5)} {rng.choice(MERCHANT_WORDS)}"
+         if rng.random() < 0.7 else f"card payment {rng.randrange(10**6)}", Decimal(rng.randrange(1, 200)))
+        for _ in range(rows)
+    ]
+    sample = titles[:1000]
+    mismatches = sum(naive_match(compiled, title, amount) != matcher(title, amount) for title, amount in sample)
+
+    results = {}
+    for name, func in (
+        ("per-rule re.search loop", lambda: [naive_match(compiled, title, amount) for title, amount in titles]),
+        ("rules.Matcher", lambda: [matcher(title, amount) for title, amount in titles]),
+    ):
+        result = measure(func, max(1, repeat // 10))
+        result["titles_per_min"] = rows / result["mean_ms"] * 60000
+        results[name] = result
+    results["rules.Matcher"]["mismatches_in_1000"] = mismatches
+
+    user = seed(rows, incomes=0)
+    pks = list(Category.objects.filter(user=user, transaction_type="EXPENSE").values_list("pk", flat=True))
+    CategoryRule.objects.bulk_create([
+        CategoryRule(user=user, kind=kind, pattern=pattern, category_id=pks[category_id], min_amount=low, max_amount=high, priority=i)
+        for i, (kind, pattern, category_id, low, high) in enumerate(rule_rows)
+    ])
+    rules.invalidate(user.pk)
+    Expense.objects.filter(user=user).update(title="POS " + merchants[0].upper())
+    with CaptureQueriesContext(connection) as ctx:
+        stats = rules.recategorize(user, overwrite=True)
+    results["rules.recategorize (overwrite)"] = {
+        "rows": stats["scanned"],
+        "updated": stats["updated"],
+        "queries": len(ctx.captured_queries),
+        "elapsed_s": stats["elapsed"],
+        "rows_per_sec": stats["scanned"] / stats["elapsed"],
+    }
+    return results
+
+
+# --- load test -------------------------------------------------------------
+
+# endpoint -> (sync WSGI path, async ASGI path)
+LOAD_ENDPOINTS = {
+    "expenses": ("/api/expenses/?page_size=100", "/api/async/expenses/?page_size=100"),
+    "summary": ("/api/income/summary/", "/api/async/income/summary/"),
+    "budgets": ("/api/budgets/progress/", "/api/async/budgets/progress/"),
+}
+
+
+def load_stats(timings, errors, elapsed):
+    timings = sorted(timings)
+    return {
+        "requests": len(timings),
+        "errors": errors,
+        "req_per_sec": len(timings) / elapsed if elapsed else 0.0,
+        "p50_ms": statistics.median(timings) if timings else 0.0,
+        "p95_ms": timings[int(len(timings) * 0.95) - 1] if timings else 0.0,
+        "max_ms": timings[-1] if timings else 0.0,
+    }
+
+
+def wsgi_load(path, headers, requests, concurrency):
+    """``requests`` GETs through the WSGI handler from ``concurrency`` threads."""
+    def worker(count):
+        client = Client()
+        timings, errors = [], 0
+        try:
+            for _ in range(count):
+                started = time.perf_counter()
+                response = client.get(path, headers=headers)
+                timings.append((time.perf_counter() - started) * 1000)
+                errors += response.status_code != 200
+        finally:
+            connections.close_all()
+        return timings, errors
+
+    shares = [requests // concurrency + (i < requests % concurrency) for i in range(concurrency)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(worker, shares))
+    elapsed = time.perf_counter() - started
+    return load_stats([t for timings, _ in results for t in timings], sum(e for _, e in results), elapsed)
+
+
+def asgi_load(path, headers, requests, concurrency):
+    """``requests`` GETs through the ASGI handler, ``concurrency`` in flight at once."""
+    async def run():
+        client = AsyncClient()
+        gate = asyncio.Semaphore(concurrency)
+        timings, errors = [], 0
+
+        async def one():
+            nonlocal errors
+            async with gate:
+                started = time.perf_counter()
+                response = await client.get(path, headers=headers)
+                timings.append((time.perf_counter() - started) * 1000)
+                errors += response.status_code != 200
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(requests)))
+        return load_stats(timings, errors, time.perf_counter() - started)
+
+    return asyncio.run(run())
+
+
+def load_test(endpoints, rows, requests, concurrency):
+    """
+    Throughput of the sync views under WSGI against their async versions
+    under ASGI, both driven in-process by Django's test clients. Unlike the
+    suites above the data has to be committed for other threads to see it,
+    so the scratch user is deleted afterwards instead of rolled back.
+    """
+    user = seed(rows)
+    try:
+        rollups.rebuild(user)
+        Budget.objects.bulk_create([
+            Budget(user=user, category=category, amount=Decimal("500.00"))
+            for category in Category.objects.filter(user=user, transaction_type="EXPENSE")
+        ])
+        token = Token.objects.create(user=user)
+        headers = {"authorization": f"Token {token.key}"}
+
+        results = {}
+        for name in endpoints:
+            sync_path, async_path = LOAD_ENDPOINTS[name]
+            results[f"{name} WSGI"] = wsgi_load(sync_path, headers, requests, concurrency)
+            results[f"{name} ASGI"] = asgi_load(async_path, headers, requests, concurrency)
+        return results
+    finally:
+        user.delete()
+
+
+# --- API replay ------------------------------------------------------------
+
+# name -> path; {start}/{end} are filled with a random window per request
+TRAFFIC = {
+    "expenses list": "/api/expenses/?page_size=50",
+    "expenses list, date range": "/api/expenses/?page_size=50&start_date={start}&end_date={end}",
+    "income list": "/api/income/?page_size=50",
+    "expenses summary_stats": "/api/expenses/summary_stats/",
+    "expenses summary_stats, date range": "/api/expenses/summary_stats/?start_date={start}&end_date={end}",
+    "expenses analytics": "/api/expenses/analytics/",
+    "income summary": "/api/income/summary/",
+    "expenses export_csv": "/api/expenses/export_csv/",
+    "ledger": "/api/ledger/?page_size=50",
+    "ledger, date range": "/api/ledger/?page_size=50&start_date={start}&end_date={end}",
+    "search": "/api/search/?q=star",
+    "search, filtered": "/api/search/?q=pizza&min_amount=20&start_date={start}&end_date={end}",
+    "budget progress": "/api/budgets/progress/",
+}
+
+
+def percentiles(timings):
+    if len(timings) < 2:
+        value = timings[0] if timings else 0.0
+        return {"p50_ms": value, "p95_ms": value, "p99_ms": value}
+    cuts = statistics.quantiles(timings, n=100, method="inclusive")
+    return {"p50_ms": cuts[49], "p95_ms": cuts[94], "p99_ms": cuts[98]}
+
+
+def replay(users, names, requests, seed_value=0):
+    """
+    ``requests`` GETs per endpoint in ``names``, spread round-robin over
+    ``users`` and sent with their tokens through the test client, one at
+    a time. Date windows are drawn from a seeded generator, so two runs
+    over the same data send the same requests. Latency percentiles and
+    the mean and max query count per endpoint.
+    """
+    rng = random.Random(seed_value)
+    client = Client()
+    headers = []
+    for user in users:
+        token, _ = Token.objects.get_or_create(user=user)
+        if authentication.expired(token):
+            token = authentication.rotate(user)
+        headers.append({"authorization": f"Token {token.key}"})
+    today = date.today()
+
+    results = {}
+    for name in names:
+        timings, queries, errors = [], [], 0
+        for index in range(requests):
+            start = today - timedelta(days=rng.randrange(30, 3 * 365))
+            path = TRAFFIC[name].format(start=start, end=start + timedelta(days=rng.choice((7, 30, 90, 365))))
+            with CaptureQueriesContext(connection) as ctx:
+                started = time.perf_counter()
+                response = client.get(path, headers=headers[index % len(headers)])
+                if response.streaming:
+                    b"".join(response.streaming_content)
+                timings.append((time.perf_counter() - started) * 1000)
+            queries.append(len(ctx.captured_queries))
+            errors += response.status_code != 200
+        results[name] = {
+            "requests": requests,
+            "errors": errors,
+            **percentiles(timings),
+            "max_ms": max(timings),
+            "queries": statistics.fmean(queries),
+            "max_queries": max(queries),
+        }
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Per endpoint, the change against a baseline run: percent change of each
+    percentile and the query count difference. ``regressed`` is set where
+    p95 grew by more than ``tolerance`` percent or the query count went up.
+    """
+    changes = {}
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        change = {
+            f"{key}_change_%": (result[key] - before[key]) * 100 / before[key] if before[key] else 0.0
+            for key in ("p50_ms", "p95_ms", "p99_ms")
+        }
+        change["queries_change"] = result["queries"] - before["queries"]
+        change["regressed"] = change["p95_ms_change_%"] > tolerance or change["queries_change"] > 0
+        changes[name] = change
+    return changes
@@ -0,0 +1,157 @@
+import calendar
+from collections import defaultdict
+from datetime import date, timedelta
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db import connection
+
+from .models import Budget, Category, Expense
+
+
+CENTS = Decimal('0.01')
+MAX_HISTORY = 60
+
+
+def month_end(day):
+    return day.replace(day=calendar.monthrange(day.year, day.month)[1])
+
+
+def add_months(day, months):
+    index = day.year * 12 + day.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def parse_period(params, today):
+    """
+    (start, end) selected by the query params: ``month=YYYY-MM``,
+    ``quarter=YYYY-Qn``, or ``start_date``/``end_date``; the current month
+    by default. ValueError if malformed.
+    """
+    try:
+        if params.get('month'):
+            year, month = params['month'].split('-')
+            start = date(int(year), int(month), 1)
+            return start, month_end(start)
+        if params.get('quarter'):
+            year, quarter = params['quarter'].upper().split('-Q')
+            if not 1 <= int(quarter) <= 4:
+                raise ValueError(quarter)
+            start = date(int(year), 3 * int(quarter) - 2, 1)
+            return start, month_end(add_months(start, 2))
+        if params.get('start_date') or params.get('end_date'):
+            start = date.fromisoformat(params['start_date'])
+            end = date.fromisoformat(params['end_date'])
+            if start > end:
+                raise ValueError('start_date is after end_date')
+            return start, end
+    except (KeyError, ValueError):
+        raise ValueError('Use month=YYYY-MM, quarter=YYYY-Qn, or both start_date and end_date as YYYY-MM-DD')
+    start = today.replace(day=1)
+    return start, month_end(start)
+
+
+def parse_history(params):
+    try:
+        history = int(params.get('history', 0))
+    except ValueError:
+        history = -1
+    if not 0 <= history <= MAX_HISTORY:
+        raise ValueError(f'history must be a number of months between 0 and {MAX_HISTORY}')
+    return history
+
+
+def period_limit(monthly, start, end):
+    """
+    A monthly budget scaled to [start, end]: whole months count in full,
+    partial months by their share of days.
+    """
+    total = Decimal('0')
+    month = start.replace(day=1)
+    while month <= end:
+        last = month_end(month)
+        days = (min(end, last) - max(start, month)).days + 1
+        total += monthly * days / last.day
+        month = last + timedelta(days=1)
+    return total.quantize(CENTS, rounding=ROUND_HALF_UP)
+
+
+def progress_sql(user_id, start, end, history_start, history_end):
+    """
+    Budgets joined to the user's expense sums per category and month over
+    the period and the history window. Budgets with nothing spent come back
+    once with a NULL month. Amounts are integer cents (exact on SQLite).
+    """
+    qn = connection.ops.quote_name
+    budget, category, expense = (qn(model._meta.db_table) for model in (Budget, Category, Expense))
+    cents = f'CAST(ROUND({expense}.amount * 100) AS INTEGER)'
+    month, month_params = connection.ops.date_trunc_sql('month', f'{expense}.date', ())
+
+    sql = (
+        f"SELECT {budget}.id, {category}.name, CAST(ROUND({budget}.amount * 100) AS INTEGER), spent.month, spent.period_cents, spent.history_cents "
+        f"FROM {budget} "
+        f"INNER JOIN {category} ON {category}.id = {budget}.category_id "
+        f"LEFT JOIN ("
+        f"SELECT {expense}.category_id AS category_id, {month} AS month, "
+        f"SUM(CASE WHEN {expense}.date >= %s AND {expense}.date <= %s THEN {cents} ELSE 0 END) AS period_cents, "
+        f"SUM(CASE WHEN {expense}.date >= %s AND {expense}.date <= %s THEN {cents} ELSE 0 END) AS history_cents "
+        f"FROM {expense} WHERE {expense}.user_id = %s AND {expense}.date >= %s AND {expense}.date <= %s "
+        f"GROUP BY 1, 2"
+        f") AS spent ON spent.category_id = {budget}.category_id "
+        f"WHERE {budget}.user_id = %s "
+        f"ORDER BY {budget}.id"
+    )
+    params = [
+        *month_params, start, end, history_start, history_end, user_id,
+        min(start, history_start), max(end, history_end), user_id,
+    ]
+    return sql, params
+
+
+def row_progress(limit, spent):
+    percent = (spent / limit * 100).quantize(Decimal('0.1'), rounding=ROUND_HALF_UP) if limit > 0 else 0
+    return {
+        'budget_limit': str(limit),
+        'actual_limit': str(spent),
+        'remaining': str(limit - spent),
+        'percent': percent,
+    }
+
+
+def progress(user, start, end, history=0):
+    """
+    Spending against each of the user's budgets over [start, end] in one
+    query, with exact decimals. ``history`` > 0 adds a series of that many
+    months ending with the month of ``end``.
+    """
+    history_end = month_end(end)
+    history_start = add_months(end.replace(day=1), 1 - history) if history else end.replace(day=1)
+
+    sql, params = progress_sql(user.pk, start, end, history_start, history_end)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+
+    budgets = {}
+    by_month = defaultdict(dict)
+    for budget_id, name, amount_cents, month, period_cents, history_cents in rows:
+        budgets.setdefault(budget_id, [name, (Decimal(amount_cents) / 100).quantize(CENTS), 0])
+        if month is not None:
+            budgets[budget_id][2] += period_cents
+            # truncated months come back as 'YYYY-MM-01' strings on SQLite
+            by_month[budget_id][date.fromisoformat(str(month)[:10])] = history_cents
+
+    months = [add_months(history_start, i) for i in range(history)]
+    data = []
+    for budget_id, (name, monthly, cents) in budgets.items():
+        spent = (Decimal(cents) / 100).quantize(CENTS)
+        row = {'id': budget_id, 'category': name, **row_progress(period_limit(monthly, start, end), spent)}
+        if history:
+            row['history'] = [
+                {
+                    'month': month.isoformat(),
+                    **row_progress(monthly, (Decimal(by_month[budget_id].get(month, 0)) / 100).quantize(CENTS)),
+                }
+                for month in months
+            ]
+        data.append(row)
+    return data
@@ -0,0 +1,166 @@
+from django.db import transaction
+from django.utils.timezone import now
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.response import Response
+
+from . import categories, rollups, rules, signals
+from .caching import bump_version
+from .models import Tombstone
+
+
+def valid_id(pk):
+    # JSON true/false arrive as bools, which isinstance(..., int) accepts
+    return type(pk) is int
+
+
+class BulkTransactionMixin:
+    """
+    Adds ``/bulk/`` to a transaction viewset:
+
+    * POST   a list of rows to create them,
+    * PATCH  a list of rows carrying ``id`` to update them,
+    * DELETE ``{"ids": [...]}`` to delete them.
+
+    Categories are validated against one query per batch, writes go through
+    bulk_create / bulk_update / a single DELETE inside one transaction, and
+    invalid rows are reported by index without aborting the rest.
+    """
+    bulk_serializer_class = None
+    transaction_type = None
+    tombstone_kind = None
+    max_bulk_size = 5000
+
+    def get_bulk_context(self):
+        category_ids = set(categories.visible(self.request.user.pk, self.transaction_type))
+        matcher = rules.matcher(self.request.user.pk, self.transaction_type)
+        return {**self.get_serializer_context(), 'category_ids': category_ids, 'matcher': matcher}
+
+    def get_bulk_rows(self, request):
+        rows = request.data
+        if not isinstance(rows, list):
+            return None, Response({'detail': 'Expected a list of rows.'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(rows) > self.max_bulk_size:
+            return None, Response(
+                {'detail': f'At most {self.max_bulk_size} rows per request.'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        return rows, None
+
+    @staticmethod
+    def rollup_row(obj):
+        return (obj.user_id, obj.category_id, obj.date, obj.amount)
+
+    @action(detail=False, methods=['post', 'patch', 'delete'])
+    def bulk(self, request):
+        if request.method == 'POST':
+            return self.bulk_create(request)
+        if request.method == 'PATCH':
+            return self.bulk_update(request)
+        return self.bulk_destroy(request)
+
+    def bulk_create(self, request):
+        rows, error = self.get_bulk_rows(request)
+        if error:
+            return error
+        model = self.bulk_serializer_class.Meta.model
+        context = self.get_bulk_context()
+
+        objs, errors = [], []
+        for index, row in enumerate(rows):
+            serializer = self.bulk_serializer_class(data=row, context=context)
+            if serializer.is_valid():
+                objs.append(model(user=request.user, **serializer.validated_data))
+            else:
+                errors.append({'index': index, 'errors': serializer.errors})
+
+        with transaction.atomic():
+            model.objects.bulk_create(objs, batch_size=500)
+            rollups.apply_rows(self.transaction_type, added=map(self.rollup_row, objs))
+        bump_version(request.user.pk)
+
+        return Response(
+            {'created': [obj.pk for obj in objs], 'errors': errors},
+            status=status.HTTP_201_CREATED if objs or not errors else status.HTTP_400_BAD_REQUEST,
+        )
+
+    def bulk_update(self, request):
+        rows, error = self.get_bulk_rows(request)
+        if error:
+            return error
+        model = self.bulk_serializer_class.Meta.model
+        context = self.get_bulk_context()
+
+        ids = [row.get('id') for row in rows if isinstance(row, dict)]
+        existing = model.objects.filter(user=request.user, id__in=[pk for pk in ids if valid_id(pk)]).in_bulk()
+
+        objs, before, fields, errors = [], [], set(), []
+        seen = set()
+        timestamp = now()
+        for index, row in enumerate(rows):
+            pk = row.get('id') if isinstance(row, dict) else None
+            if pk is not None and not valid_id(pk):
+                errors.append({'index': index, 'errors': {'id': ['Invalid id.']}})
+                continue
+            obj = existing.get(pk)
+            if obj is None:
+                errors.append({'index': index, 'errors': {'id': ['Not found.']}})
+                continue
+            # a second row for the same object would diff against the first one's changes
+            if obj.pk in seen:
+                errors.append({'index': index, 'errors': {'id': ['Repeated in this batch.']}})
+                continue
+            seen.add(obj.pk)
+            serializer = self.bulk_serializer_class(obj, data=row, context=context, partial=True)
+            if not serializer.is_valid():
+                errors.append({'index': index, 'errors': serializer.errors})
+                continue
+            before.append(self.rollup_row(obj))
+            for field, value in serializer.validated_data.items():
+                setattr(obj, field, value)
+                fields.add(field)
+            # bulk_update skips auto_now
+            obj.updated_at = timestamp
+            objs.append(obj)
+
+        if objs and fields:
+            fields.add('updated_at')
+            with transaction.atomic():
+                model.objects.bulk_update(objs, sorted(fields), batch_size=500)
+                rollups.apply_rows(self.transaction_type, added=map(self.rollup_row, objs), removed=before)
+            bump_version(request.user.pk)
+
+        return Response(
+            {'updated': [obj.pk for obj in objs], 'errors': errors},
+            status=status.HTTP_200_OK if objs or not errors else status.HTTP_400_BAD_REQUEST,
+        )
+
+    def bulk_destroy(self, request):
+        ids = request.data.get('ids') if isinstance(request.data, dict) else None
+        if not isinstance(ids, list):
+            return Response({'detail': 'Expected {"ids": [...]}.'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(ids) > self.max_bulk_size:
+            return Response(
+                {'detail': f'At most {self.max_bulk_size} rows per request.'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        model = self.bulk_serializer_class.Meta.model
+
+        with transaction.atomic():
+            queryset = model.objects.filter(user=request.user, id__in=[pk for pk in ids if valid_id(pk)])
+            removed = list(queryset.values_list('id', 'user_id', 'category_id', 'date', 'amount'))
+            with signals.muted():
+                queryset.delete()
+            rollups.apply_rows(self.transaction_type, removed=[row[1:] for row in removed])
+            Tombstone.objects.bulk_create([
+                Tombstone(user=request.user, kind=self.tombstone_kind, object_id=row[0])
+                for row in removed
+            ], batch_size=500)
+        bump_version(request.user.pk)
+
+        deleted = {row[0] for row in removed}
+        errors = [
+            {'id': pk, 'errors': 'Not found.' if valid_id(pk) else 'Invalid id.'}
+            for pk in ids if not valid_id(pk) or pk not in deleted
+        ]
+        return Response({'deleted': sorted(deleted), 'errors': errors})
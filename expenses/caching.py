@@ -0,0 +1,166 @@
+import threading
+import time
+from collections import defaultdict
+from functools import wraps
+from hashlib import sha256
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.cache import get_conditional_response
+from django.utils.timezone import now
+from rest_framework.response import Response
+
+
+_stats = defaultdict(lambda: {'hits': 0, 'misses': 0})
+_stats_lock = threading.Lock()
+
+
+def get_cache():
+    return caches[getattr(settings, 'EXPENSES_CACHE_ALIAS', 'default')]
+
+
+def version_key(user_id):
+    return f'expenses:version:{user_id}'
+
+
+def get_version(user_id):
+    """
+    Current data version of a user: the time of their last write in
+    nanoseconds. Every ETag of their responses is derived from it. A
+    version key lost to eviction comes back as "now", which is always
+    newer than anything stored under the old one.
+    """
+    cache = get_cache()
+    version = cache.get(version_key(user_id))
+    if version is None:
+        version = time.time_ns()
+        if not cache.add(version_key(user_id), version, timeout=None):
+            version = cache.get(version_key(user_id), version)
+    return version
+
+
+def bump_version(user_id):
+    """Invalidate every cached response and ETag of a user; call after any write."""
+    cache = get_cache()
+    current = cache.get(version_key(user_id)) or 0
+    # strictly increasing even if the clock steps back
+    cache.set(version_key(user_id), max(time.time_ns(), current + 1), timeout=None)
+
+
+def bump_versions(user_ids):
+    """``bump_version`` for many users in two cache round trips."""
+    cache = get_cache()
+    keys = [version_key(user_id) for user_id in set(user_ids)]
+    if not keys:
+        return
+    current = cache.get_many(keys)
+    stamp = time.time_ns()
+    cache.set_many({key: max(stamp, (current.get(key) or 0) + 1) for key in keys}, timeout=None)
+
+
+def response_key(request, version):
+    query = urlencode(sorted(request.query_params.lists()), doseq=True)
+    # responses computed relative to today (budget progress) must not outlive it
+    return f'expenses:response:{request.user.pk}:{version}:{now().date()}:{request.path}?{query}'
+
+
+def record(name, hit):
+    with _stats_lock:
+        _stats[name]['hits' if hit else 'misses'] += 1
+
+
+def stats():
+    with _stats_lock:
+        return {name: dict(counts) for name, counts in _stats.items()}
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+def cached_response(view_method):
+    """
+    Cache a read-only view's 200 responses per user and query string. Entries
+    die with the user's data version, or after EXPENSES_CACHE_TIMEOUT seconds.
+    """
+    name = view_method.__qualname__
+
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        cache = get_cache()
+        key = response_key(request, get_version(request.user.pk))
+        data = cache.get(key)
+        if data is not None:
+            record(name, hit=True)
+            response = Response(data)
+            response['X-Cache'] = 'HIT'
+            return response
+
+        record(name, hit=False)
+        response = view_method(self, request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data, getattr(settings, 'EXPENSES_CACHE_TIMEOUT', 300))
+        response['X-Cache'] = 'MISS'
+        return response
+
+    return wrapper
+
+
+def conditional_headers(request, version, renderer_format):
+    """
+    ETag and Cache-Control of a user's GET response, derived from their
+    data version rather than the body. There is no Last-Modified: versions
+    are nanoseconds, and an If-Modified-Since only resolves whole seconds,
+    so a write in the same second as the client's last fetch would be
+    answered with a 304.
+    """
+    fingerprint = '|'.join([
+        str(request.user.pk), str(version), str(now().date()), renderer_format, request.get_full_path(),
+    ])
+    return {
+        'ETag': '"%s"' % sha256(fingerprint.encode()).hexdigest()[:32],
+        # per-user data: keep it out of shared caches, revalidate every time
+        'Cache-Control': 'private, no-cache',
+    }
+
+
+class NotModified(Exception):
+
+    def __init__(self, response):
+        self.response = response
+
+
+class ConditionalGetMixin:
+    """
+    Strong ETag for GET and HEAD, derived from the user's data version
+    instead of the response body. A matching If-None-Match is answered with
+    304 straight after authentication, before the view runs any query or
+    serializer.
+    """
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.conditional_headers = None
+        if request.method not in ('GET', 'HEAD'):
+            return
+
+        version = get_version(request.user.pk)
+        self.conditional_headers = conditional_headers(request, version, request.accepted_renderer.format)
+        not_modified = get_conditional_response(request, etag=self.conditional_headers['ETag'])
+        if not_modified is not None:
+            raise NotModified(not_modified)
+
+    def handle_exception(self, exc):
+        if isinstance(exc, NotModified):
+            return exc.response
+        return super().handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        headers = getattr(self, 'conditional_headers', None)
+        if headers and response.status_code in (200, 304):
+            for name, value in headers.items():
+                response[name] = value
+        return response
@@ -0,0 +1,89 @@
+"""
+In-process cache of the categories each user can pick, so serializers can
+validate category pks and render category names without touching the
+database. Entries are checked against version counters kept in the shared
+Django cache (one per user plus one for the shared categories), which the
+Category signal handlers bump on every write, so all workers notice.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.db.models import Q
+
+from .caching import get_cache
+from .models import Category
+
+
+MAX_USERS = 1024
+SHARED = 'shared'
+
+_entries = OrderedDict()
+_lock = threading.Lock()
+
+
+def version_key(owner):
+    return f'expenses:categories:{owner}'
+
+
+def versions(user_id):
+    """
+    Current (user, shared) category versions. A key lost to eviction or a
+    cache clear is reseeded with the current time, so it never matches a
+    version an in-process entry was stored under.
+    """
+    cache = get_cache()
+    keys = [version_key(user_id), version_key(SHARED)]
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            cache.add(key, time.time_ns(), timeout=None)
+            found[key] = cache.get(key)
+    return tuple(found[key] for key in keys)
+
+
+def invalidate(user_id):
+    """Call after any write to a category owned by ``user_id`` (None = shared)."""
+    key = version_key(SHARED if user_id is None else user_id)
+    cache = get_cache()
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), timeout=None)
+
+
+def visible(user_id, transaction_type):
+    """{pk: name} of the categories of one type the user can attach."""
+    current = versions(user_id)
+    with _lock:
+        entry = _entries.get(user_id)
+        if entry is not None and entry[0] == current:
+            _entries.move_to_end(user_id)
+            return entry[1].get(transaction_type, {})
+
+    by_type = {}
+    rows = Category.objects.filter(Q(user_id=user_id) | Q(user__isnull=True)).values_list('id', 'name', 'transaction_type')
+    for pk, name, kind in rows:
+        by_type.setdefault(kind, {})[pk] = name
+
+    with _lock:
+        _entries[user_id] = (current, by_type)
+        _entries.move_to_end(user_id)
+        while len(_entries) > MAX_USERS:
+            _entries.popitem(last=False)
+    return by_type.get(transaction_type, {})
+
+
+def clear():
+    with _lock:
+        _entries.clear()
+
+
+def stub(pk, name, transaction_type):
+    """
+    Category instance built from the cache. Good for assigning to a foreign
+    key and reading ``name``; it is not a full row (``user`` is unknown).
+    """
+    category = Category(pk=pk, name=name, transaction_type=transaction_type)
+    category._state.adding = False
+    return category
@@ -0,0 +1,58 @@
+import csv
+import heapq
+from operator import itemgetter
+
+from django.http import StreamingHttpResponse
+
+
+CHUNK_SIZE = 2000
+TRANSACTION_COLUMNS = ('date', 'title', 'category__name', 'amount')
+
+
+class Echo:
+    """File-like object whose write() hands the formatted line straight back."""
+
+    def write(self, value):
+        return value
+
+
+def transaction_rows(queryset):
+    # values_list + iterator: no model instances, one chunk in memory at a time
+    rows = queryset.order_by('-date', '-id').values_list(*TRANSACTION_COLUMNS).iterator(chunk_size=CHUNK_SIZE)
+    for day, title, category, amount in rows:
+        yield [day.strftime('%Y-%m-%d'), title, category or 'N/A', str(amount)]
+
+
+def ledger_rows(expenses, incomes):
+    """Expense and Income rows merged newest first, each tagged with its type."""
+    def tagged(rows, kind):
+        for row in rows:
+            yield [row[0], kind] + row[1:]
+
+    return heapq.merge(
+        tagged(transaction_rows(incomes), 'Income'),
+        tagged(transaction_rows(expenses), 'Expense'),
+        key=itemgetter(0),
+        reverse=True,
+    )
+
+
+def csv_response(filename, header, rows):
+    writer = csv.writer(Echo())
+
+    def lines():
+        yield writer.writerow(header)
+        for row in rows:
+            yield writer.writerow(row)
+
+    response = StreamingHttpResponse(lines(), content_type="text/csv")
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
+
+
+def transactions_csv(filename, queryset):
+    return csv_response(filename, ['Date', 'Title', 'Category', 'Amount'], transaction_rows(queryset))
+
+
+def ledger_csv(filename, expenses, incomes):
+    return csv_response(filename, ['Date', 'Type', 'Title', 'Category', 'Amount'], ledger_rows(expenses, incomes))
@@ -0,0 +1,402 @@
+"""
+Per-request performance instrumentation. ``InstrumentationMiddleware``
+counts the SQL queries a request runs and the time they take (through a
+database execute wrapper), collects the time spent in named sections
+(``serialize`` in the viewsets and the values readers, ``render`` in the
+JSON renderer) and the response size, then:
+
+* reports them to the client in a ``Server-Timing`` header,
+* folds them into per-route histograms kept in this process, published to
+  the shared cache every EXPENSES_INSTRUMENTATION_FLUSH seconds so the
+  ``perf_stats`` command can merge every worker's numbers,
+* logs each query slower than EXPENSES_SLOW_QUERY_MS, with its SQL but
+  not its parameters, to the ``expenses.slow_queries`` logger.
+
+Section times exclude the queries run inside them, so ``db``,
+``serialize`` and ``render`` never count the same time twice.
+"""
+import bisect
+import logging
+import os
+import socket
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from rest_framework.renderers import JSONRenderer
+
+from .caching import get_cache
+
+
+slow_query_log = logging.getLogger('expenses.slow_queries')
+
+FLUSH_INTERVAL = 10
+SLOTS_KEY = 'expenses:perf:slots'
+HOST = socket.gethostname()
+
+MS_BOUNDS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+COUNT_BOUNDS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500, 1000)
+BYTE_BOUNDS = (1 << 10, 4 << 10, 16 << 10, 64 << 10, 256 << 10, 1 << 20, 4 << 20, 16 << 20)
+
+# metric -> histogram bucket bounds
+METRICS = {
+    'total_ms': MS_BOUNDS,
+    'db_ms': MS_BOUNDS,
+    'serialize_ms': MS_BOUNDS,
+    'render_ms': MS_BOUNDS,
+    'queries': COUNT_BOUNDS,
+    'bytes': BYTE_BOUNDS,
+}
+SECTIONS = ('serialize', 'render')
+
+_current = ContextVar('expenses_request_metrics', default=None)
+_routes = {}
+_lock = threading.Lock()
+_last_flush = 0.0
+_slot = None
+_slot_pid = None
+
+
+class RequestMetrics:
+
+    def __init__(self):
+        self.queries = 0
+        self.db = 0.0
+        self.sections = dict.fromkeys(SECTIONS, 0.0)
+
+
+@contextmanager
+def section(name):
+    """Add the time spent in the block, less its queries, to the current request's ``name``."""
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+    started, db_before = time.perf_counter(), metrics.db
+    try:
+        yield
+    finally:
+        metrics.sections[name] += time.perf_counter() - started - (metrics.db - db_before)
+
+
+class Histogram:
+    """Counts per bucket of ``bounds`` (upper edges; one more for anything above), plus sum and max."""
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+    def percentile(self, q):
+        """Upper edge of the bucket holding the ``q``-th percentile (the max past the last edge)."""
+        if not self.count:
+            return 0
+        rank, seen = q / 100 * self.count, 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(self.bounds[index], self.max) if index < len(self.bounds) else self.max
+        return self.max
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else 0
+
+
+def new_route():
+    return {metric: Histogram(bounds) for metric, bounds in METRICS.items()}
+
+
+def observe(route, values):
+    with _lock:
+        histograms = _routes.get(route)
+        if histograms is None:
+            histograms = _routes[route] = new_route()
+        for metric, value in values.items():
+            histograms[metric].observe(value)
+
+
+def snapshot():
+    """This process's histograms: {route: {metric: Histogram}}."""
+    with _lock:
+        copy = {route: new_route() for route in _routes}
+        for route, histograms in _routes.items():
+            for metric, histogram in histograms.items():
+                copy[route][metric].merge(histogram)
+    return copy
+
+
+def merge(snapshots):
+    merged = {}
+    for routes in snapshots:
+        for route, histograms in routes.items():
+            target = merged.setdefault(route, new_route())
+            for metric, histogram in histograms.items():
+                target[metric].merge(histogram)
+    return merged
+
+
+def report(routes):
+    """Rows of per-route figures, the routes taking the most time in total first."""
+    rows = []
+    for route, histograms in routes.items():
+        total = histograms['total_ms']
+        rows.append({
+            'route': route,
+            'requests': total.count,
+            'p50_ms': total.percentile(50),
+            'p95_ms': total.percentile(95),
+            'p99_ms': total.percentile(99),
+            'max_ms': total.max,
+            'mean_ms': total.mean,
+            'db_ms': histograms['db_ms'].mean,
+            'queries': histograms['queries'].mean,
+            'max_queries': histograms['queries'].max,
+            'serialize_ms': histograms['serialize_ms'].mean,
+            'render_ms': histograms['render_ms'].mean,
+            'bytes': histograms['bytes'].mean,
+        })
+    return sorted(rows, key=lambda row: row['mean_ms'] * row['requests'], reverse=True)
+
+
+def slot_key(slot):
+    return f'expenses:perf:slot:{slot}'
+
+
+def claim_slot(cache):
+    """
+    This process's slot number. Slots are handed out by an atomic counter,
+    so workers starting together never overwrite each other's registration.
+    """
+    global _slot, _slot_pid
+    if _slot is None or _slot_pid != os.getpid():
+        cache.add(SLOTS_KEY, 0, timeout=None)
+        _slot, _slot_pid = cache.incr(SLOTS_KEY), os.getpid()
+    return _slot
+
+
+def alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def flush():
+    """Publish this process's histograms to the shared cache."""
+    global _last_flush
+    _last_flush = time.monotonic()
+    cache = get_cache()
+    entry = {'pid': os.getpid(), 'host': HOST, 'routes': snapshot()}
+    cache.set(slot_key(claim_slot(cache)), entry, timeout=None)
+
+
+def collected():
+    """
+    Every published process's histograms merged with this one's. Slots of
+    processes on this host that have exited are dropped on the way.
+    """
+    cache = get_cache()
+    own = _slot if _slot_pid == os.getpid() else None
+    keys = [slot_key(slot) for slot in range(1, (cache.get(SLOTS_KEY) or 0) + 1) if slot != own]
+    published, dead = [], []
+    for key, entry in cache.get_many(keys).items():
+        if entry['host'] == HOST and not alive(entry['pid']):
+            dead.append(key)
+        else:
+            published.append(entry['routes'])
+    if dead:
+        cache.delete_many(dead)
+    return merge([*published, snapshot()])
+
+
+def reset():
+    """Drop this process's histograms and every published snapshot."""
+    global _slot
+    cache = get_cache()
+    slots = cache.get(SLOTS_KEY) or 0
+    cache.delete_many([slot_key(slot) for slot in range(1, slots + 1)] + [SLOTS_KEY])
+    _slot = None
+    with _lock:
+        _routes.clear()
+
+
+def route_of(request):
+    match = getattr(request, 'resolver_match', None)
+    return f"{request.method} /{match.route.replace('^', '').replace('$', '')}" if match else f'{request.method} (unmatched)'
+
+
+def server_timing(metrics, total, size):
+    entries = [
+        f'db;dur={metrics.db * 1000:.1f};desc="{metrics.queries} queries"',
+        *(f'{name};dur={metrics.sections[name] * 1000:.1f}' for name in SECTIONS),
+        f'total;dur={total * 1000:.1f}',
+    ]
+    if size is not None:
+        entries.append(f'size;desc="{size} bytes"')
+    return ', '.join(entries)
+
+
+class InstrumentationMiddleware:
+    """
+    Put near the top of MIDDLEWARE; off unless EXPENSES_INSTRUMENTATION is
+    set. Sync and async capable, so under ASGI it does not push the async
+    views onto a thread.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'EXPENSES_INSTRUMENTATION', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        started = time.perf_counter()
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        try:
+            with ExitStack() as stack:
+                self.wrap_connections(stack, self.recorder(request, metrics))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        response = self.finish(request, response, metrics, time.perf_counter() - started)
+        if self.flush_due():
+            flush()
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        # connections belong to a thread: wrap the ones of the thread the
+        # async ORM runs queries on (queries given their own thread by
+        # EXPENSES_ASYNC_PARALLEL_QUERIES are not counted)
+        stack = ExitStack()
+        try:
+            await sync_to_async(self.wrap_connections)(stack, self.recorder(request, metrics))
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+            _current.reset(token)
+        response = self.finish(request, response, metrics, time.perf_counter() - started)
+        if self.flush_due():
+            await sync_to_async(flush)()
+        return response
+
+    @staticmethod
+    def recorder(request, metrics):
+        slow = getattr(settings, 'EXPENSES_SLOW_QUERY_MS', None)
+
+        def record_query(execute, sql, params, many, context):
+            started = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                elapsed = time.perf_counter() - started
+                metrics.queries += 1
+                metrics.db += elapsed
+                if slow is not None and elapsed * 1000 >= slow:
+                    # params hold token keys, passwords and titles; only their count is logged
+                    slow_query_log.warning(
+                        '%.1f ms %s %s: %s; %d params', elapsed * 1000, request.method, request.path, sql, len(params or ()),
+                    )
+
+        return record_query
+
+    @staticmethod
+    def wrap_connections(stack, record_query):
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(record_query))
+
+    def finish(self, request, response, metrics, total):
+        size = None if response.streaming else len(response.content)
+        if getattr(settings, 'EXPENSES_SERVER_TIMING', True):
+            response['Server-Timing'] = server_timing(metrics, total, size)
+        observe(route_of(request), {
+            'total_ms': total * 1000,
+            'db_ms': metrics.db * 1000,
+            'serialize_ms': metrics.sections['serialize'] * 1000,
+            'render_ms': metrics.sections['render'] * 1000,
+            'queries': metrics.queries,
+            **({'bytes': size} if size is not None else {}),
+        })
+        return response
+
+    @staticmethod
+    def flush_due():
+        return time.monotonic() - _last_flush >= getattr(settings, 'EXPENSES_INSTRUMENTATION_FLUSH', FLUSH_INTERVAL)
+
+
+class InstrumentedMixin:
+    """Viewset mixin: times serializer output as the request's ``serialize`` section."""
+
+    def get_serializer_class(self):
+        return timed_serializer(super().get_serializer_class())
+
+
+_timed_classes = {}
+_depth = ContextVar('expenses_serializer_depth', default=0)
+
+
+def timed_serializer(serializer_class):
+    """
+    Subclass of ``serializer_class`` whose outermost ``to_representation``
+    calls are timed; many=True lists call it once per row, nested
+    serializers inside a row are not counted twice.
+    """
+    timed = _timed_classes.get(serializer_class)
+    if timed is not None:
+        return timed
+
+    def to_representation(self, instance):
+        if _depth.get():
+            return super(timed, self).to_representation(instance)
+        token = _depth.set(1)
+        try:
+            with section('serialize'):
+                return super(timed, self).to_representation(instance)
+        finally:
+            _depth.reset(token)
+
+    timed = type(serializer_class.__name__, (serializer_class,), {
+        'to_representation': to_representation, '__module__': serializer_class.__module__,
+    })
+    _timed_classes[serializer_class] = timed
+    return timed
+
+
+class TimedJSONRenderer(JSONRenderer):
+    """JSONRenderer whose work is the request's ``render`` section."""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with section('render'):
+            return super().render(data, accepted_media_type, renderer_context)
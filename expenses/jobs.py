@@ -0,0 +1,319 @@
+"""
+Database-backed background jobs. ``enqueue()`` stores a Job row; the
+``run_jobs`` worker claims due rows, runs their handler (inline or in a
+process pool) and records progress, results and failures on the row. A
+failed attempt is retried with exponential backoff, except for JobError,
+which fails the job at once. Handlers are registered with ``@handler``:
+
+    @handler('kind', validate=check_params)
+    def run_kind(job, progress):
+        progress(done, total)
+        return {...}          # stored as job.result
+"""
+import csv
+import gzip
+import io
+import multiprocessing
+import tempfile
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import date, timedelta
+
+import django
+from django.conf import settings
+from django.core.files import File
+from django.db import close_old_connections, connections, transaction
+from django.db.models import F
+from django.utils.timezone import now
+
+from . import exports, rollups, rules, statements
+from .models import Expense, Income, Job
+
+
+HANDLERS = {}
+
+RETRY_DELAY = 30
+STALE_AFTER = 600
+PROGRESS_INTERVAL = 1.0
+
+
+class JobError(Exception):
+    """A failure retrying cannot fix (bad parameters, missing data)."""
+
+
+def handler(kind, validate=None):
+    def register(func):
+        HANDLERS[kind] = (func, validate)
+        return func
+    return register
+
+
+def validate(kind, params):
+    """ValueError unless ``kind`` is registered and accepts ``params``."""
+    if kind not in HANDLERS:
+        raise ValueError(f"Unknown job kind {kind!r}; expected one of {', '.join(sorted(HANDLERS))}")
+    check = HANDLERS[kind][1]
+    if check is not None:
+        check(params)
+
+
+def enqueue(user, kind, params=None, max_attempts=3, file=None):
+    """
+    Validate ``params`` for ``kind`` and queue a job; ValueError if invalid.
+    ``file`` (e.g. an upload) is stored as the job's input in ``job.file``.
+    """
+    params = params or {}
+    validate(kind, params)
+    job = Job(user=user, kind=kind, params=params, max_attempts=max_attempts)
+    if file is not None:
+        # stored before the row exists, so no worker can claim a job without its file
+        job.file.save(file.name.rsplit('/', 1)[-1], file, save=False)
+    job.save()
+    return job
+
+
+class Progress:
+    """Callable handed to handlers; writes progress at most once a second."""
+
+    def __init__(self, job):
+        self.job = job
+        self.last_write = 0.0
+
+    def __call__(self, done, total, message=''):
+        if time.monotonic() - self.last_write < PROGRESS_INTERVAL:
+            return
+        self.last_write = time.monotonic()
+        percent = min(99, int(done * 100 / total)) if total else 0
+        Job.objects.filter(pk=self.job.pk).update(progress=percent, message=message[:255], heartbeat_at=now())
+
+
+def claim(limit):
+    """Mark up to ``limit`` due jobs running and return their ids."""
+    if limit <= 0:
+        return []
+    with transaction.atomic():
+        ids = list(
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(status=Job.Status.QUEUED, run_after__lte=now())
+            .order_by('run_after', 'id')
+            .values_list('id', flat=True)[:limit]
+        )
+        started = now()
+        Job.objects.filter(pk__in=ids).update(
+            status=Job.Status.RUNNING, attempts=F('attempts') + 1,
+            started_at=started, heartbeat_at=started, progress=0,
+        )
+    return ids
+
+
+def fail(job, error, retry=True):
+    """Record a failed attempt: back to the queue with backoff, or failed for good."""
+    job.error = error
+    job.heartbeat_at = None
+    if retry and job.attempts < job.max_attempts:
+        job.status = Job.Status.QUEUED
+        job.run_after = now() + timedelta(seconds=getattr(settings, 'EXPENSES_JOB_RETRY_DELAY', RETRY_DELAY) * 2 ** (job.attempts - 1))
+    else:
+        job.status = Job.Status.FAILED
+        job.finished_at = now()
+    job.save(update_fields=['error', 'heartbeat_at', 'status', 'run_after', 'finished_at'])
+
+
+def run(job_id):
+    """Run one claimed job to completion or failure. Safe to call in a pool process."""
+    try:
+        job = Job.objects.get(pk=job_id)
+        func, _ = HANDLERS.get(job.kind, (None, None))
+        try:
+            if func is None:
+                raise JobError(f'Unknown job kind: {job.kind}')
+            result = func(job, Progress(job))
+        except JobError as exc:
+            fail(job, str(exc), retry=False)
+        except Exception:
+            fail(job, traceback.format_exc())
+        else:
+            job.status = Job.Status.SUCCEEDED
+            job.progress = 100
+            job.result = result
+            job.error = ''
+            job.finished_at = now()
+            job.save(update_fields=['status', 'progress', 'result', 'error', 'finished_at', 'file'])
+        return job.status
+    finally:
+        close_old_connections()
+
+
+def requeue_stale():
+    """Jobs whose worker stopped reporting count as a failed attempt."""
+    cutoff = now() - timedelta(seconds=getattr(settings, 'EXPENSES_JOB_STALE_AFTER', STALE_AFTER))
+    stale = Job.objects.filter(status=Job.Status.RUNNING, heartbeat_at__lt=cutoff)
+    for job in stale:
+        fail(job, 'Worker stopped responding.')
+    return len(stale)
+
+
+def work(processes=0, once=False, interval=2.0, log=None):
+    """
+    The ``run_jobs`` loop. With ``processes`` > 0 jobs run in a pool of that
+    many processes, otherwise one at a time in this one. ``once`` returns
+    when nothing is due. Returns the number of jobs run.
+    """
+    log = log or (lambda message: None)
+    finished = 0
+    if not processes:
+        while True:
+            requeue_stale()
+            ids = claim(1)
+            if not ids:
+                if once:
+                    return finished
+                close_old_connections()
+                time.sleep(interval)
+                continue
+            log(f'Job #{ids[0]}: {run(ids[0])}')
+            finished += 1
+
+    # children get fresh connections; never share the parent's
+    connections.close_all()
+    pool = ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context('spawn'), initializer=django.setup)
+    running = {}
+    try:
+        while True:
+            requeue_stale()
+            for job_id in claim(processes - len(running)):
+                running[pool.submit(run, job_id)] = job_id
+            if not running:
+                if once:
+                    return finished
+                close_old_connections()
+                time.sleep(interval)
+                continue
+            done, _ = wait(running, timeout=interval, return_when=FIRST_COMPLETED)
+            for future in done:
+                job_id = running.pop(future)
+                try:
+                    log(f'Job #{job_id}: {future.result()}')
+                except Exception:
+                    # the pool process died mid-job
+                    fail(Job.objects.get(pk=job_id), traceback.format_exc())
+                    log(f'Job #{job_id}: crashed')
+                finished += 1
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+# --- handlers --------------------------------------------------------------
+
+EXPORT_SOURCES = ('expenses', 'income', 'ledger')
+
+
+def validate_dates(params):
+    for key in ('start_date', 'end_date'):
+        if params.get(key):
+            try:
+                date.fromisoformat(params[key])
+            except (TypeError, ValueError):
+                raise ValueError(f'{key} must be YYYY-MM-DD')
+
+
+def validate_export(params):
+    if params.get('source') not in EXPORT_SOURCES:
+        raise ValueError(f"source must be one of {', '.join(EXPORT_SOURCES)}")
+    validate_dates(params)
+
+
+def export_rows(job):
+    params = job.params
+    querysets = {}
+    for name, model in (('expenses', Expense), ('income', Income)):
+        queryset = model.objects.filter(user=job.user)
+        if params.get('start_date'):
+            queryset = queryset.filter(date__gte=params['start_date'])
+        if params.get('end_date'):
+            queryset = queryset.filter(date__lte=params['end_date'])
+        querysets[name] = queryset
+
+    if params['source'] == 'ledger':
+        total = querysets['expenses'].count() + querysets['income'].count()
+        header = ['Date', 'Type', 'Title', 'Category', 'Amount']
+        return header, total, exports.ledger_rows(querysets['expenses'], querysets['income'])
+    queryset = querysets[params['source']]
+    return ['Date', 'Title', 'Category', 'Amount'], queryset.count(), exports.transaction_rows(queryset)
+
+
+@handler('export', validate=validate_export)
+def export(job, progress):
+    """The same CSV as the export_csv endpoints, gzipped into ``job.file``."""
+    header, total, rows = export_rows(job)
+    written = 0
+    with tempfile.TemporaryFile() as spool:
+        with gzip.GzipFile(fileobj=spool, mode='wb') as compressed:
+            text = io.TextIOWrapper(compressed, encoding='utf-8', newline='')
+            writer = csv.writer(text)
+            writer.writerow(header)
+            for row in rows:
+                writer.writerow(row)
+                written += 1
+                if written % exports.CHUNK_SIZE == 0:
+                    progress(written, total, f'{written} of {total} rows')
+            text.flush()
+            text.detach()
+        size = spool.tell()
+        spool.seek(0)
+        job.file.save(f"{job.params['source']}-{job.pk}.csv.gz", File(spool), save=False)
+    return {'rows': written, 'bytes': size}
+
+
+@handler('rebuild_rollups')
+def rebuild_rollups(job, progress):
+    """Recompute the user's monthly rollups from their raw rows."""
+    progress(0, 1, 'Rebuilding')
+    rollups.rebuild(job.user, progress=progress)
+    mismatches = rollups.verify(job.user)
+    if mismatches:
+        raise RuntimeError(f'{len(mismatches)} rollup buckets still differ after the rebuild')
+    return {'buckets': job.user.rollups.count()}
+
+
+def validate_import(params):
+    if params.get('format') not in statements.FORMATS:
+        raise ValueError(f"format must be one of {', '.join(statements.FORMATS)}")
+    if params.get('transaction_type') not in (None, *statements.TRANSACTION_TYPES):
+        raise ValueError(f"transaction_type must be one of {', '.join(statements.TRANSACTION_TYPES)}")
+
+
+@handler('import', validate=validate_import)
+def import_statement(job, progress):
+    """Import the statement uploaded as ``job.file``, then drop the upload."""
+    if not job.file:
+        raise JobError('The uploaded statement is missing.')
+    progress(0, 1, 'Importing')
+    try:
+        with job.file.open('rb') as stream:
+            stats = statements.import_statement(
+                job.user, stream, job.params['format'],
+                job.params.get('date_format'), job.params.get('transaction_type'),
+                progress=progress,
+            )
+    except statements.StatementError as exc:
+        raise JobError(str(exc))
+    job.file.delete(save=False)
+    return stats
+
+
+def validate_recategorize(params):
+    if not isinstance(params.get('overwrite', False), bool):
+        raise ValueError('overwrite must be true or false')
+    validate_dates(params)
+
+
+@handler('recategorize', validate=validate_recategorize)
+def recategorize(job, progress):
+    """Run the user's CategoryRules over their existing transactions."""
+    params = job.params
+    return rules.recategorize(
+        job.user, overwrite=params.get('overwrite', False),
+        start_date=params.get('start_date'), end_date=params.get('end_date'), progress=progress,
+    )
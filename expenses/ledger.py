@@ -0,0 +1,147 @@
+"""
+Expense and Income rows merged into one statement, newest first, each
+with the running balance (income minus expenses, all time) after it.
+
+A page is one query. Each table contributes at most a page of rows read
+off its (user, date) index, the two are merged by a UNION ALL, and a
+window SUM over the page adds the balance to the opening balance before
+its oldest row. That opening balance comes from the monthly rollups for
+the months before the oldest row's plus the raw rows of its own month,
+so it is never a scan of the whole history.
+
+Entries are ordered by (date, type, id); ``type`` breaks ties between an
+expense and an income sharing a date and an id.
+"""
+from collections import namedtuple
+from datetime import date
+from decimal import Decimal
+
+from django.db import connection
+
+from .models import Category, Expense, Income, MonthlyRollup
+
+
+CENTS = Decimal('0.01')
+KINDS = {
+    Category.CategoryType.EXPENSE: (Expense, -1),
+    Category.CategoryType.INCOME: (Income, 1),
+}
+
+Entry = namedtuple('Entry', 'kind id date title category category_name amount balance')
+
+
+def money(value):
+    return Decimal(str(round(value, 2))).quantize(CENTS)
+
+
+def as_date(value):
+    return value if isinstance(value, date) else date.fromisoformat(value)
+
+
+def after(kind, boundary, reverse):
+    """
+    WHERE clause (and params) keeping the ``kind`` rows past ``boundary``,
+    a (date, kind, id) key: older ones, or newer when ``reverse``.
+    """
+    day, boundary_kind, pk = boundary
+    past, beyond = ('>', '>=') if reverse else ('<', '<=')
+    if kind == boundary_kind:
+        return f'(date {past} %s OR (date = %s AND id {past} %s))', [day, day, pk]
+    # every row of the other type on the boundary date sorts on one side of it
+    return f'date {beyond if (kind < boundary_kind) != reverse else past} %s', [day]
+
+
+class Ledger:
+
+    def __init__(self, user, start_date=None, end_date=None):
+        self.user = user
+        self.start_date = start_date
+        self.end_date = end_date
+
+    def branch(self, kind, boundary, reverse, limit):
+        model, sign = KINDS[kind]
+        ops = connection.ops
+        conditions, params = ['user_id = %s'], [self.user.pk]
+        if self.start_date:
+            conditions.append('date >= %s')
+            params.append(ops.adapt_datefield_value(self.start_date))
+        if self.end_date:
+            conditions.append('date <= %s')
+            params.append(ops.adapt_datefield_value(self.end_date))
+        if boundary is not None:
+            sql, boundary_params = after(kind, (ops.adapt_datefield_value(boundary[0]), *boundary[1:]), reverse)
+            conditions.append(sql)
+            params.extend(boundary_params)
+        order = 'ASC' if reverse else 'DESC'
+        sql = (
+            f"SELECT * FROM (SELECT %s AS kind, id, date, title, category_id, amount, {'-' if sign < 0 else ''}amount AS signed "
+            f"FROM {ops.quote_name(model._meta.db_table)} WHERE {' AND '.join(conditions)} "
+            f"ORDER BY date {order}, id {order} LIMIT %s) AS {kind.lower()}_rows"
+        )
+        return sql, [kind, *params, limit]
+
+    def opening(self):
+        """Scalar subqueries summing everything before the ``edge`` row."""
+        qn = connection.ops.quote_name
+        month_sql, month_params = connection.ops.date_trunc_sql('month', 'edge.date', ())
+        parts = [(
+            f"SELECT SUM(CASE transaction_type WHEN %s THEN total ELSE -total END) "
+            # the type list lets the (user, type, month) unique index bound the month
+            f"FROM {qn(MonthlyRollup._meta.db_table)} WHERE user_id = %s AND transaction_type IN (%s, %s) AND month < {month_sql}",
+            [Category.CategoryType.INCOME, self.user.pk, *KINDS, *month_params],
+        )]
+        for kind, (model, sign) in KINDS.items():
+            parts.append((
+                f"SELECT SUM({'-' if sign < 0 else ''}amount) FROM {qn(model._meta.db_table)} "
+                f"WHERE user_id = %s AND date >= {month_sql} AND date <= edge.date "
+                f"AND (date < edge.date OR edge.kind > %s OR (edge.kind = %s AND id < edge.id))",
+                [self.user.pk, *month_params, kind, kind],
+            ))
+        return ' + '.join(f'COALESCE(({sql}), 0)' for sql, _ in parts), [p for _, params in parts for p in params]
+
+    def page(self, boundary=None, reverse=False, limit=50):
+        """
+        Up to ``limit`` entries past ``boundary`` (a (date, kind, id) key,
+        None for the newest), newest first whichever way the page was read.
+        """
+        qn = connection.ops.quote_name
+        branches = [self.branch(kind, boundary, reverse, limit) for kind in KINDS]
+        order = 'ASC' if reverse else 'DESC'
+        opening_sql, opening_params = self.opening()
+        sql = f"""
+            WITH page AS (
+                {' UNION ALL '.join(sql for sql, _ in branches)}
+                ORDER BY date {order}, kind {order}, id {order} LIMIT %s
+            ),
+            edge AS (SELECT date, kind, id FROM page ORDER BY date, kind, id LIMIT 1),
+            -- materialized, or the planner may rerun the subqueries for every row
+            opening AS MATERIALIZED (SELECT {opening_sql} AS balance FROM edge)
+            SELECT page.kind, page.id, page.date, page.title, page.category_id, category.name, page.amount,
+                opening.balance + SUM(page.signed) OVER (
+                    ORDER BY page.date, page.kind, page.id ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW
+                )
+            FROM page
+            CROSS JOIN opening
+            LEFT JOIN {qn(Category._meta.db_table)} category ON category.id = page.category_id
+            ORDER BY page.date DESC, page.kind DESC, page.id DESC
+        """
+        params = [p for _, branch_params in branches for p in branch_params] + [limit] + opening_params
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return [
+                Entry(kind, pk, as_date(day), title, category, name, money(amount), money(balance))
+                for kind, pk, day, title, category, name, amount, balance in cursor.fetchall()
+            ]
+
+
+def representation(entry):
+    return {
+        'type': entry.kind,
+        'id': entry.id,
+        'date': entry.date.isoformat(),
+        'title': entry.title,
+        'category': entry.category,
+        'category_name': entry.category_name,
+        'amount': str(entry.amount),
+        'balance': str(entry.balance),
+    }
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from expenses import benchmarks
+
+
+class Command(BaseCommand):
+    help = "Run a micro-benchmark suite on scratch data that is rolled back afterwards."
+
+    def add_arguments(self, parser):
+        parser.add_argument("suite", choices=sorted(benchmarks.SUITES))
+        parser.add_argument("--rows", type=int, default=20000, help="Synthetic expense rows to seed.")
+        parser.add_argument("--repeat", type=int, default=20, help="Timed runs per case.")
+
+    def handle(self, *args, **options):
+        with benchmarks.scratch():
+            results = benchmarks.SUITES[options["suite"]](options["rows"], options["repeat"])
+
+        width = max(len(name) for name in results)
+        for name, result in results.items():
+            metrics = "  ".join(
+                f"{key}={value:.2f}" if isinstance(value, float) else f"{key}={value}"
+                for key, value in result.items()
+            )
+            self.stdout.write(f"{name.ljust(width)}  {metrics}")
@@ -0,0 +1,89 @@
+import json
+import platform
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+from django.test.utils import override_settings
+from django.utils.timezone import now
+
+from expenses import benchmarks, synthetic
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay endpoint traffic through the test client for users made by generate_data and report "
+        "p50/p95/p99 latency and query counts; optionally save them as a baseline or compare with one."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "endpoints", nargs="*",
+            help=f"Endpoints to replay: {', '.join(benchmarks.TRAFFIC)} (default: all).",
+        )
+        parser.add_argument("--prefix", default=synthetic.PREFIX, help="Users named <prefix>-<n>.")
+        parser.add_argument("--users", type=int, default=5, help="How many of them to spread the requests over.")
+        parser.add_argument("--requests", type=int, default=50, help="Requests per endpoint.")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--warm", action="store_true", help="Leave the response cache on.")
+        parser.add_argument("--save", metavar="PATH", help="Write the results to this baseline file.")
+        parser.add_argument("--baseline", metavar="PATH", help="Compare with this baseline file.")
+        parser.add_argument(
+            "--tolerance", type=float, default=10.0,
+            help="With --baseline: fail when an endpoint's p95 grows by more than this percentage, or its query count grows.",
+        )
+
+    def handle(self, *args, **options):
+        names = options["endpoints"] or list(benchmarks.TRAFFIC)
+        unknown = set(names) - set(benchmarks.TRAFFIC)
+        if unknown:
+            raise CommandError(f"Unknown endpoints: {', '.join(sorted(unknown))}")
+        users = list(
+            User.objects.filter(username__startswith=f"{options['prefix']}-")
+            .annotate(rows=Count("expense")).order_by("id")[:options["users"]]
+        )
+        if not users:
+            raise CommandError(f"No {options['prefix']}-* users; run generate_data first.")
+
+        overrides = {"ALLOWED_HOSTS": ["testserver"], "DEBUG": False}
+        if not options["warm"]:
+            overrides["EXPENSES_CACHE_TIMEOUT"] = 0
+        with override_settings(**overrides):
+            results = benchmarks.replay(users, names, options["requests"], options["seed"])
+
+        columns = ("requests", "errors", "p50_ms", "p95_ms", "p99_ms", "max_ms", "queries", "max_queries")
+        changes = {}
+        if options["baseline"]:
+            baseline = json.loads(Path(options["baseline"]).read_text())
+            changes = benchmarks.compare(results, baseline["results"], options["tolerance"])
+
+        width = max(len(name) for name in results)
+        self.stdout.write("  ".join(["endpoint".ljust(width), *(column.rjust(11) for column in columns)]))
+        for name, result in results.items():
+            cells = [f"{result[column]:.1f}" if isinstance(result[column], float) else str(result[column]) for column in columns]
+            line = "  ".join([name.ljust(width), *(cell.rjust(11) for cell in cells)])
+            if name in changes:
+                change = changes[name]
+                line += f"  p95 {change['p95_ms_change_%']:+.0f}%  queries {change['queries_change']:+.1f}"
+                line = self.style.ERROR(line) if change["regressed"] else line
+            self.stdout.write(line)
+
+        if options["save"]:
+            Path(options["save"]).write_text(json.dumps({
+                "created_at": now().isoformat(),
+                "python": platform.python_version(),
+                "database": settings.DATABASES["default"]["ENGINE"],
+                "users": len(users),
+                "rows": sum(user.rows for user in users),
+                "requests": options["requests"],
+                "seed": options["seed"],
+                "warm": options["warm"],
+                "results": results,
+            }, indent=2) + "\n")
+            self.stdout.write(f"Baseline written to {options['save']}.")
+
+        regressed = sorted(name for name, change in changes.items() if change["regressed"])
+        if regressed:
+            raise CommandError(f"Slower than the baseline: {', '.join(regressed)}")
@@ -0,0 +1,37 @@
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+
+from expense_project import database
+
+
+class Command(BaseCommand):
+    help = (
+        "Run concurrent read-then-write transactions and reads against a scratch SQLite file "
+        "configured with a database profile, and fail if any of them hit a lock error."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--profile", choices=database.PROFILES, default="production")
+        parser.add_argument("--writers", type=int, default=8)
+        parser.add_argument("--readers", type=int, default=8)
+        parser.add_argument("--seconds", type=float, default=5.0)
+        parser.add_argument(
+            "--dir", help="Directory for the scratch database (default: a temporary directory). "
+            "Use the directory of the real database to test its filesystem.",
+        )
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory(dir=options["dir"]) as directory:
+            result = database.stress(
+                directory, options["profile"], options["writers"], options["readers"], options["seconds"],
+            )
+
+        self.stdout.write(
+            f"{options['profile']}: {result['writes']} writes ({result['writes_per_sec']:.0f}/s), "
+            f"{result['reads']} reads ({result['reads_per_sec']:.0f}/s)"
+        )
+        for message, count in sorted(result["errors"].items()):
+            self.stdout.write(f"  {count} x {message}")
+        if result["errors"] or not result["consistent"]:
+            raise CommandError("Concurrent access failed: see the errors above.")
@@ -0,0 +1,34 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from expenses import synthetic
+
+
+class Command(BaseCommand):
+    help = (
+        "Create synthetic users with categories, budgets, tokens and a realistic history of expenses "
+        "and income, for load tests and benchmarks. The same --seed and --end-date give the same rows."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=10)
+        parser.add_argument("--rows", type=int, default=100000, help="Expense rows, shared between the users.")
+        parser.add_argument("--years", type=int, default=3, help="How far back the history goes.")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--end-date", type=date.fromisoformat, help="Last day of the history (default: today).")
+        parser.add_argument("--prefix", default=synthetic.PREFIX, help="Usernames are <prefix>-<n>.")
+        parser.add_argument("--chunk-size", type=int, default=synthetic.CHUNK_SIZE)
+        parser.add_argument("--clear", action="store_true", help="Delete the users with this prefix first.")
+
+    def handle(self, *args, **options):
+        if options["clear"]:
+            self.stdout.write(f"Deleted {synthetic.clear(options['prefix'])} users.")
+        stats = synthetic.generate(
+            options["users"], options["rows"], options["years"], options["seed"], options["prefix"],
+            options["end_date"], options["chunk_size"], log=self.stdout.write if options["verbosity"] > 1 else None,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {stats['users']} users, {stats['expenses']} expenses and {stats['income']} income rows "
+            f"in {stats['elapsed']:.1f}s ({stats['rows_per_sec']:.0f} rows/s)."
+        ))
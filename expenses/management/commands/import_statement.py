@@ -0,0 +1,40 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from expenses import statements
+
+
+class Command(BaseCommand):
+    help = "Import a CSV or OFX bank statement for a user, skipping rows that already exist."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--user", required=True, help="Username to import for.")
+        parser.add_argument("--format", choices=statements.FORMATS, help="Default: from the file extension.")
+        parser.add_argument("--date-format", help="strptime format of CSV dates (default: YYYY-MM-DD).")
+        parser.add_argument("--type", choices=statements.TRANSACTION_TYPES, help="File every row as this type instead of by sign.")
+        parser.add_argument("--chunk-size", type=int, default=statements.CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options["user"])
+        except User.DoesNotExist:
+            raise CommandError(f"No user {options['user']!r}")
+
+        try:
+            with open(options["path"], "rb") as stream:
+                stats = statements.import_statement(
+                    user, stream, options["format"] or statements.guess_format(options["path"]),
+                    options["date_format"], options["type"], options["chunk_size"],
+                )
+        except (OSError, statements.StatementError) as exc:
+            raise CommandError(str(exc))
+
+        for error in stats["errors"]:
+            self.stderr.write(f"line {error['line']}: {error['error']}")
+        created = stats["created"]
+        self.stdout.write(self.style.SUCCESS(
+            f"Read {stats['rows']} rows in {stats['elapsed']:.2f}s ({stats['rows_per_sec']:.0f} rows/s): "
+            f"{created['expense']} expenses and {created['income']} income created, "
+            f"{stats['duplicates']} duplicates skipped, {stats['error_count']} errors."
+        ))
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from expenses import benchmarks
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare request throughput of the sync (WSGI) read endpoints against their async (ASGI) "
+        "versions, in-process. Seeds a scratch user that is deleted afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "endpoints", nargs="*",
+            help=f"Endpoints to load: {', '.join(sorted(benchmarks.LOAD_ENDPOINTS))} (default: all).",
+        )
+        parser.add_argument("--rows", type=int, default=20000, help="Synthetic expense rows to seed.")
+        parser.add_argument("--requests", type=int, default=200, help="Requests per endpoint and server type.")
+        parser.add_argument("--concurrency", type=int, default=16, help="Requests in flight at once.")
+        parser.add_argument(
+            "--cold", action="store_true",
+            help="Bypass the response cache so every request reaches the database.",
+        )
+
+    def handle(self, *args, **options):
+        unknown = set(options["endpoints"]) - set(benchmarks.LOAD_ENDPOINTS)
+        if unknown:
+            raise CommandError(f"Unknown endpoints: {', '.join(sorted(unknown))}")
+
+        overrides = {"ALLOWED_HOSTS": ["testserver"], "DEBUG": False}
+        if options["cold"]:
+            overrides["EXPENSES_CACHE_TIMEOUT"] = 0
+        with override_settings(**overrides):
+            results = benchmarks.load_test(
+                options["endpoints"] or sorted(benchmarks.LOAD_ENDPOINTS),
+                options["rows"], options["requests"], options["concurrency"],
+            )
+
+        width = max(len(name) for name in results)
+        for name, result in results.items():
+            metrics = "  ".join(
+                f"{key}={value:.2f}" if isinstance(value, float) else f"{key}={value}"
+                for key, value in result.items()
+            )
+            self.stdout.write(f"{name.ljust(width)}  {metrics}")
@@ -0,0 +1,66 @@
+import json
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.test.utils import override_settings
+
+from expenses import instrumentation
+
+
+COLUMNS = (
+    ("requests", "{:d}"), ("p50_ms", "{:.0f}"), ("p95_ms", "{:.0f}"), ("p99_ms", "{:.0f}"), ("max_ms", "{:.1f}"),
+    ("db_ms", "{:.1f}"), ("queries", "{:.1f}"), ("serialize_ms", "{:.1f}"), ("render_ms", "{:.1f}"), ("bytes", "{:.0f}"),
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Dump the per-route request timings the instrumentation middleware collected in every worker "
+        "(published through the shared cache). --get runs requests in this process first."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--route", help="Only routes containing this text.")
+        parser.add_argument("--json", action="store_true", help="Print JSON instead of a table.")
+        parser.add_argument("--reset", action="store_true", help="Clear the collected timings afterwards.")
+        parser.add_argument("--get", action="append", default=[], metavar="PATH", help="GET this path first (repeatable).")
+        parser.add_argument("--user", help="Username to send the --get requests as.")
+        parser.add_argument("--repeat", type=int, default=20, help="Requests per --get path.")
+
+    def handle(self, *args, **options):
+        if options["get"]:
+            self.run_requests(options["get"], options["user"], options["repeat"])
+
+        rows = instrumentation.report(instrumentation.collected())
+        if options["route"]:
+            rows = [row for row in rows if options["route"] in row["route"]]
+        if options["reset"]:
+            instrumentation.reset()
+
+        if options["json"]:
+            self.stdout.write(json.dumps(rows, indent=2))
+            return
+        if not rows:
+            self.stdout.write("No requests recorded.")
+            return
+        width = max(len(row["route"]) for row in rows)
+        self.stdout.write("  ".join(["route".ljust(width), *(name.rjust(12) for name, _ in COLUMNS)]))
+        for row in rows:
+            self.stdout.write("  ".join([row["route"].ljust(width), *(fmt.format(row[name]).rjust(12) for name, fmt in COLUMNS)]))
+
+    def run_requests(self, paths, username, repeat):
+        if not username:
+            raise CommandError("--get needs --user")
+        try:
+            user = User.objects.get(username=username)
+        except User.DoesNotExist:
+            raise CommandError(f"No user {username!r}")
+        client = Client()
+        client.force_login(user)
+        with override_settings(ALLOWED_HOSTS=["testserver"], DEBUG=False, EXPENSES_INSTRUMENTATION=True):
+            for path in paths:
+                for _ in range(repeat):
+                    response = client.get(path)
+                    if response.status_code >= 400:
+                        raise CommandError(f"GET {path}: {response.status_code}")
@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from expenses import alerts
+
+
+class Command(BaseCommand):
+    help = "Check queued expense buckets against budgets and record threshold alerts."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Drain the queue once and exit.")
+        parser.add_argument("--interval", type=float, default=5.0, help="Seconds to sleep when the queue is empty.")
+        parser.add_argument("--batch-size", type=int, default=alerts.BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        while True:
+            handled = alerts.drain(options["batch_size"])
+            if handled:
+                self.stdout.write(f"Checked {handled} queued budget buckets.")
+            if options["once"]:
+                return
+            close_old_connections()
+            try:
+                time.sleep(options["interval"])
+            except KeyboardInterrupt:
+                return
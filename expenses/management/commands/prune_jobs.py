@@ -0,0 +1,30 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils.timezone import now
+
+from expenses.models import Job
+
+
+class Command(BaseCommand):
+    help = "Delete finished jobs, and their files, older than EXPENSES_JOB_RETENTION_DAYS."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days", type=int,
+            default=getattr(settings, "EXPENSES_JOB_RETENTION_DAYS", 7),
+            help="Keep jobs that finished less than this many days ago.",
+        )
+
+    def handle(self, *args, **options):
+        finished = Job.objects.filter(
+            status__in=[Job.Status.SUCCEEDED, Job.Status.FAILED],
+            finished_at__lt=now() - timedelta(days=options["days"]),
+        )
+        # one by one so the post_delete signal removes each file
+        deleted = 0
+        for job in finished.iterator():
+            job.delete()
+            deleted += 1
+        self.stdout.write(self.style.SUCCESS(f"Pruned {deleted} job(s)."))
@@ -0,0 +1,23 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils.timezone import now
+
+from expenses.models import Tombstone
+
+
+class Command(BaseCommand):
+    help = "Delete sync tombstones older than EXPENSES_TOMBSTONE_RETENTION_DAYS."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days", type=int,
+            default=getattr(settings, "EXPENSES_TOMBSTONE_RETENTION_DAYS", 90),
+            help="Keep tombstones younger than this many days.",
+        )
+
+    def handle(self, *args, **options):
+        cutoff = now() - timedelta(days=options["days"])
+        deleted, _ = Tombstone.objects.filter(deleted_at__lt=cutoff).delete()
+        self.stdout.write(self.style.SUCCESS(f"Pruned {deleted} tombstone(s)."))
@@ -0,0 +1,38 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from expenses import rollups
+
+
+class Command(BaseCommand):
+    help = "Rebuild the monthly rollup table from the raw Expense/Income rows, or verify it with --verify."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", help="Only process this username.")
+        parser.add_argument(
+            "--verify", action="store_true",
+            help="Compare the rollups against the raw tables without changing anything.",
+        )
+
+    def handle(self, *args, **options):
+        user = None
+        if options["user"]:
+            try:
+                user = User.objects.get(username=options["user"])
+            except User.DoesNotExist:
+                raise CommandError(f"No such user: {options['user']}")
+
+        if options["verify"]:
+            mismatches = rollups.verify(user)
+            for (user_id, category_id, month, transaction_type), (expected, actual) in sorted(mismatches.items(), key=str):
+                self.stdout.write(
+                    f"user={user_id} category={category_id} month={month:%Y-%m} {transaction_type}: "
+                    f"expected {expected}, stored {actual}"
+                )
+            if mismatches:
+                raise CommandError(f"{len(mismatches)} rollup bucket(s) out of date")
+            self.stdout.write(self.style.SUCCESS("Rollups match the raw tables."))
+            return
+
+        count = rollups.rebuild(user)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {count} rollup bucket(s)."))
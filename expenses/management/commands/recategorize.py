@@ -0,0 +1,32 @@
+from datetime import date
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from expenses import rules
+
+
+class Command(BaseCommand):
+    help = "Run a user's category rules over their existing expenses and income."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", required=True, help="Username to recategorise.")
+        parser.add_argument("--overwrite", action="store_true", help="Also recategorise rows that already have a category.")
+        parser.add_argument("--start-date", type=date.fromisoformat, help="YYYY-MM-DD")
+        parser.add_argument("--end-date", type=date.fromisoformat, help="YYYY-MM-DD")
+        parser.add_argument("--chunk-size", type=int, default=rules.CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options["user"])
+        except User.DoesNotExist:
+            raise CommandError(f"No user {options['user']!r}")
+
+        stats = rules.recategorize(
+            user, options["overwrite"], options["start_date"], options["end_date"], options["chunk_size"],
+        )
+        rate = stats["scanned"] / stats["elapsed"] if stats["elapsed"] else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Scanned {stats['scanned']} rows in {stats['elapsed']:.2f}s ({rate:.0f} rows/s), "
+            f"{stats['updated']} recategorised."
+        ))
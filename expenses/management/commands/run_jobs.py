@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from expenses import jobs
+
+
+class Command(BaseCommand):
+    help = "Run queued background jobs (exports, rollup rebuilds), retrying failures with backoff."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--processes", type=int, default=2,
+                            help="Jobs to run at once, each in its own process; 0 runs them in this process.")
+        parser.add_argument("--once", action="store_true", help="Run every job that is due and exit.")
+        parser.add_argument("--interval", type=float, default=2.0, help="Seconds to wait when nothing is due.")
+
+    def handle(self, *args, **options):
+        try:
+            finished = jobs.work(options["processes"], options["once"], options["interval"], log=self.stdout.write)
+        except KeyboardInterrupt:
+            return
+        self.stdout.write(f"Ran {finished} jobs.")
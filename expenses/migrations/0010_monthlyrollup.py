@@ -0,0 +1,53 @@
+# Generated by Django 6.0 on 2026-10-18 20:29
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncMonth
+
+
+def populate_rollups(apps, schema_editor):
+    MonthlyRollup = apps.get_model('expenses', 'MonthlyRollup')
+    for transaction_type, model_name in (('EXPENSE', 'Expense'), ('INCOME', 'Income')):
+        model = apps.get_model('expenses', model_name)
+        rows = (
+            model.objects.annotate(bucket=TruncMonth('date'))
+            .values_list('user_id', 'category_id', 'bucket')
+            .annotate(total=Sum('amount'), count=Count('id'))
+            .order_by()
+        )
+        MonthlyRollup.objects.bulk_create([
+            MonthlyRollup(
+                user_id=user_id, category_id=category_id, month=month,
+                transaction_type=transaction_type, total=total, count=count,
+            )
+            for user_id, category_id, month, total, count in rows
+        ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0009_transaction_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('transaction_type', models.CharField(choices=[('INCOME', 'Income'), ('EXPENSE', 'Expense')], max_length=20)),
+                ('month', models.DateField()),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='expenses.category')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'transaction_type', 'month', 'category'), name='rollup_unique'), models.UniqueConstraint(condition=models.Q(('category__isnull', True)), fields=('user', 'transaction_type', 'month'), name='rollup_unique_uncategorised')],
+            },
+        ),
+        migrations.RunPython(populate_rollups, migrations.RunPython.noop),
+    ]
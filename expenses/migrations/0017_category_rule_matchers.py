@@ -0,0 +1,28 @@
+# Generated by Django 6.0 on 2026-10-18 21:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0016_category_rules'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='categoryrule',
+            name='kind',
+            field=models.CharField(choices=[('keyword', 'Keyword'), ('regex', 'Regular expression')], default='keyword', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='categoryrule',
+            name='max_amount',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='categoryrule',
+            name='min_amount',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 6.0 on 2026-10-18 22:41
+
+from django.db import migrations
+
+
+TABLES = ('expenses_expense', 'expenses_income')
+
+
+def create_search_tables(apps, schema_editor):
+    # FTS5 is SQLite's; elsewhere expenses.search falls back to LIKE filters
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for table in TABLES:
+        search = f'{table}_search'
+        for sql in (
+            # user_id is indexed too, so "user_id : N AND ..." intersects posting lists
+            f"CREATE VIRTUAL TABLE {search} USING fts5("
+            f"title, user_id, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')",
+            f"INSERT INTO {search} (rowid, title, user_id) SELECT id, title, user_id FROM {table}",
+            f"CREATE TRIGGER {search}_insert AFTER INSERT ON {table} BEGIN "
+            f"INSERT INTO {search} (rowid, title, user_id) VALUES (new.id, new.title, new.user_id); END",
+            f"CREATE TRIGGER {search}_delete AFTER DELETE ON {table} BEGIN "
+            f"DELETE FROM {search} WHERE rowid = old.id; END",
+            f"CREATE TRIGGER {search}_update AFTER UPDATE OF title, user_id ON {table} BEGIN "
+            f"DELETE FROM {search} WHERE rowid = old.id; "
+            f"INSERT INTO {search} (rowid, title, user_id) VALUES (new.id, new.title, new.user_id); END",
+        ):
+            schema_editor.execute(sql)
+
+
+def drop_search_tables(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for table in TABLES:
+        search = f'{table}_search'
+        for trigger in ('insert', 'delete', 'update'):
+            schema_editor.execute(f'DROP TRIGGER IF EXISTS {search}_{trigger}')
+        schema_editor.execute(f'DROP TABLE IF EXISTS {search}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0017_category_rule_matchers'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_tables, drop_search_tables),
+    ]
@@ -13,6 +13,7 @@ class Category(models.Model):
     name = models.CharField(max_length=50)
     transaction_type = models.CharField(max_length=20, choices=CategoryType.choices)
     created_at = models.DateTimeField(default=timezone.now, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         unique_together = ('user', 'name', 'transaction_type')
@@ -22,25 +23,38 @@ class Category(models.Model):
         return self.name
 
 class Transactions(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    # user_id lookups are served by the composite indexes below, so the
+    # plain FK index would only add write cost.
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
     category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True)
     title = models.CharField(max_length=255)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     date = models.DateField()
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         abstract = True
+        indexes = [
+            # list / date-range filters ordered by -date, -id
+            models.Index(fields=['user', 'date'], name='%(class)s_user_date_idx'),
+            # per-category sums; amount makes them index-only scans
+            models.Index(fields=['user', 'category', 'date', 'amount'], name='%(class)s_user_cat_date_amt_idx'),
+            # min/max/median walk amounts in order
+            models.Index(fields=['user', 'amount'], name='%(class)s_user_amount_idx'),
+            # delta sync: rows changed since a watermark
+            models.Index(fields=['user', 'updated_at'], name='%(class)s_user_updated_idx'),
+        ]
 
 
 # Create your models here.
 class Expense(Transactions):
-    class Meta:
+    class Meta(Transactions.Meta):
         verbose_name_plural = 'expenses'
     
 
 
 class Income(Transactions):
-    class Meta:
+    class Meta(Transactions.Meta):
         verbose_name_plural = 'incomes'
 
 
@@ -49,9 +63,231 @@ class Budget(models.Model):
     category = models.ForeignKey("category",on_delete=models.CASCADE,related_name="budgets")
     amount = models.DecimalField(max_digits=10,decimal_places=2)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         unique_together = (("user", "category",),)
 
     def __str__(self):
-        return f"{self.user} - {self.category} (Monthly)"
\ No newline at end of file
+        return f"{self.user} - {self.category} (Monthly)"
+
+
+class MonthlyRollup(models.Model):
+    """
+    Running per-month totals of Expense/Income rows, keyed by
+    (user, category, month, transaction_type). Kept in step with the raw
+    tables by the handlers in expenses/signals.py; rebuild or verify with
+    ``manage.py rebuild_rollups``.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="rollups")
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, null=True, blank=True, related_name="+")
+    transaction_type = models.CharField(max_length=20, choices=Category.CategoryType.choices)
+    month = models.DateField()
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'transaction_type', 'month', 'category'], name='rollup_unique'),
+            # NULLs never collide in a unique index, so uncategorised rows need their own
+            models.UniqueConstraint(
+                fields=['user', 'transaction_type', 'month'],
+                condition=models.Q(category__isnull=True),
+                name='rollup_unique_uncategorised',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.user} - {self.category} {self.month:%Y-%m} {self.transaction_type}"
+
+
+class Tombstone(models.Model):
+    """
+    Marker left behind when an Expense, Income, Category or Budget is
+    deleted, so /api/sync/ can tell clients what to drop. ``user`` is null
+    for shared categories. Pruned by ``manage.py prune_tombstones``.
+    """
+    class Kind(TextChoices):
+        EXPENSE = 'expense', 'Expense'
+        INCOME = 'income', 'Income'
+        CATEGORY = 'category', 'Category'
+        BUDGET = 'budget', 'Budget'
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name="+")
+    kind = models.CharField(max_length=20, choices=Kind.choices)
+    object_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'deleted_at'], name='tombstone_user_deleted_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} #{self.object_id} deleted {self.deleted_at:%Y-%m-%d %H:%M}"
+
+
+class BudgetAlert(models.Model):
+    """
+    A budget's spending for ``month`` reached ``threshold`` percent of its
+    limit. Written by the alert worker (``manage.py process_alerts``), at
+    most once per budget, month and threshold.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="budget_alerts")
+    budget = models.ForeignKey(Budget, on_delete=models.CASCADE, related_name="alerts")
+    month = models.DateField()
+    threshold = models.PositiveSmallIntegerField()
+    spent = models.DecimalField(max_digits=14, decimal_places=2)
+    limit = models.DecimalField(max_digits=10, decimal_places=2)
+    created_at = models.DateTimeField(default=timezone.now)
+    read_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['budget', 'month', 'threshold'], name='budget_alert_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'created_at'], name='budget_alert_user_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.budget} {self.month:%Y-%m} reached {self.threshold}%"
+
+
+class AlertEvent(models.Model):
+    """
+    Queue of (user, category, month) expense buckets whose spending went up
+    and still need checking against budgets. Enqueued on the write path,
+    one row per bucket however many writes hit it, and drained by
+    ``manage.py process_alerts``.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name="+")
+    month = models.DateField()
+    enqueued_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'category', 'month'], name='alert_event_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['enqueued_at'], name='alert_event_enqueued_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user} - {self.category} {self.month:%Y-%m}"
+
+
+class Job(models.Model):
+    """
+    A unit of background work (exports, recomputations) run by
+    ``manage.py run_jobs``; handlers are registered in expenses/jobs.py.
+    Failed attempts are retried with backoff until ``max_attempts``.
+    ``file`` holds the job's input (an uploaded statement) or its output
+    to download (a gzipped CSV export).
+    """
+    class Status(TextChoices):
+        QUEUED = 'queued', 'Queued'
+        RUNNING = 'running', 'Running'
+        SUCCEEDED = 'succeeded', 'Succeeded'
+        FAILED = 'failed', 'Failed'
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="jobs")
+    kind = models.CharField(max_length=50)
+    params = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.QUEUED)
+    progress = models.PositiveSmallIntegerField(default=0)
+    message = models.CharField(max_length=255, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    file = models.FileField(upload_to='jobs/%Y/%m/', blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='job_status_run_after_idx'),
+            models.Index(fields=['user', 'created_at'], name='job_user_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} #{self.pk} ({self.status})"
+
+
+class RecurringTransaction(models.Model):
+    """
+    A rule that ``manage.py materialize_recurring`` turns into Expense or
+    Income rows: every ``interval`` days, weeks, months or years from
+    ``start_date`` until ``end_date`` (inclusive, open-ended if null).
+    Occurrence n falls n intervals after ``start_date``; ``next_index`` is
+    the first one not written yet and ``next_date`` its date, null once the
+    rule has run out. See ``expenses.recurring``.
+    """
+    class Frequency(TextChoices):
+        DAILY = 'daily', 'Daily'
+        WEEKLY = 'weekly', 'Weekly'
+        MONTHLY = 'monthly', 'Monthly'
+        YEARLY = 'yearly', 'Yearly'
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="recurring")
+    transaction_type = models.CharField(max_length=20, choices=Category.CategoryType.choices)
+    category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
+    title = models.CharField(max_length=255)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    frequency = models.CharField(max_length=10, choices=Frequency.choices)
+    interval = models.PositiveSmallIntegerField(default=1)
+    start_date = models.DateField()
+    end_date = models.DateField(null=True, blank=True)
+    active = models.BooleanField(default=True)
+    next_index = models.PositiveIntegerField(default=0)
+    next_date = models.DateField(null=True, blank=True)
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # the scheduler's due scan; paused and finished rules stay out of it
+            models.Index(
+                fields=['next_date', 'id'], name='recurring_due_idx',
+                condition=models.Q(active=True, next_date__isnull=False),
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.title} every {self.interval} {self.frequency} from {self.start_date}"
+
+
+class CategoryRule(models.Model):
+    """
+    Transactions saved without a category, and imported statement rows, are
+    filed under ``category`` when their title contains the keyword
+    ``pattern`` (or matches it as a regular expression; case insensitive
+    either way) and their amount lies in [min_amount, max_amount], where
+    set. Of several matching rules the lowest ``priority`` wins. Rules only
+    apply to transactions of their category's type. See ``expenses.rules``.
+    """
+    class Kind(TextChoices):
+        KEYWORD = 'keyword', 'Keyword'
+        REGEX = 'regex', 'Regular expression'
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="category_rules")
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name="+")
+    kind = models.CharField(max_length=10, choices=Kind.choices, default=Kind.KEYWORD)
+    pattern = models.CharField(max_length=255)
+    min_amount = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    max_amount = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    priority = models.PositiveSmallIntegerField(default=100)
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'priority'], name='category_rule_user_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.pattern!r} -> {self.category}"
@@ -0,0 +1,171 @@
+import base64
+from datetime import date
+
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from .models import Category
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset pagination over (-date, -id).
+
+    Each cursor holds the (date, id) of the row at the page boundary, so a
+    page is always one index range scan no matter how deep the client is,
+    and rows inserted meanwhile never shift or duplicate what follows.
+
+    Pagination is opt-in: list endpoints stay unpaginated unless the client
+    sends ``cursor`` or ``page_size``.
+    """
+    page_size = 50
+    max_page_size = 500
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if self.cursor_query_param not in params and self.page_size_query_param not in params:
+            return None
+
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+
+        reverse = cursor is not None and cursor[0]
+        if reverse:
+            queryset = queryset.order_by('date', 'id')
+        else:
+            queryset = queryset.order_by('-date', '-id')
+
+        if cursor is not None:
+            _, boundary_date, boundary_id = cursor
+            # date bound first so the (user, date) index drives the range scan
+            if reverse:
+                queryset = queryset.filter(date__gte=boundary_date).exclude(date=boundary_date, id__lte=boundary_id)
+            else:
+                queryset = queryset.filter(date__lte=boundary_date).exclude(date=boundary_date, id__gte=boundary_id)
+
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+            has_next, has_previous = cursor is not None, has_more
+        else:
+            has_next, has_previous = has_more, cursor is not None
+
+        self.next_position = None
+        self.previous_position = None
+        if rows and has_next:
+            self.next_position = (rows[-1].date, rows[-1].id)
+        if rows and has_previous:
+            self.previous_position = (rows[0].date, rows[0].id)
+        return rows
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            raw = base64.urlsafe_b64decode(encoded.encode('ascii')).decode('ascii')
+            direction, day, pk = raw.split('|')
+            if direction not in ('n', 'p'):
+                raise ValueError(direction)
+            return direction == 'p', date.fromisoformat(day), int(pk)
+        except (TypeError, ValueError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, reverse, position):
+        raw = '%s|%s|%d' % ('p' if reverse else 'n', position[0].isoformat(), position[1])
+        encoded = base64.urlsafe_b64encode(raw.encode('ascii')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        return self.encode_cursor(False, self.next_position)
+
+    def get_previous_link(self):
+        if self.previous_position is None:
+            return None
+        return self.encode_cursor(True, self.previous_position)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class LedgerPagination(KeysetPagination):
+    """
+    KeysetPagination for ``ledger.Ledger``: a ledger is always paginated,
+    and its cursors also carry the entry type, which orders an expense and
+    an income on the same date.
+    """
+
+    def paginate_queryset(self, ledger, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+
+        reverse = cursor is not None and cursor[0]
+        rows = ledger.page(cursor and cursor[1:], reverse, self.page_size + 1)
+        has_more = len(rows) > self.page_size
+        # rows come back newest first; the extra one is past the far end
+        rows = rows[1:] if reverse and has_more else rows[:self.page_size]
+        if reverse:
+            has_next, has_previous = cursor is not None, has_more
+        else:
+            has_next, has_previous = has_more, cursor is not None
+
+        self.next_position = None
+        self.previous_position = None
+        if rows and has_next:
+            self.next_position = rows[-1].date, rows[-1].kind, rows[-1].id
+        if rows and has_previous:
+            self.previous_position = rows[0].date, rows[0].kind, rows[0].id
+        return rows
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            raw = base64.urlsafe_b64decode(encoded.encode('ascii')).decode('ascii')
+            direction, day, kind, pk = raw.split('|')
+            if direction not in ('n', 'p') or kind not in Category.CategoryType.values:
+                raise ValueError(direction)
+            return direction == 'p', date.fromisoformat(day), kind, int(pk)
+        except (TypeError, ValueError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, reverse, position):
+        raw = '%s|%s|%s|%d' % ('p' if reverse else 'n', position[0].isoformat(), position[1], position[2])
+        encoded = base64.urlsafe_b64encode(raw.encode('ascii')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
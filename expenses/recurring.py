@@ -0,0 +1,148 @@
+"""
+Recurring transactions. A RecurringTransaction's occurrence n falls n
+intervals after its start date; monthly and yearly rules keep the start
+day, clamped to shorter months (a rule on the 31st runs on Feb 28/29).
+
+``materialize()`` writes every due occurrence for all users in batches:
+each batch locks a slice of due rules, bulk-inserts their rows, folds them
+into the rollups and advances the rules in one transaction, so a crashed or
+repeated run never writes an occurrence twice.
+"""
+import calendar
+import math
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import caching, rollups
+from .budgets import add_months
+from .models import RecurringTransaction
+
+
+Frequency = RecurringTransaction.Frequency
+
+BATCH_SIZE = 1000
+# occurrences one rule may write per batch; a rule further behind resumes in the next one
+MAX_CATCH_UP = 366
+
+
+def shift_months(day, months):
+    target = add_months(day, months)
+    return target.replace(day=min(day.day, calendar.monthrange(target.year, target.month)[1]))
+
+
+def occurrence(rule, n):
+    step = rule.interval * n
+    if rule.frequency == Frequency.DAILY:
+        return rule.start_date + timedelta(days=step)
+    if rule.frequency == Frequency.WEEKLY:
+        return rule.start_date + timedelta(weeks=step)
+    return shift_months(rule.start_date, step * (12 if rule.frequency == Frequency.YEARLY else 1))
+
+
+def index_on_or_after(rule, day):
+    """Index of the first occurrence on or after ``day``."""
+    start = rule.start_date
+    if day <= start:
+        return 0
+    if rule.frequency in (Frequency.DAILY, Frequency.WEEKLY):
+        days = rule.interval * (7 if rule.frequency == Frequency.WEEKLY else 1)
+        return math.ceil((day - start).days / days)
+    months = rule.interval * (12 if rule.frequency == Frequency.YEARLY else 1)
+    n = ((day.year - start.year) * 12 + day.month - start.month) // months
+    while occurrence(rule, n) < day:
+        n += 1
+    return n
+
+
+def due_date(rule, n):
+    """Date of occurrence ``n``, or None past the rule's end date."""
+    day = occurrence(rule, n)
+    return day if rule.end_date is None or day <= rule.end_date else None
+
+
+def reschedule(rule, written_through=None):
+    """
+    Point ``next_index``/``next_date`` at the first occurrence after
+    ``written_through``, the last date already written (None for a new
+    rule). Run after any change to the rule's schedule fields.
+    """
+    first = rule.start_date if written_through is None else max(rule.start_date, written_through + timedelta(days=1))
+    rule.next_index = index_on_or_after(rule, first)
+    rule.next_date = due_date(rule, rule.next_index)
+
+
+def written_through(rule):
+    """Date of the last occurrence written for ``rule`` as stored, or None."""
+    return occurrence(rule, rule.next_index - 1) if rule.next_index else None
+
+
+def materialize_batch(today, batch_size=BATCH_SIZE, max_catch_up=MAX_CATCH_UP):
+    """Write the due occurrences of one batch of rules; (rules, rows written)."""
+    rows = {transaction_type: [] for transaction_type in rollups.TRANSACTION_MODELS}
+    with transaction.atomic():
+        rules = list(
+            RecurringTransaction.objects.select_for_update(skip_locked=True)
+            .filter(active=True, next_date__isnull=False, next_date__lte=today)
+            .order_by('next_date', 'id')[:batch_size]
+        )
+        if not rules:
+            return 0, 0
+
+        stamp = timezone.now()
+        advances = []
+        for rule in rules:
+            first = rule.next_index
+            model = rollups.TRANSACTION_MODELS[rule.transaction_type]
+            for _ in range(max_catch_up):
+                rows[rule.transaction_type].append(model(
+                    user_id=rule.user_id, category_id=rule.category_id,
+                    title=rule.title, amount=rule.amount, date=rule.next_date,
+                ))
+                rule.next_index += 1
+                rule.next_date = due_date(rule, rule.next_index)
+                if rule.next_date is None or rule.next_date > today:
+                    break
+            advances.append(rule.next_index - first)
+
+        for transaction_type, objs in rows.items():
+            rollups.TRANSACTION_MODELS[transaction_type].objects.bulk_create(objs, batch_size=500)
+            rollups.apply_rows(transaction_type, added=((obj.user_id, obj.category_id, obj.date, obj.amount) for obj in objs))
+        # one UPDATE per distinct outcome, usually a handful per batch, where
+        # bulk_update would build a CASE arm per rule and field
+        advanced = defaultdict(list)
+        for rule, written in zip(rules, advances):
+            advanced[(written, rule.next_date)].append(rule.pk)
+        for (written, next_date), ids in advanced.items():
+            RecurringTransaction.objects.filter(pk__in=ids).update(
+                next_index=F('next_index') + written, next_date=next_date, updated_at=stamp,
+            )
+
+    caching.bump_versions(rule.user_id for rule in rules)
+    return len(rules), sum(len(objs) for objs in rows.values())
+
+
+def materialize(today=None, batch_size=BATCH_SIZE, seconds=None, max_catch_up=MAX_CATCH_UP):
+    """
+    Write every occurrence due on or before ``today`` (default: the current
+    date), batch after batch, stopping early once ``seconds`` have passed.
+    ``complete`` is False when the time budget ran out first; the next run
+    carries on where this one stopped.
+    """
+    today = today or timezone.localdate()
+    started = time.monotonic()
+    stats = {'rules': 0, 'created': 0, 'batches': 0, 'complete': False}
+    while seconds is None or time.monotonic() - started < seconds:
+        rules, created = materialize_batch(today, batch_size, max_catch_up)
+        if not rules:
+            stats['complete'] = True
+            break
+        stats['rules'] += rules
+        stats['created'] += created
+        stats['batches'] += 1
+    stats['elapsed'] = time.monotonic() - started
+    return stats
@@ -0,0 +1,234 @@
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncMonth
+
+from . import alerts
+from .models import Category, Expense, Income, MonthlyRollup
+
+
+UPSERT_CHUNK = 500
+
+TRANSACTION_MODELS = {
+    Category.CategoryType.EXPENSE: Expense,
+    Category.CategoryType.INCOME: Income,
+}
+
+
+def transaction_type_for(model):
+    for transaction_type, candidate in TRANSACTION_MODELS.items():
+        if issubclass(model, candidate):
+            return transaction_type
+    return None
+
+
+def month_of(day):
+    return day.replace(day=1)
+
+
+def apply_delta(user_id, category_id, day, transaction_type, amount, count, check_alerts=True):
+    """
+    Add ``amount``/``count`` (either may be negative) to one rollup bucket.
+    Expense buckets that went up are queued for the budget alert worker.
+    """
+    if not amount and not count:
+        return
+    key = dict(user_id=user_id, category_id=category_id, month=month_of(day), transaction_type=transaction_type)
+    bucket = MonthlyRollup.objects.filter(**key)
+
+    with transaction.atomic():
+        updated = bucket.update(total=F('total') + amount, count=F('count') + count)
+        if not updated:
+            try:
+                with transaction.atomic():
+                    MonthlyRollup.objects.create(total=amount, count=count, **key)
+            except IntegrityError:
+                # another writer created the bucket first
+                bucket.update(total=F('total') + amount, count=F('count') + count)
+        if count < 0:
+            bucket.filter(count=0).delete()
+        if check_alerts and amount > 0 and transaction_type == Category.CategoryType.EXPENSE:
+            alerts.enqueue([(user_id, category_id, key['month'])])
+
+
+def add_buckets(transaction_type, buckets):
+    """
+    Add {(user_id, category_id, month): (total, count)} with positive counts
+    to their buckets, creating the missing ones: one INSERT ... ON CONFLICT
+    DO UPDATE per chunk rather than an UPDATE, and maybe an INSERT, per
+    bucket.
+    """
+    qn = connection.ops.quote_name
+    table = qn(MonthlyRollup._meta.db_table)
+    columns = ', '.join(qn(column) for column in ('user_id', 'category_id', 'transaction_type', 'month', 'total', 'count'))
+    increment = ', '.join(f'{qn(column)} = {table}.{qn(column)} + excluded.{qn(column)}' for column in ('total', 'count'))
+    # uncategorised buckets are unique through the partial index only
+    targets = (
+        (False, '(user_id, transaction_type, month, category_id)'),
+        (True, '(user_id, transaction_type, month) WHERE category_id IS NULL'),
+    )
+    with connection.cursor() as cursor:
+        for uncategorised, target in targets:
+            rows = [
+                (user_id, category_id, transaction_type, connection.ops.adapt_datefield_value(month),
+                 connection.ops.adapt_decimalfield_value(total), count)
+                for (user_id, category_id, month), (total, count) in buckets.items()
+                if (category_id is None) == uncategorised
+            ]
+            for start in range(0, len(rows), UPSERT_CHUNK):
+                chunk = rows[start:start + UPSERT_CHUNK]
+                values = ', '.join(['(%s, %s, %s, %s, %s, %s)'] * len(chunk))
+                cursor.execute(
+                    f'INSERT INTO {table} ({columns}) VALUES {values} ON CONFLICT {target} DO UPDATE SET {increment}',
+                    [value for row in chunk for value in row],
+                )
+
+
+def update_buckets(transaction_type, buckets):
+    """
+    Add {(user_id, category_id, month): (total, count)} to buckets that
+    exist, dropping the ones left empty: one UPDATE ... FROM a VALUES list
+    per chunk. Counts may be negative, which an upsert cannot take: the
+    inserted row is checked against ``count >= 0`` before the conflict.
+    """
+    if not buckets:
+        return
+    qn = connection.ops.quote_name
+    table = qn(MonthlyRollup._meta.db_table)
+    names = ('user_id', 'category_id', 'month', 'total', 'count')
+    rows = [
+        (user_id, category_id, connection.ops.adapt_datefield_value(month),
+         connection.ops.adapt_decimalfield_value(total), count)
+        for (user_id, category_id, month), (total, count) in buckets.items()
+    ]
+    increment = ', '.join(f'{qn(column)} = {table}.{qn(column)} + delta.{qn(column)}' for column in ('total', 'count'))
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), UPSERT_CHUNK):
+            chunk = rows[start:start + UPSERT_CHUNK]
+            values = ', '.join(['(%s, %s, %s, %s, %s)'] * len(chunk))
+            cursor.execute(
+                f'WITH delta ({", ".join(qn(column) for column in names)}) AS (VALUES {values}) '
+                f'UPDATE {table} SET {increment} FROM delta '
+                f'WHERE {table}.{qn("transaction_type")} = %s AND {table}.{qn("user_id")} = delta.{qn("user_id")} '
+                f'AND {table}.{qn("month")} = delta.{qn("month")} AND {table}.{qn("category_id")} IS delta.{qn("category_id")}',
+                [value for row in chunk for value in row] + [transaction_type],
+            )
+    if any(count < 0 for _, count in buckets.values()):
+        MonthlyRollup.objects.filter(
+            user_id__in={user_id for user_id, _, _ in buckets}, transaction_type=transaction_type, count=0,
+        ).delete()
+
+
+def apply_rows(transaction_type, added=(), removed=()):
+    """
+    Fold iterables of (user_id, category_id, date, amount) rows into the
+    rollups, netted per touched bucket: buckets that gained rows in bulk
+    upserts, the rest one UPDATE each. Used by code paths that bypass the
+    model signals (bulk_create, bulk_update, bulk deletes).
+    """
+    buckets = {}
+    for sign, rows in ((1, added), (-1, removed)):
+        for user_id, category_id, day, amount in rows:
+            key = (user_id, category_id, month_of(day))
+            total, count = buckets.get(key, (Decimal('0'), 0))
+            buckets[key] = (total + sign * amount, count + sign)
+
+    with transaction.atomic():
+        add_buckets(transaction_type, {key: delta for key, delta in buckets.items() if delta[1] > 0})
+        update_buckets(transaction_type, {key: delta for key, delta in buckets.items() if delta[1] <= 0 and any(delta)})
+    if transaction_type == Category.CategoryType.EXPENSE:
+        alerts.enqueue(key for key, (total, _) in buckets.items() if total > 0)
+
+
+def merge_into_uncategorised(category):
+    """Move a category's buckets onto category=None ahead of its SET_NULL."""
+    with transaction.atomic():
+        for rollup in MonthlyRollup.objects.filter(category=category):
+            rollup.delete()
+            apply_delta(rollup.user_id, None, rollup.month, rollup.transaction_type, rollup.total, rollup.count)
+
+
+def raw_totals(user=None, progress=None):
+    """Recompute every bucket from the raw tables: {key: (total, count)}."""
+    totals = {}
+    for step, (transaction_type, model) in enumerate(TRANSACTION_MODELS.items(), 1):
+        queryset = model.objects.all()
+        if user is not None:
+            queryset = queryset.filter(user=user)
+        rows = (
+            queryset.annotate(bucket=TruncMonth('date'))
+            .values_list('user_id', 'category_id', 'bucket')
+            .annotate(total=Sum('amount'), count=Count('id'))
+            .order_by()
+        )
+        for user_id, category_id, month, total, count in rows:
+            totals[(user_id, category_id, month, transaction_type)] = (total, count)
+        if progress:
+            progress(step, len(TRANSACTION_MODELS) + 1, f'{transaction_type.lower()} totals read')
+    return totals
+
+
+def stored_totals(user=None):
+    queryset = MonthlyRollup.objects.all()
+    if user is not None:
+        queryset = queryset.filter(user=user)
+    return {
+        (r.user_id, r.category_id, r.month, r.transaction_type): (r.total, r.count)
+        for r in queryset.filter(count__gt=0)
+    }
+
+
+def rebuild(user=None, progress=None):
+    """
+    Replace the stored rollups (``user``'s, or everyone's) with ones summed
+    from the raw rows. ``progress`` is called after each table is summed and
+    once the new rollups are committed, never inside the transaction, where
+    a heartbeat would not be seen until the end.
+    """
+    totals = raw_totals(user, progress)
+    with transaction.atomic():
+        existing = MonthlyRollup.objects.all()
+        if user is not None:
+            existing = existing.filter(user=user)
+        existing.delete()
+        MonthlyRollup.objects.bulk_create([
+            MonthlyRollup(
+                user_id=user_id, category_id=category_id, month=month,
+                transaction_type=transaction_type, total=total, count=count,
+            )
+            for (user_id, category_id, month, transaction_type), (total, count) in totals.items()
+        ], batch_size=1000)
+    if progress:
+        progress(1, 1, f'{len(totals)} buckets written')
+    return len(totals)
+
+
+def verify(user=None):
+    """Return the buckets whose stored value disagrees with the raw tables."""
+    expected = raw_totals(user)
+    actual = stored_totals(user)
+    return {
+        key: (expected.get(key), actual.get(key))
+        for key in expected.keys() | actual.keys()
+        if expected.get(key) != actual.get(key)
+    }
+
+
+def month_range(start_date=None, end_date=None):
+    """
+    Map a start/end date filter onto whole months, or return None when the
+    range cuts through a month and has to be answered from the raw rows.
+    """
+    try:
+        start = date.fromisoformat(start_date) if start_date else None
+        end = date.fromisoformat(end_date) if end_date else None
+    except (TypeError, ValueError):
+        return None
+    if start is not None and start.day != 1:
+        return None
+    if end is not None and (end + timedelta(days=1)).day != 1:
+        return None
+    return start, end and month_of(end)
+
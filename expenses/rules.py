@@ -0,0 +1,281 @@
+"""
+Automatic categorisation. A user's CategoryRules are compiled, per
+transaction type, into a ``Matcher`` that finds the best rule for a title
+in one regex scan plus a few targeted searches, rather than one search per
+rule:
+
+* keyword rules form a trie rendered as a single regular expression, run
+  as a lookahead at every position of the casefolded title. At a position
+  it matches the longest keyword starting there; every shorter keyword
+  that also starts there is a prefix of it, so each keyword is mapped up
+  front to the best rule among itself and its prefixes;
+* regex rules, and keyword rules with an amount range, are searched one by
+  one in priority order, and only while they could still beat the best
+  keyword. A regex with a literal every match must contain (``#\\d+
+  uber`` has " uber") adds that literal to the trie as well, and is only
+  searched when the scan saw it.
+
+Compiled matchers are cached in-process per user, behind a version counter
+in the shared cache that the CategoryRule signal handlers bump, like the
+category cache in ``categories``.
+"""
+import re
+import threading
+import time
+from collections import OrderedDict
+from itertools import groupby
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import categories, rollups
+from .caching import bump_version, get_cache
+from .models import CategoryRule
+
+
+MAX_USERS = 1024
+CHUNK_SIZE = 5000
+MIN_LITERAL = 3
+
+KEYWORD = CategoryRule.Kind.KEYWORD
+REGEX = CategoryRule.Kind.REGEX
+
+_entries = OrderedDict()
+_lock = threading.Lock()
+
+
+def trie_pattern(words):
+    """Regex source matching any of ``words``, longest first where they share a prefix."""
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = True
+
+    def render(node):
+        branches = [re.escape(char) + render(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+        if '' in node:
+            # greedy: the longer keyword wins, the end of this one is the fallback
+            return f'(?:{body})?' if len(branches) == 1 else f'{body}?'
+        return body
+
+    return render(trie)
+
+
+def required_literal(pattern):
+    """
+    Casefolded ASCII text every match of ``pattern`` contains, or None: the
+    longest run of plain characters at its top level (outside groups,
+    alternations and repeats), if at least MIN_LITERAL long.
+    """
+    best, run = '', ''
+    for op, value in list(sre_parse.parse(pattern)) + [(None, None)]:
+        if op is sre_parse.LITERAL and value < 128:
+            run += chr(value)
+            continue
+        if len(run) > len(best):
+            best = run
+        run = ''
+    return best.casefold() if len(best) >= MIN_LITERAL else None
+
+
+def compile_rule(kind, pattern):
+    return re.compile(re.escape(pattern) if kind == KEYWORD else pattern, re.IGNORECASE)
+
+
+class Matcher:
+    """Best rule for a (title, amount); built from rules in (priority, id) order."""
+
+    def __init__(self, rules):
+        self.categories = []
+        keywords, triggers, self.checked = {}, {}, []
+        for rank, (kind, pattern, category_id, low, high) in enumerate(rules):
+            self.categories.append(category_id)
+            if kind == KEYWORD and low is None and high is None:
+                keywords.setdefault(pattern.casefold(), rank)
+                continue
+            literal = pattern.casefold() if kind == KEYWORD else required_literal(pattern)
+            if literal is not None:
+                triggers.setdefault(literal, []).append(rank)
+            self.checked.append((rank, compile_rule(kind, pattern), low, high, literal is not None))
+
+        # per word of the trie: best keyword rank and checked rules seen, over its prefixes
+        self.words = {}
+        for word in keywords.keys() | triggers.keys():
+            prefixes = [word[:end] for end in range(1, len(word) + 1)]
+            self.words[word] = (
+                min((keywords[prefix] for prefix in prefixes if prefix in keywords), default=len(self.categories)),
+                frozenset(rank for prefix in prefixes for rank in triggers.get(prefix, ())),
+            )
+        self.scan = re.compile(f'(?=({trie_pattern(self.words)}))') if self.words else None
+
+    def rank(self, title, amount=None):
+        best, seen = len(self.categories), set()
+        if self.scan is not None:
+            for match in self.scan.finditer(title.casefold()):
+                rank, triggered = self.words[match.group(1)]
+                best = min(best, rank)
+                seen |= triggered
+        for rank, compiled, low, high, triggered in self.checked:
+            if rank >= best:
+                break
+            if triggered and rank not in seen:
+                continue
+            if low is not None and (amount is None or amount < low):
+                continue
+            if high is not None and (amount is None or amount > high):
+                continue
+            if compiled.search(title):
+                return rank
+        return best
+
+    def __call__(self, title, amount=None):
+        """Category pk of the best matching rule, or None."""
+        rank = self.rank(title, amount)
+        return self.categories[rank] if rank < len(self.categories) else None
+
+
+def version_key(user_id):
+    return f'expenses:category-rules:{user_id}'
+
+
+def version(user_id):
+    cache = get_cache()
+    key = version_key(user_id)
+    current = cache.get(key)
+    if current is None:
+        # reseeded after eviction so it never matches a stale in-process entry
+        cache.add(key, time.time_ns(), timeout=None)
+        current = cache.get(key)
+    return current
+
+
+def invalidate(user_id):
+    """Call after any write to a user's rules."""
+    cache = get_cache()
+    try:
+        cache.incr(version_key(user_id))
+    except ValueError:
+        cache.set(version_key(user_id), time.time_ns(), timeout=None)
+
+
+def build(user_id):
+    rows = (
+        CategoryRule.objects.filter(user_id=user_id)
+        .order_by('category__transaction_type', 'priority', 'id')
+        .values_list('category__transaction_type', 'kind', 'pattern', 'category_id', 'min_amount', 'max_amount')
+    )
+    return {
+        transaction_type: Matcher(rule[1:] for rule in rules)
+        for transaction_type, rules in groupby(rows, key=lambda row: row[0])
+    }
+
+
+def matcher(user_id, transaction_type):
+    """The user's compiled Matcher for one transaction type, or None without rules."""
+    current = version(user_id)
+    with _lock:
+        entry = _entries.get(user_id)
+        if entry is not None and entry[0] == current:
+            _entries.move_to_end(user_id)
+            return entry[1].get(transaction_type)
+
+    matchers = build(user_id)
+    with _lock:
+        _entries[user_id] = (current, matchers)
+        _entries.move_to_end(user_id)
+        while len(_entries) > MAX_USERS:
+            _entries.popitem(last=False)
+    return matchers.get(transaction_type)
+
+
+def clear():
+    with _lock:
+        _entries.clear()
+
+
+def categorize(user_id, transaction_type, title, amount=None):
+    """
+    Category the user's rules give a new transaction, as a stub Category,
+    or None. Rules pointing at a category the user can no longer pick are
+    ignored.
+    """
+    match = matcher(user_id, transaction_type)
+    category_id = match(title, amount) if match is not None else None
+    names = categories.visible(user_id, transaction_type)
+    if category_id not in names:
+        return None
+    return categories.stub(category_id, names[category_id], transaction_type)
+
+
+def recategorize(user, overwrite=False, start_date=None, end_date=None, chunk_size=CHUNK_SIZE, progress=None):
+    """
+    Run the user's rules over their existing transactions: uncategorised
+    ones, or all of them with ``overwrite`` (rows no rule matches keep their
+    category). Walks each table in id order, chunk by chunk, with one
+    UPDATE per new category per chunk and the rollups moved to match.
+    """
+    started = time.monotonic()
+    stats = {'scanned': 0, 'updated': 0}
+    for transaction_type, model in rollups.TRANSACTION_MODELS.items():
+        match = matcher(user.pk, transaction_type)
+        if match is None:
+            continue
+        allowed = set(categories.visible(user.pk, transaction_type))
+        queryset = model.objects.filter(user=user)
+        if not overwrite:
+            queryset = queryset.filter(category__isnull=True)
+        if start_date:
+            queryset = queryset.filter(date__gte=start_date)
+        if end_date:
+            queryset = queryset.filter(date__lte=end_date)
+        total = queryset.count()
+
+        last_id = 0
+        while chunk := list(
+            queryset.filter(id__gt=last_id).order_by('id')
+            .values_list('id', 'title', 'amount', 'category_id', 'date')[:chunk_size]
+        ):
+            last_id = chunk[-1][0]
+            moves = {}
+            for pk, title, amount, old, day in chunk:
+                new = match(title, amount)
+                if new is not None and new != old and new in allowed:
+                    moves[pk] = (old, new, day, amount)
+            stats['scanned'] += len(chunk)
+            if moves:
+                move_rows(user, model, transaction_type, moves)
+                stats['updated'] += len(moves)
+            if progress:
+                progress(stats['scanned'], total, f"{stats['updated']} of {stats['scanned']} rows recategorised")
+
+    if stats['updated']:
+        bump_version(user.pk)
+    stats['elapsed'] = time.monotonic() - started
+    return stats
+
+
+def move_rows(user, model, transaction_type, moves):
+    """Point rows at new categories: {pk: (old category, new category, date, amount)}."""
+    by_category = {}
+    for pk, (_, new, _, _) in moves.items():
+        by_category.setdefault(new, []).append(pk)
+    stamp = timezone.now()
+    with transaction.atomic():
+        for category_id, ids in by_category.items():
+            # updated_at moves so delta sync picks the rows up
+            model.objects.filter(user=user, id__in=ids).update(category_id=category_id, updated_at=stamp)
+        rollups.apply_rows(
+            transaction_type,
+            added=[(user.pk, new, day, amount) for _, new, day, amount in moves.values()],
+            removed=[(user.pk, old, day, amount) for old, _, day, amount in moves.values()],
+        )
@@ -0,0 +1,177 @@
+"""
+Title search over a user's expenses and income. On SQLite each table has
+an FTS5 index, ``<table>_search`` (migration 0018), kept in step by
+triggers, so rows written through raw SQL, bulk inserts or imports are
+searchable as soon as they commit.
+
+Every word of the query is matched as a prefix and all must match. The
+user's id is an indexed column of the FTS table, so the match only walks
+that user's postings, in rowid order: FTS5 stops as soon as it has the
+most recent CANDIDATES matches that pass the filters. Those are ranked
+by how many words match whole rather than as a prefix, then by shorter
+titles, then newest first. That is the order bm25 gives them (its IDF
+term is the same for every row of one query), without bm25's per-query
+document counts, which cost time in proportion to the user's history.
+Other databases get the same filters answered with ``LIKE``.
+
+Ranking only sees those candidates: in a long history an older title
+matching a word whole can lose to CANDIDATES newer prefix matches.
+
+The triggers are raw SQL, so Django's schema editor does not know about
+them. A later migration that makes SQLite remake ``expenses_expense`` or
+``expenses_income`` (altering a column, say) drops them silently, and the
+index stops following writes; such a migration must create them again as
+0018 does. ``check_triggers`` (a database system check, run by
+``check --database default``) and the tests report any that are missing.
+"""
+import re
+
+from django.core import checks
+from django.db import connection, connections
+from django.db.models import Q
+
+from .ledger import KINDS, as_date, money
+from .models import Category
+
+
+WORD = re.compile(r'\w+')
+LIMIT = 50
+CANDIDATES = 500
+MAX_LIMIT = 200
+
+
+def words(text):
+    return WORD.findall(text or '')
+
+
+def trigger_names(table):
+    return [f'{table}_search_{event}' for event in ('insert', 'delete', 'update')]
+
+
+def check_triggers(app_configs=None, databases=None, **kwargs):
+    """Error for each search trigger missing beside an existing search table."""
+    errors = []
+    for alias in databases or ():
+        if connections[alias].vendor != 'sqlite':
+            continue
+        with connections[alias].cursor() as cursor:
+            cursor.execute("SELECT type, name FROM sqlite_master WHERE type IN ('table', 'trigger')")
+            present = set(cursor.fetchall())
+        for model, _ in KINDS.values():
+            table = model._meta.db_table
+            if ('table', f'{table}_search') not in present:
+                continue
+            errors += [
+                checks.Error(
+                    f'Trigger {name} is missing, so {table}_search no longer follows writes to {table}.',
+                    hint='A migration remade the table; create the triggers again as migration 0018 does.',
+                    id='expenses.E001',
+                )
+                for name in trigger_names(table) if ('trigger', name) not in present
+            ]
+    return errors
+
+
+def match_expression(user_id, text):
+    # words hold no quotes or operators, so quoting them is enough
+    prefixes = ' '.join(f'"{word}"*' for word in words(text))
+    return f'user_id : "{user_id}" AND title : ({prefixes})'
+
+
+def filters(params):
+    """SQL conditions and params for the date, category and amount filters."""
+    ops = connection.ops
+    conditions, values = [], []
+    for key, sql, adapt in (
+        ('start_date', 't.date >= %s', ops.adapt_datefield_value),
+        ('end_date', 't.date <= %s', ops.adapt_datefield_value),
+        ('category', 't.category_id = %s', int),
+        ('min_amount', 't.amount >= %s', ops.adapt_decimalfield_value),
+        ('max_amount', 't.amount <= %s', ops.adapt_decimalfield_value),
+    ):
+        if params.get(key) is not None:
+            conditions.append(sql)
+            values.append(adapt(params[key]))
+    return conditions, values
+
+
+def search(user, text, kinds=tuple(KINDS), limit=LIMIT, **params):
+    """
+    Up to ``limit`` (kind, id, date, title, category_id, category_name,
+    amount) rows of ``kinds`` whose title has every word of ``text``.
+    """
+    if not words(text):
+        return []
+    if connection.vendor != 'sqlite':
+        return search_like(user, text, kinds, limit, **params)
+
+    qn = connection.ops.quote_name
+    conditions, values = filters(params)
+    branches, branch_params = [], []
+    for kind in kinds:
+        model, _ = KINDS[kind]
+        table = model._meta.db_table
+        index = qn(f'{table}_search')
+        branches.append(
+            f"SELECT * FROM (SELECT %s AS kind, t.id, t.date, t.title, t.category_id, t.amount "
+            f"FROM {index} s JOIN {qn(table)} t ON t.id = s.rowid "
+            f"WHERE {' AND '.join([f'{index} MATCH %s', 't.user_id = %s', *conditions])} "
+            f"ORDER BY s.rowid DESC LIMIT %s) AS {kind.lower()}_matches"
+        )
+        branch_params += [kind, match_expression(user.pk, text), user.pk, *values, max(limit, CANDIDATES)]
+    sql = (
+        f"SELECT m.kind, m.id, m.date, m.title, m.category_id, c.name, m.amount "
+        f"FROM ({' UNION ALL '.join(branches)}) m "
+        f"LEFT JOIN {qn(Category._meta.db_table)} c ON c.id = m.category_id"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, branch_params)
+        rows = cursor.fetchall()
+    return [
+        (kind, pk, as_date(day), title, category, name, money(amount))
+        for kind, pk, day, title, category, name, amount in ranked(rows, text)[:limit]
+    ]
+
+
+def ranked(rows, text):
+    terms = {word.casefold() for word in words(text)}
+
+    def key(row):
+        title = [word.casefold() for word in words(row[3])]
+        return -len(terms.intersection(title)), len(title), -as_date(row[2]).toordinal(), -row[1]
+
+    return sorted(rows, key=key)
+
+
+def search_like(user, text, kinds, limit, **params):
+    lookups = {
+        'start_date': 'date__gte', 'end_date': 'date__lte', 'category': 'category_id',
+        'min_amount': 'amount__gte', 'max_amount': 'amount__lte',
+    }
+    condition = Q(user=user)
+    for word in words(text):
+        condition &= Q(title__icontains=word)
+    for key, lookup in lookups.items():
+        if params.get(key) is not None:
+            condition &= Q(**{lookup: params[key]})
+    rows = []
+    for kind in kinds:
+        model, _ = KINDS[kind]
+        rows += [
+            (kind, *row) for row in model.objects.filter(condition).order_by('-date', '-id')
+            .values_list('id', 'date', 'title', 'category_id', 'category__name', 'amount')[:limit]
+        ]
+    return sorted(rows, key=lambda row: (row[2], row[1]), reverse=True)[:limit]
+
+
+def representation(row):
+    kind, pk, day, title, category, name, amount = row
+    return {
+        'type': kind,
+        'id': pk,
+        'date': day.isoformat(),
+        'title': title,
+        'category': category,
+        'category_name': name,
+        'amount': str(amount),
+    }
@@ -1,42 +1,161 @@
+import re
+
 from rest_framework import serializers
-from .models import Expense, Income, Category, Budget
+from . import categories, jobs, recurring, rules, search, statements
+from .models import Expense, Income, Category, Budget, BudgetAlert, CategoryRule, Job, RecurringTransaction
 from django.db import models
 from django.db.models import Q
+from django.urls import reverse
+
+
+class CategoryField(serializers.PrimaryKeyRelatedField):
+    """
+    Category pk checked against the per-user resolver in ``categories``
+    rather than one query per row. Validated values are stub Category
+    instances carrying pk, name and type.
+    """
+
+    def __init__(self, transaction_type, **kwargs):
+         self.transaction_type = transaction_type
+         kwargs.setdefault('queryset', Category.objects.filter(transaction_type=transaction_type))
+         super().__init__(**kwargs)
+
+    def get_queryset(self):
+         queryset = super().get_queryset()
+         request = self.context.get('request')
+         if request and request.user.is_authenticated:
+              # user__in=[user, None] never matched the shared categories: IN drops NULL
+              queryset = queryset.filter(Q(user=request.user) | Q(user__isnull=True))
+         return queryset
+
+    def to_internal_value(self, data):
+         names = category_names(self)
+         if names is None:
+              return super().to_internal_value(data)
+         if isinstance(data, bool):
+              self.fail('incorrect_type', data_type=type(data).__name__)
+         try:
+              pk = int(data)
+         except (TypeError, ValueError):
+              self.fail('incorrect_type', data_type=type(data).__name__)
+         if pk not in names:
+              self.fail('does_not_exist', pk_value=data)
+         return categories.stub(pk, names[pk], self.transaction_type)
+
+
+class CategoryNameField(serializers.ReadOnlyField):
+    """``category.name`` served from the resolver, without a join."""
+
+    def __init__(self, transaction_type, **kwargs):
+         self.transaction_type = transaction_type
+         kwargs['source'] = 'category.name'
+         super().__init__(**kwargs)
+
+    def get_attribute(self, instance):
+         names = category_names(self)
+         if names is not None and instance.category_id in names:
+              return names[instance.category_id]
+         return super().get_attribute(instance)
+
+
+def category_names(field):
+    """
+    {pk: name} of the categories the requesting user can use, looked up once
+    per serializer (list serializers share one child) or None without a user.
+    """
+    request = field.context.get('request')
+    if request is None or not request.user.is_authenticated:
+         return None
+    resolved = getattr(field, '_category_names', None)
+    if resolved is None or resolved[0] is not request:
+         resolved = (request, categories.visible(request.user.pk, field.transaction_type))
+         field._category_names = resolved
+    return resolved[1]
+
+
+def categorize_missing(serializer, attrs, transaction_type, required):
+    """
+    Fill in a category left out of a new or fully replaced row from the
+    user's CategoryRules; ``required`` keeps it mandatory when none match.
+    """
+    request = serializer.context.get('request')
+    if serializer.partial or attrs.get('category') is not None or request is None:
+         return attrs
+    category = rules.categorize(request.user.pk, transaction_type, attrs.get('title', ''), attrs.get('amount'))
+    if category is None and required:
+         raise serializers.ValidationError({'category': [serializers.Field.default_error_messages['required']]})
+    if category is not None:
+         attrs['category'] = category
+    return attrs
 
 
 class ExpenseSerializer(serializers.ModelSerializer):
-    category_name = serializers.ReadOnlyField(source='category.name')
-    category = serializers.PrimaryKeyRelatedField(queryset=Category.objects.all())
+    category_name = CategoryNameField(Category.CategoryType.EXPENSE)
+    # optional only when a CategoryRule supplies one
+    category = CategoryField(Category.CategoryType.EXPENSE, required=False)
 
     class Meta:
          model = Expense
          fields = ['id','title','category','amount','date','category_name']
 
-    def __init__(self,  *args,**kwargs):
-         super().__init__(*args, **kwargs)
-
-         request = self.context.get('request')
-         if request and request.user:
-              self.fields['category'].queryset = Category.objects.filter(
-                   transaction_type='EXPENSE',
-                   user__in = [request.user,None]
-              )
+    def validate(self, attrs):
+         return categorize_missing(self, attrs, Category.CategoryType.EXPENSE, required=True)
 
 
 class IncomeSerializer(serializers.ModelSerializer):
-    category_name = serializers.ReadOnlyField(source='category.name')
+    category_name = CategoryNameField(Category.CategoryType.INCOME)
+    category = CategoryField(Category.CategoryType.INCOME, allow_null=True, required=False)
+
     class Meta:
         model = Income
         fields = ['id','title','category', 'amount', 'date','category_name']
 
-    def __init__(self, *args, **kwargs):
-            super().__init__(*args, **kwargs)
-            request = self.context.get('request')
-            if request and request.user:
-                self.fields['category'].queryset = Category.objects.filter(
-                    transaction_type='INCOME',
-                    user__in = [request.user,None]
-                )
+    def validate(self, attrs):
+        return categorize_missing(self, attrs, Category.CategoryType.INCOME, required=False)
+
+class BulkTransactionSerializer(serializers.ModelSerializer):
+    """
+    Row serializer for the bulk endpoints. ``category`` is a plain pk checked
+    against ``context['category_ids']``, the user-visible category set loaded
+    once per batch, instead of one lookup per row.
+    """
+
+    category_required = False
+
+    def validate_category(self, value):
+         if value is not None and value not in self.context['category_ids']:
+              raise serializers.ValidationError(f'Invalid pk "{value}" - object does not exist.')
+         return value
+
+    def validate(self, attrs):
+         # a missing category comes from the batch's CategoryRule matcher
+         if self.partial or attrs.get('category_id') is not None:
+              return attrs
+         match = self.context.get('matcher')
+         category_id = match(attrs.get('title', ''), attrs.get('amount')) if match is not None else None
+         if category_id in self.context['category_ids']:
+              attrs['category_id'] = category_id
+         elif self.category_required:
+              raise serializers.ValidationError({'category': [serializers.Field.default_error_messages['required']]})
+         return attrs
+
+
+class ExpenseBulkSerializer(BulkTransactionSerializer):
+    category = serializers.IntegerField(source='category_id', required=False)
+    category_required = True
+
+    class Meta:
+         model = Expense
+         fields = ['id','title','category','amount','date']
+
+
+class IncomeBulkSerializer(BulkTransactionSerializer):
+    category = serializers.IntegerField(source='category_id', allow_null=True, required=False)
+
+    class Meta:
+         model = Income
+         fields = ['id','title','category','amount','date']
+
 
 class CategorySerializer(serializers.ModelSerializer):
     class Meta:
@@ -52,4 +171,151 @@ class BudgetSerializer(serializers.ModelSerializer):
 
      class Meta:
           model = Budget
-          fields = ["id", "category","category_name", "amount"]
\ No newline at end of file
+          fields = ["id", "category","category_name", "amount"]
+
+
+class BudgetAlertSerializer(serializers.ModelSerializer):
+     category_name = serializers.CharField(source="budget.category.name", read_only=True)
+
+     class Meta:
+          model = BudgetAlert
+          fields = ["id", "budget", "category_name", "month", "threshold", "spent", "limit", "created_at", "read_at"]
+          read_only_fields = fields
+
+
+class JobSerializer(serializers.ModelSerializer):
+     download_url = serializers.SerializerMethodField()
+
+     class Meta:
+          model = Job
+          fields = ["id", "kind", "params", "status", "progress", "message", "result", "error", "attempts",
+                    "created_at", "started_at", "finished_at", "download_url"]
+          read_only_fields = [field for field in fields if field not in ("kind", "params")]
+
+     def get_download_url(self, job):
+          if job.status != Job.Status.SUCCEEDED or not job.file:
+               return None
+          url = reverse("job-download", args=[job.pk])
+          request = self.context.get("request")
+          return request.build_absolute_uri(url) if request else url
+
+     def validate(self, attrs):
+          try:
+               jobs.validate(attrs["kind"], attrs.get("params") or {})
+          except ValueError as exc:
+               raise serializers.ValidationError({"params": str(exc)})
+          return attrs
+
+
+class RecurringTransactionSerializer(serializers.ModelSerializer):
+     category_name = serializers.CharField(source="category.name", read_only=True, default=None)
+
+     class Meta:
+          model = RecurringTransaction
+          fields = ["id", "transaction_type", "title", "category", "category_name", "amount", "frequency",
+                    "interval", "start_date", "end_date", "active", "next_date"]
+          read_only_fields = ["next_date"]
+          extra_kwargs = {"interval": {"min_value": 1}}
+
+     def get_fields(self):
+          fields = super().get_fields()
+          request = self.context.get("request")
+          if request and request.user.is_authenticated:
+               fields["category"].queryset = Category.objects.filter(Q(user=request.user) | Q(user__isnull=True))
+          return fields
+
+     def validate(self, attrs):
+          def current(name):
+               return attrs[name] if name in attrs else getattr(self.instance, name, None)
+
+          transaction_type, category = current("transaction_type"), current("category")
+          if category is not None and category.transaction_type != transaction_type:
+               raise serializers.ValidationError({"category": f"Not a {transaction_type.lower()} category."})
+          if category is None and transaction_type == Category.CategoryType.EXPENSE:
+               raise serializers.ValidationError({"category": "Expenses need a category."})
+          end_date = current("end_date")
+          if end_date is not None and end_date < current("start_date"):
+               raise serializers.ValidationError({"end_date": "Must not be before start_date."})
+          return attrs
+
+     def create(self, validated_data):
+          rule = RecurringTransaction(**validated_data)
+          recurring.reschedule(rule)
+          rule.save()
+          return rule
+
+     def update(self, instance, validated_data):
+          # resume after what the old schedule already wrote
+          written_through = recurring.written_through(instance)
+          for field, value in validated_data.items():
+               setattr(instance, field, value)
+          recurring.reschedule(instance, written_through)
+          instance.save()
+          return instance
+
+
+class CategoryRuleSerializer(serializers.ModelSerializer):
+     category_name = serializers.CharField(source="category.name", read_only=True)
+
+     class Meta:
+          model = CategoryRule
+          fields = ["id", "kind", "pattern", "min_amount", "max_amount", "category", "category_name", "priority"]
+
+     def get_fields(self):
+          fields = super().get_fields()
+          request = self.context.get("request")
+          if request and request.user.is_authenticated:
+               fields["category"].queryset = Category.objects.filter(Q(user=request.user) | Q(user__isnull=True))
+          return fields
+
+     def validate(self, attrs):
+          def current(name):
+               return attrs[name] if name in attrs else getattr(self.instance, name, None)
+
+          pattern = current("pattern")
+          if not pattern.strip():
+               raise serializers.ValidationError({"pattern": "May not be blank."})
+          if current("kind") == CategoryRule.Kind.REGEX:
+               try:
+                    rules.compile_rule(CategoryRule.Kind.REGEX, pattern)
+               except re.error as exc:
+                    raise serializers.ValidationError({"pattern": f"Invalid regular expression: {exc}"})
+          low, high = current("min_amount"), current("max_amount")
+          if low is not None and high is not None and low > high:
+               raise serializers.ValidationError({"max_amount": "Must not be below min_amount."})
+          return attrs
+
+
+class CategoryRuleApplySerializer(serializers.Serializer):
+     overwrite = serializers.BooleanField(default=False)
+     start_date = serializers.DateField(required=False)
+     end_date = serializers.DateField(required=False)
+
+
+class TransactionSearchSerializer(serializers.Serializer):
+     q = serializers.CharField(max_length=200)
+     type = serializers.ChoiceField(choices=Category.CategoryType.choices, required=False)
+     category = serializers.IntegerField(required=False)
+     start_date = serializers.DateField(required=False)
+     end_date = serializers.DateField(required=False)
+     min_amount = serializers.DecimalField(max_digits=10, decimal_places=2, required=False)
+     max_amount = serializers.DecimalField(max_digits=10, decimal_places=2, required=False)
+     limit = serializers.IntegerField(min_value=1, max_value=search.MAX_LIMIT, default=search.LIMIT)
+
+     def validate(self, attrs):
+          if not search.words(attrs["q"]):
+               raise serializers.ValidationError({"q": "Enter at least one word."})
+          if attrs.get("min_amount") is not None and attrs.get("max_amount") is not None and attrs["min_amount"] > attrs["max_amount"]:
+               raise serializers.ValidationError({"max_amount": "Must not be below min_amount."})
+          return attrs
+
+
+class StatementImportSerializer(serializers.Serializer):
+     file = serializers.FileField()
+     format = serializers.ChoiceField(choices=statements.FORMATS, required=False)
+     date_format = serializers.CharField(required=False, max_length=32)
+     transaction_type = serializers.ChoiceField(choices=statements.TRANSACTION_TYPES, required=False)
+
+     def validate(self, attrs):
+          attrs.setdefault("format", statements.guess_format(attrs["file"].name))
+          return attrs
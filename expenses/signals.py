@@ -0,0 +1,143 @@
+import itertools
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import partial
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from . import authentication, caching, categories, rollups, rules
+from django.utils.timezone import now
+
+from .models import Budget, Category, CategoryRule, Expense, Income, Job, Tombstone
+
+
+_muted = ContextVar('expenses_signals_muted', default=False)
+
+SHARED_BUMP_CHUNK = 1000
+
+
+@contextmanager
+def muted():
+    """
+    Silence the per-row handlers below while a bulk path does the rollup and
+    tombstone bookkeeping for the whole batch itself.
+    """
+    token = _muted.set(True)
+    try:
+        yield
+    finally:
+        _muted.reset(token)
+
+
+def is_muted():
+    return _muted.get()
+
+
+@receiver(pre_save, sender=Expense)
+@receiver(pre_save, sender=Income)
+def remember_previous_row(sender, instance, raw=False, **kwargs):
+    instance._rollup_previous = None
+    if raw or instance.pk is None or is_muted():
+        return
+    instance._rollup_previous = (
+        sender.objects.filter(pk=instance.pk)
+        .values_list('user_id', 'category_id', 'date', 'amount')
+        .first()
+    )
+
+
+@receiver(post_save, sender=Expense)
+@receiver(post_save, sender=Income)
+def update_rollup_on_save(sender, instance, raw=False, **kwargs):
+    if raw or is_muted():
+        return
+    transaction_type = rollups.transaction_type_for(sender)
+    previous = getattr(instance, '_rollup_previous', None)
+    current = (instance.user_id, instance.category_id, instance.date, instance.amount)
+
+    if previous == current:
+        return
+    if previous is not None:
+        user_id, category_id, day, amount = previous
+        rollups.apply_delta(user_id, category_id, day, transaction_type, -amount, -1)
+    rollups.apply_delta(instance.user_id, instance.category_id, instance.date, transaction_type, instance.amount, 1)
+
+
+@receiver(post_delete, sender=Expense)
+@receiver(post_delete, sender=Income)
+def update_rollup_on_delete(sender, instance, origin=None, **kwargs):
+    # the user's rollups are removed by the same cascade
+    if isinstance(origin, User) or is_muted():
+        return
+    transaction_type = rollups.transaction_type_for(sender)
+    rollups.apply_delta(instance.user_id, instance.category_id, instance.date, transaction_type, -instance.amount, -1)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category_cache(sender, instance, **kwargs):
+    categories.invalidate(instance.user_id)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def bump_versions_for_shared_category(sender, instance, **kwargs):
+    # every user's cached lists and ETags carry shared category names
+    if instance.user_id is not None:
+        return
+    user_ids = User.objects.values_list('pk', flat=True).iterator(chunk_size=SHARED_BUMP_CHUNK)
+    while chunk := list(itertools.islice(user_ids, SHARED_BUMP_CHUNK)):
+        caching.bump_versions(chunk)
+
+
+@receiver(pre_delete, sender=Category)
+def uncategorise_rollups(sender, instance, **kwargs):
+    rollups.merge_into_uncategorised(instance)
+    # SET_NULL is a bare UPDATE; mark the rows so delta sync picks them up
+    for model in (Expense, Income):
+        model.objects.filter(category=instance).update(updated_at=now())
+
+
+TOMBSTONE_KINDS = {
+    Expense: Tombstone.Kind.EXPENSE,
+    Income: Tombstone.Kind.INCOME,
+    Category: Tombstone.Kind.CATEGORY,
+    Budget: Tombstone.Kind.BUDGET,
+}
+
+
+@receiver(post_delete, sender=Expense)
+@receiver(post_delete, sender=Income)
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Budget)
+def leave_tombstone(sender, instance, origin=None, **kwargs):
+    if isinstance(origin, User) or is_muted():
+        return
+    Tombstone.objects.create(user_id=instance.user_id, kind=TOMBSTONE_KINDS[sender], object_id=instance.pk)
+
+
+@receiver(post_delete, sender=Job)
+def delete_job_file(sender, instance, **kwargs):
+    if instance.file:
+        instance.file.delete(save=False)
+
+
+@receiver(post_save, sender=CategoryRule)
+@receiver(post_delete, sender=CategoryRule)
+def invalidate_category_rules(sender, instance, **kwargs):
+    rules.invalidate(instance.user_id)
+
+
+@receiver(post_delete, sender=Token)
+@receiver(post_save, sender=User)
+def invalidate_authentication(sender, instance, **kwargs):
+    # deleted tokens and deactivated users must stop authenticating at once;
+    # bumped again on commit, since a lookup that ran before the commit but
+    # read the first bump would cache the old row under the new version
+    user_id = instance.user_id if sender is Token else instance.pk
+    authentication.invalidate(user_id)
+    transaction.on_commit(partial(authentication.invalidate, user_id))
@@ -0,0 +1,307 @@
+"""
+Bank statement import. ``import_statement()`` stream-parses a CSV or OFX
+file of any size, files each row under a category (a Category column,
+else the user's CategoryRules), drops rows that already exist and
+bulk-inserts the rest chunk by chunk.
+
+A row duplicates an Expense/Income that existed before the import with the
+same date, amount and title (case and spacing ignored). The first chunk to
+reach a date loads that day's rows through the (user, date) index into a
+counted table of fingerprints, each row matching at most one statement
+line: a statement holding two identical coffees imports both, and
+importing it again adds nothing, which also makes a retried import safe.
+"""
+import csv
+import hashlib
+import html
+import io
+import re
+import time
+from collections import Counter
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.db import transaction
+
+from . import categories, rollups, rules
+from .caching import bump_version
+from .models import Category
+
+
+FORMATS = ('csv', 'ofx')
+CHUNK_SIZE = 2000
+MAX_ERRORS = 100
+CENTS = Decimal('0.01')
+MAX_AMOUNT = Decimal('99999999.99')
+TITLE_LENGTH = 255
+ISO_DATE = '%Y-%m-%d'
+
+EXPENSE = Category.CategoryType.EXPENSE
+INCOME = Category.CategoryType.INCOME
+TRANSACTION_TYPES = (EXPENSE, INCOME)
+
+# accepted CSV headers, compared case-insensitively
+COLUMNS = {
+    'date': ('date', 'posted date', 'posting date', 'transaction date', 'booking date', 'value date'),
+    'title': ('title', 'description', 'payee', 'name', 'memo', 'details', 'narrative'),
+    'amount': ('amount', 'value'),
+    'debit': ('debit', 'withdrawal', 'withdrawals', 'money out', 'paid out'),
+    'credit': ('credit', 'deposit', 'deposits', 'money in', 'paid in'),
+    'type': ('type',),
+    'category': ('category',),
+}
+
+
+class StatementError(ValueError):
+    """The file as a whole cannot be read (unknown format, missing columns)."""
+
+
+def guess_format(filename):
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    if extension in ('ofx', 'qfx'):
+        return 'ofx'
+    return 'csv'
+
+
+def text_stream(stream):
+    """Text view of a binary or text file; a UTF-8 byte order mark is skipped."""
+    if isinstance(stream, io.TextIOBase):
+        return stream
+    return io.TextIOWrapper(stream, encoding='utf-8-sig', errors='replace', newline='')
+
+
+# --- parsers: yield (line, record) with string fields ------------------------
+
+def csv_records(stream):
+    text = text_stream(stream)
+    sample = text.read(8192)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=',;\t|')
+    except csv.Error:
+        dialect = csv.excel
+    text.seek(0)
+
+    reader = csv.reader(text, dialect)
+    header = next(reader, None)
+    if header is None:
+        raise StatementError('The file is empty.')
+    positions = {}
+    for index, name in enumerate(header):
+        for field, aliases in COLUMNS.items():
+            if name.strip().lower() in aliases and field not in positions:
+                positions[field] = index
+    missing = [field for field in ('date', 'title') if field not in positions]
+    if 'amount' not in positions and not {'debit', 'credit'} & positions.keys():
+        missing.append('amount (or debit/credit)')
+    if missing:
+        raise StatementError(f"Missing column(s): {', '.join(missing)}. Found: {', '.join(header)}")
+
+    for line, values in enumerate(reader, start=2):
+        if not any(value.strip() for value in values):
+            continue
+        yield line, {field: values[index] if index < len(values) else '' for field, index in positions.items()}
+
+
+OFX_TAG = re.compile(r'<(/?)([A-Za-z0-9.]+)>([^<]*)')
+
+
+def ofx_records(stream, block_size=65536):
+    """
+    Transactions of an OFX 1.x (SGML, unclosed leaf tags) or 2.x (XML)
+    statement, read in blocks with only a partial tag carried between them.
+    """
+    text = text_stream(stream)
+    buffer, record, count = '', None, 0
+
+    def tags(data):
+        nonlocal record, count
+        for closing, tag, value in OFX_TAG.findall(data):
+            tag = tag.upper()
+            if tag == 'STMTTRN':
+                if not closing:
+                    record = {}
+                elif record is not None:
+                    count += 1
+                    yield count, ofx_record(record)
+                    record = None
+            elif record is not None and not closing and value.strip():
+                record.setdefault(tag, html.unescape(value.strip()))
+
+    while block := text.read(block_size):
+        buffer += block
+        cut = buffer.rfind('<')
+        yield from tags(buffer[:cut])
+        buffer = buffer[cut:]
+    yield from tags(buffer)
+
+
+def ofx_record(fields):
+    posted = fields.get('DTPOSTED', '')
+    return {
+        'date': f'{posted[:4]}-{posted[4:6]}-{posted[6:8]}',
+        'amount': fields.get('TRNAMT', ''),
+        'title': fields.get('NAME') or fields.get('MEMO') or fields.get('PAYEE', ''),
+    }
+
+
+PARSERS = {'csv': csv_records, 'ofx': ofx_records}
+
+
+# --- rows --------------------------------------------------------------------
+
+def parse_amount(value):
+    """Decimal amount of '1,234.50', '-12', '(12.00)', '$ 5' and the like; '' is None."""
+    text = value.strip()
+    if not text:
+        return None
+    negative = text.startswith('(') and text.endswith(')')
+    text = re.sub(r'[^\d.+-]', '', text)
+    try:
+        amount = Decimal(text).quantize(CENTS)
+    except InvalidOperation:
+        raise ValueError(f'Invalid amount {value!r}')
+    return -amount if negative else amount
+
+
+def parse_date(value, date_format):
+    try:
+        if date_format == ISO_DATE:
+            # several times faster than strptime; a trailing time is ignored
+            return date.fromisoformat(value.strip()[:10])
+        return datetime.strptime(value.strip(), date_format).date()
+    except ValueError:
+        raise ValueError(f'Invalid date {value!r}; expected {date_format}')
+
+
+def record_row(record, date_format, transaction_type):
+    """
+    (date, amount, title, type, category name) of a parsed record. Without
+    a Type column or a forced ``transaction_type`` the sign decides, the way
+    banks write statements: money out is negative.
+    """
+    day = parse_date(record['date'], date_format)
+    if 'amount' in record:
+        amount = parse_amount(record['amount'])
+    else:
+        debit, credit = parse_amount(record.get('debit', '')), parse_amount(record.get('credit', ''))
+        amount = (credit or 0) - abs(debit or 0) if debit or credit else None
+    if amount is None:
+        raise ValueError('Missing amount')
+    if not 0 < abs(amount) <= MAX_AMOUNT:
+        raise ValueError(f'Amount {amount} is out of range')
+
+    kind = transaction_type
+    if kind is None and record.get('type'):
+        kind = record['type'].strip().upper()
+        if kind not in TRANSACTION_TYPES:
+            raise ValueError(f"Unknown type {record['type']!r}")
+    if kind is None:
+        kind = EXPENSE if amount < 0 else INCOME
+
+    title = ' '.join(record['title'].split())[:TITLE_LENGTH]
+    if not title:
+        raise ValueError('Missing title')
+    return day, abs(amount), title, kind, record.get('category', '').strip()
+
+
+def fingerprint(day, amount, title):
+    """64-bit hash of a row's (date, amount, title) for duplicate detection."""
+    key = f"{day.isoformat()}|{Decimal(amount).quantize(CENTS)}|{' '.join(title.split()).casefold()}"
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big')
+
+
+class Categorizer:
+    """Category pk of a row: its Category column if it names one, else the user's best matching rule."""
+
+    def __init__(self, user):
+        visible = {kind: categories.visible(user.pk, kind) for kind in TRANSACTION_TYPES}
+        self.allowed = {kind: set(names) for kind, names in visible.items()}
+        self.by_name = {
+            kind: {name.casefold(): pk for pk, name in names.items()}
+            for kind, names in visible.items()
+        }
+        self.matchers = {kind: rules.matcher(user.pk, kind) for kind in TRANSACTION_TYPES}
+
+    def __call__(self, title, kind, name, amount=None):
+        if name and name.casefold() in self.by_name[kind]:
+            return self.by_name[kind][name.casefold()]
+        match = self.matchers[kind]
+        category_id = match(title, amount) if match is not None else None
+        return category_id if category_id in self.allowed[kind] else None
+
+
+# --- import ------------------------------------------------------------------
+
+def import_statement(user, stream, format='csv', date_format=None, transaction_type=None, chunk_size=CHUNK_SIZE, progress=None):
+    """
+    Import a statement for ``user``. ``date_format`` is a strptime format
+    for CSV dates (ISO by default); ``transaction_type`` files every row as
+    EXPENSE or INCOME regardless of sign. ``progress``, if given, is called
+    with the rows read so far after each chunk. Returns counts, the first
+    MAX_ERRORS row errors and rows/sec. StatementError if the file is
+    unreadable as a whole.
+    """
+    if format not in PARSERS:
+        raise StatementError(f"Unknown format {format!r}; expected one of {', '.join(FORMATS)}")
+    if transaction_type not in (None, *TRANSACTION_TYPES):
+        raise StatementError(f"Unknown transaction type {transaction_type!r}")
+    date_format = ISO_DATE if format == 'ofx' or not date_format else date_format
+    categorize = Categorizer(user)
+    # {(type, date): Counter of fingerprints} of the rows that existed before
+    # the import, loaded the first time a chunk touches the date
+    existing = {}
+    stats = {'rows': 0, 'created': {EXPENSE: 0, INCOME: 0}, 'duplicates': 0, 'errors': [], 'error_count': 0}
+    started = time.monotonic()
+
+    records = PARSERS[format](stream)
+    while chunk := list(islice(records, chunk_size)):
+        rows = {EXPENSE: [], INCOME: []}
+        for line, record in chunk:
+            stats['rows'] += 1
+            try:
+                day, amount, title, kind, name = record_row(record, date_format, transaction_type)
+            except ValueError as exc:
+                stats['error_count'] += 1
+                if len(stats['errors']) < MAX_ERRORS:
+                    stats['errors'].append({'line': line, 'error': str(exc)})
+                continue
+            rows[kind].append((day, amount, title, name))
+        write_chunk(user, rows, categorize, existing, stats)
+        if progress:
+            progress(stats['rows'], 0, f"{stats['rows']} rows read")
+
+    if any(stats['created'].values()):
+        bump_version(user.pk)
+    stats['created'] = {kind.lower(): count for kind, count in stats['created'].items()}
+    stats['elapsed'] = time.monotonic() - started
+    stats['rows_per_sec'] = stats['rows'] / stats['elapsed'] if stats['elapsed'] else 0
+    return stats
+
+
+def write_chunk(user, rows, categorize, existing, stats):
+    with transaction.atomic():
+        for kind, kind_rows in rows.items():
+            if not kind_rows:
+                continue
+            model = rollups.TRANSACTION_MODELS[kind]
+            # before this chunk writes any: rows the import added itself are never loaded
+            dates = {row[0] for row in kind_rows if (kind, row[0]) not in existing}
+            existing.update({(kind, day): Counter() for day in dates})
+            for day, amount, title in model.objects.filter(user=user, date__in=dates).values_list('date', 'amount', 'title').order_by():
+                existing[(kind, day)][fingerprint(day, amount, title)] += 1
+
+            objs = []
+            for day, amount, title, name in kind_rows:
+                key = fingerprint(day, amount, title)
+                found = existing[(kind, day)]
+                if found[key] > 0:
+                    found[key] -= 1
+                    stats['duplicates'] += 1
+                    continue
+                objs.append(model(
+                    user=user, date=day, amount=amount, title=title, category_id=categorize(title, kind, name, amount),
+                ))
+            model.objects.bulk_create(objs, batch_size=500)
+            rollups.apply_rows(kind, added=((user.pk, obj.category_id, obj.date, obj.amount) for obj in objs))
+            stats['created'][kind] += len(objs)
@@ -0,0 +1,108 @@
+from decimal import Decimal
+
+from django.db import connection
+
+from .models import Category, Expense, Income
+
+
+CENTS = Decimal('0.01')
+
+SOURCES = (
+    (Category.CategoryType.EXPENSE, Expense),
+    (Category.CategoryType.INCOME, Income),
+)
+
+
+def summary_sql(user_id, start, end, sources=SOURCES):
+    """
+    One UNION ALL statement returning, for both transaction tables, the
+    per-category sum/count/min/max and the middle one or two amounts for the
+    median. Amounts are summed as integer cents so totals stay exact on
+    SQLite, whose NUMERIC columns hold floats. The grouped half is an
+    index-only scan of (user, category, date, amount); the median half walks
+    (user, amount) up to the middle row.
+    """
+    qn = connection.ops.quote_name
+    cents = 'CAST(ROUND({}.amount * 100) AS INTEGER)'
+    parts, params = [], []
+    for transaction_type, model in sources:
+        # no table aliases, so query plans name the real tables
+        table = qn(model._meta.db_table)
+        where = [f'{table}.user_id = %s']
+        where_params = [user_id]
+        for lookup, value in (('>=', start), ('<=', end)):
+            if value:
+                where.append(f'{table}.date {lookup} %s')
+                where_params.append(value)
+        where = ' AND '.join(where)
+        count = f'(SELECT COUNT(*) FROM {table} WHERE {where})'
+        amount = cents.format(table)
+
+        parts.append(
+            f"SELECT %s AS kind, {table}.category_id AS category_id, SUM({amount}) AS cents, COUNT(*) AS n, "
+            f"MIN({amount}) AS low, MAX({amount}) AS high, 0 AS is_median "
+            f"FROM {table} WHERE {where} GROUP BY {table}.category_id"
+        )
+        params += [str(transaction_type)] + where_params
+        parts.append(
+            f"SELECT %s, NULL, SUM(middle.cents), COUNT(*), NULL, NULL, 1 FROM ("
+            f"SELECT {amount} AS cents FROM {table} WHERE {where} ORDER BY {table}.amount "
+            f"LIMIT 2 - {count} %% 2 OFFSET ({count} - 1) / 2) AS middle"
+        )
+        params += [str(transaction_type)] + where_params * 3
+
+    category = qn(Category._meta.db_table)
+    sql = (
+        f"SELECT parts.kind, {category}.name, parts.cents, parts.n, parts.low, parts.high, parts.is_median "
+        f"FROM ({' UNION ALL '.join(parts)}) AS parts "
+        f"LEFT JOIN {category} ON {category}.id = parts.category_id"
+    )
+    return sql, params
+
+
+def empty_stats():
+    return {
+        'total': Decimal('0.00'), 'count': 0, 'average': Decimal('0.00'),
+        'min': None, 'max': None, 'median': None, 'by_category': [],
+    }
+
+
+def summarize(user, start=None, end=None, sources=SOURCES):
+    """
+    Totals, count, average, min, max, median and per-category totals of a
+    user's expenses and income, optionally within [start, end], in a
+    single round trip. Returns {'EXPENSE': stats, 'INCOME': stats}, or just
+    the entries for ``sources`` when given a subset of them.
+    """
+    sql, params = summary_sql(user.pk, start, end, sources)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+
+    stats = {transaction_type: empty_stats() for transaction_type, _ in sources}
+    mins, maxes, by_name = {}, {}, {}
+    for kind, category, cents, count, low, high, is_median in rows:
+        side = stats[kind]
+        if is_median:
+            if count:
+                side['median'] = Decimal(cents) / (count * 100)
+            continue
+        side['count'] += count
+        mins[kind] = low if kind not in mins else min(mins[kind], low)
+        maxes[kind] = high if kind not in maxes else max(maxes[kind], high)
+        # same-named personal and shared categories report together
+        key = (kind, category)
+        by_name[key] = by_name.get(key, 0) + cents
+
+    for (kind, category), cents in by_name.items():
+        stats[kind]['total'] += Decimal(cents) / 100
+        stats[kind]['by_category'].append({'category__name': category, 'total': (Decimal(cents) / 100).quantize(CENTS)})
+
+    for kind, side in stats.items():
+        side['total'] = side['total'].quantize(CENTS)
+        if side['count']:
+            side['average'] = (side['total'] / side['count']).quantize(CENTS)
+            side['min'] = (Decimal(mins[kind]) / 100).quantize(CENTS)
+            side['max'] = (Decimal(maxes[kind]) / 100).quantize(CENTS)
+        side['by_category'].sort(key=lambda row: -row['total'])
+    return stats
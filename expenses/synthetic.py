@@ -0,0 +1,183 @@
+"""
+Synthetic data at realistic scale for ``manage.py generate_data`` and the
+API benchmark. Every generated user is named ``<prefix>-<n>`` and gets
+categories, budgets, a token and a history of expenses and income with:
+
+* amounts drawn from a log-normal per category around a typical price
+  (coffee a few units, rent a thousand), so totals are dominated by a few
+  large rows as in real ledgers;
+* more spending at weekends and in December, and rows spread over the
+  last ``years`` years;
+* a monthly salary plus occasional other income.
+
+The output depends only on ``seed`` and ``end``, so a baseline can be
+regenerated row for row. Rows are inserted in chunks, bypassing the model
+signals, and the rollups are rebuilt per user afterwards.
+"""
+import calendar
+import itertools
+import random
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from . import rollups
+from .caching import bump_versions
+from .models import Budget, Category, Expense, Income, MonthlyRollup
+
+
+PREFIX = 'synthetic'
+CHUNK_SIZE = 10000
+CENTS = Decimal('0.01')
+
+# name, share of rows, median amount, log-normal sigma, merchants
+EXPENSE_CATEGORIES = (
+    ('Groceries', 0.28, 45, 0.6, ('Fresh Market', 'Corner Shop', 'Green Grocer', 'MegaMart')),
+    ('Coffee', 0.14, 4.5, 0.3, ('Starbucks', 'Bean There', 'Daily Grind')),
+    ('Restaurants', 0.12, 32, 0.6, ('Pizza Place', 'Sushi Bar', 'The Grill', 'Noodle House')),
+    ('Transport', 0.12, 12, 0.8, ('Metro Card', 'Taxi', 'Fuel Station', 'Bike Share')),
+    ('Shopping', 0.10, 60, 1.0, ('Online Store', 'Book Shop', 'Hardware Store', 'Clothing Co')),
+    ('Entertainment', 0.07, 25, 0.7, ('Cinema', 'Streaming', 'Concert Hall', 'Game Store')),
+    ('Health', 0.05, 40, 0.9, ('Pharmacy', 'Dentist', 'Gym Membership')),
+    ('Utilities', 0.06, 90, 0.4, ('Electric Co', 'Water Works', 'Telecom', 'Internet')),
+    ('Travel', 0.03, 300, 1.0, ('Airline', 'Hotel', 'Car Rental')),
+    ('Rent', 0.03, 1200, 0.1, ('Landlord',)),
+)
+INCOME_CATEGORIES = ('Salary', 'Freelance', 'Interest', 'Gifts')
+
+# relative spending by weekday (Monday first) and by month
+WEEKDAY_WEIGHTS = (0.9, 0.85, 0.9, 0.95, 1.2, 1.5, 1.3)
+MONTH_WEIGHTS = (0.9, 0.85, 0.95, 1.0, 1.0, 1.05, 1.1, 1.1, 1.0, 1.0, 1.1, 1.5)
+
+
+def day_weights(start, end):
+    days = [start + timedelta(days=offset) for offset in range((end - start).days + 1)]
+    return days, [WEEKDAY_WEIGHTS[day.weekday()] * MONTH_WEIGHTS[day.month - 1] for day in days]
+
+
+def money(value):
+    return Decimal(str(round(max(value, 0.01), 2))).quantize(CENTS)
+
+
+def monthly(start, end, day_of_month):
+    """The ``day_of_month`` (clamped) of every month from ``start`` to ``end``."""
+    year, month = start.year, start.month
+    while True:
+        day = date(year, month, min(day_of_month, calendar.monthrange(year, month)[1]))
+        if day > end:
+            return
+        if day >= start:
+            yield day
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+def expense_rows(rng, user, categories, count, days, cum_weights):
+    picks = rng.choices(range(len(EXPENSE_CATEGORIES)), weights=[spec[1] for spec in EXPENSE_CATEGORIES], k=count)
+    dates = rng.choices(days, cum_weights=cum_weights, k=count)
+    for index, day in zip(picks, dates):
+        name, _, median, sigma, merchants = EXPENSE_CATEGORIES[index]
+        yield categories[name], day, rng.choice(merchants), money(rng.lognormvariate(0, sigma) * median)
+
+
+def income_rows(rng, user, categories, start, end, salary):
+    for day in monthly(start, end, 25):
+        yield categories['Salary'], day, 'Payroll', money(salary * rng.uniform(0.98, 1.04))
+    for day in monthly(start, end, 1):
+        yield categories['Interest'], day, 'Savings interest', money(rng.uniform(1, 15))
+        if rng.random() < 0.3:
+            yield categories['Freelance'], day + timedelta(days=rng.randrange(27)), 'Client invoice', money(rng.lognormvariate(0, 0.6) * 600)
+
+
+def insert(model, user, rows, chunk_size):
+    """
+    Insert (category, date, title, amount) rows for ``user`` with one
+    executemany per chunk: building a model instance per row would take
+    longer than the database does to store it.
+    """
+    qn = connection.ops.quote_name
+    columns = ('user_id', 'category_id', 'date', 'title', 'amount', 'updated_at')
+    sql = (
+        f'INSERT INTO {qn(model._meta.db_table)} ({", ".join(qn(column) for column in columns)}) '
+        f'VALUES ({", ".join(["%s"] * len(columns))})'
+    )
+    ops = connection.ops
+    stamp = ops.adapt_datetimefield_value(timezone.now())
+    count = 0
+    rows = iter(rows)
+    while chunk := list(itertools.islice(rows, chunk_size)):
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.executemany(sql, [
+                (user.pk, category.pk, ops.adapt_datefield_value(day), title, ops.adapt_decimalfield_value(amount), stamp)
+                for category, day, title, amount in chunk
+            ])
+        count += len(chunk)
+    return count
+
+
+def generate(users=10, rows=100000, years=3, seed=0, prefix=PREFIX, end=None, chunk_size=CHUNK_SIZE, log=None):
+    """
+    Create ``users`` users sharing ``rows`` expenses between them (each
+    also gets monthly income). Returns counts and rows/sec.
+    """
+    log = log or (lambda message: None)
+    end = end or date.today()
+    start = end - timedelta(days=365 * years)
+    days, weights = day_weights(start, end)
+    cum_weights = list(itertools.accumulate(weights))
+
+    started = time.monotonic()
+    stats = {'users': 0, 'expenses': 0, 'income': 0}
+    password = make_password(None)
+    offset = User.objects.filter(username__startswith=f'{prefix}-').count()
+    for number in range(offset, offset + users):
+        # a generator per user, so one user's data does not depend on how many came before
+        user_rng = random.Random(f'{seed}:{number}')
+        user = User.objects.create(username=f'{prefix}-{number}', password=password)
+        Token.objects.create(user=user)
+        categories = {
+            category.name: category for category in Category.objects.bulk_create(
+                [Category(user=user, name=spec[0], transaction_type='EXPENSE') for spec in EXPENSE_CATEGORIES]
+                + [Category(user=user, name=name, transaction_type='INCOME') for name in INCOME_CATEGORIES]
+            )
+        }
+        Budget.objects.bulk_create([
+            Budget(user=user, category=categories[spec[0]], amount=money(spec[2] * spec[1] * 60 * user_rng.uniform(0.8, 1.3)))
+            for spec in EXPENSE_CATEGORIES if user_rng.random() < 0.6
+        ])
+
+        share = rows // users + (number - offset < rows % users)
+        stats['expenses'] += insert(Expense, user, expense_rows(user_rng, user, categories, share, days, cum_weights), chunk_size)
+        salary = user_rng.lognormvariate(0, 0.3) * 3500
+        stats['income'] += insert(Income, user, income_rows(user_rng, user, categories, start, end, salary), chunk_size)
+        rollups.rebuild(user)
+        stats['users'] += 1
+        log(f'{user.username}: {share} expenses')
+
+    bump_versions(User.objects.filter(username__startswith=f'{prefix}-').values_list('pk', flat=True))
+    stats['elapsed'] = time.monotonic() - started
+    stats['rows_per_sec'] = (stats['expenses'] + stats['income']) / stats['elapsed'] if stats['elapsed'] else 0
+    return stats
+
+
+def clear(prefix=PREFIX):
+    """
+    Delete the generated users. Their rows go first, in one DELETE per
+    table: the ORM's cascade would load and delete millions of rows one
+    batch at a time, firing the tombstone and rollup signals for each.
+    """
+    users = User.objects.filter(username__startswith=f'{prefix}-')
+    with transaction.atomic():
+        for model in (Expense, Income, MonthlyRollup):
+            model.objects.filter(user__in=users)._raw_delete(model.objects.db)
+        # one by one: the signal handlers skip their bookkeeping only when a User is the origin
+        deleted = 0
+        for user in users:
+            user.delete()
+            deleted += 1
+    return deleted
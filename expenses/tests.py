@@ -1,3 +1,1674 @@
-from django.test import TestCase
+import csv
+import gzip
+import os
+import re
+import subprocess
+import tempfile
+import unittest
+import unittest.mock
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from io import StringIO
 
-# Create your tests here.
+from asgiref.sync import iscoroutinefunction, sync_to_async
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import CommandError
+from django.db import connection
+from django.db.models import Sum
+from django.http import HttpResponse
+from django.test import AsyncClient, RequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import now
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient, APIRequestFactory
+
+from expense_project import database
+
+from .models import AlertEvent, Expense, Income, Category, Budget, BudgetAlert, CategoryRule, Job, MonthlyRollup, RecurringTransaction, Tombstone
+from . import alerts, authentication, benchmarks, caching, categories, instrumentation, jobs, recurring, rollups, rules, search, statements, synthetic
+from .views import ExpenseViewSet, IncomeViewSet
+
+
+# table -> indexes its hot-path queries are expected to search through
+INDEXED_TABLES = {
+    "expenses_expense": r"expense_user_\w+_idx",
+    "expenses_income": r"income_user_\w+_idx",
+    # SQLite names inline UNIQUE constraints itself
+    "expenses_monthlyrollup": r"(rollup_unique\w*|sqlite_autoindex_expenses_monthlyrollup_\d+)",
+}
+
+
+def explain(sql):
+    with connection.cursor() as cursor:
+        cursor.execute("EXPLAIN QUERY PLAN " + sql)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+class APITestCase(TestCase):
+    """Logs in ``cls.user`` and starts every test with a cold response cache."""
+
+    def setUp(self):
+        caching.get_cache().clear()
+        caching.reset_stats()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+
+class QueryPlanTests(APITestCase):
+    """
+    Runs every hot endpoint, EXPLAINs each query it issues against the
+    transaction and rollup tables and fails when one of them stops going
+    through the expected (user, ...) indexes.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("planner", password="x")
+        other = User.objects.create_user("other", password="x")
+        food = Category.objects.create(user=cls.user, name="Food", transaction_type="EXPENSE")
+        salary = Category.objects.create(user=None, name="Salary", transaction_type="INCOME")
+        today = now().date()
+        for owner in (cls.user, other):
+            Expense.objects.bulk_create([
+                Expense(user=owner, category=food, title=f"e{i}", amount=Decimal("10.00"), date=today.replace(day=1 + i % 28))
+                for i in range(50)
+            ])
+            Income.objects.bulk_create([
+                Income(user=owner, category=salary, title=f"i{i}", amount=Decimal("100.00"), date=today.replace(day=1 + i % 28))
+                for i in range(20)
+            ])
+        Budget.objects.create(user=cls.user, category=food, amount=Decimal("300.00"))
+
+
+    def assertIndexedPlans(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+            if response.streaming:
+                b"".join(response.streaming_content)
+        self.assertEqual(response.status_code, 200, url)
+
+        checked = 0
+        for query in ctx.captured_queries:
+            sql = query["sql"]
+            if not any(f'"{table}"' in sql for table in INDEXED_TABLES):
+                continue
+            for line in explain(sql):
+                match = re.match(r"(SCAN|SEARCH) (\w+)\b(.*)", line)
+                if not match or match.group(2) not in INDEXED_TABLES:
+                    continue
+                checked += 1
+                kind, table, rest = match.groups()
+                self.assertEqual(kind, "SEARCH", f"{url}: full scan in plan {line!r}\n{sql}")
+                self.assertRegex(
+                    rest, rf"USING (COVERING )?INDEX {INDEXED_TABLES[table]}",
+                    f"{url}: expected index not used in plan {line!r}\n{sql}",
+                )
+        self.assertTrue(checked, f"{url}: no indexed-table queries captured")
+
+    def test_expense_list(self):
+        self.assertIndexedPlans("/api/expenses/")
+
+    def test_expense_list_cursor_page(self):
+        first = self.client.get("/api/expenses/?page_size=10").json()
+        self.assertIndexedPlans(first["next"])
+
+    def test_expense_list_date_range(self):
+        self.assertIndexedPlans("/api/expenses/?start_date=2020-01-01&end_date=2030-12-31")
+
+    def test_expense_total(self):
+        self.assertIndexedPlans("/api/expenses/total/")
+
+    def test_summary_stats(self):
+        self.assertIndexedPlans("/api/expenses/summary_stats/")
+
+    def test_summary_stats_partial_month(self):
+        self.assertIndexedPlans("/api/expenses/summary_stats/?start_date=2020-01-15")
+
+    def test_analytics(self):
+        self.assertIndexedPlans("/api/expenses/analytics/")
+
+    def test_export_csv(self):
+        self.assertIndexedPlans("/api/expenses/export_csv/")
+
+    def test_income_list(self):
+        self.assertIndexedPlans("/api/income/")
+
+    def test_ledger_export(self):
+        self.assertIndexedPlans("/api/ledger/export_csv/?start_date=2020-01-01")
+
+    def test_ledger_page(self):
+        first = self.client.get("/api/ledger/?page_size=10").json()
+        self.assertIndexedPlans(first["next"])
+
+    def test_income_summary(self):
+        self.assertIndexedPlans("/api/income/summary/")
+
+    def test_budget_progress(self):
+        self.assertIndexedPlans("/api/budgets/progress/")
+
+
+class KeysetPaginationTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("pager", password="x")
+        cls.food = Category.objects.create(user=cls.user, name="Food", transaction_type="EXPENSE")
+        # several rows per day so the id tiebreaker matters
+        Expense.objects.bulk_create([
+            Expense(user=cls.user, category=cls.food, title=f"e{i}", amount=Decimal("1.00"), date=date(2025, 1, 1 + i // 3))
+            for i in range(25)
+        ])
+
+
+    def walk(self, url):
+        ids, pages = [], 0
+        while url:
+            body = self.client.get(url).json()
+            ids += [row["id"] for row in body["results"]]
+            url = body["next"]
+            pages += 1
+        return ids, pages
+
+    def test_unpaginated_without_params(self):
+        response = self.client.get("/api/expenses/")
+        self.assertIsInstance(response.json(), list)
+        self.assertEqual(len(response.json()), 25)
+
+    def test_walks_every_row_once_in_order(self):
+        expected = list(Expense.objects.order_by("-date", "-id").values_list("id", flat=True))
+        ids, pages = self.walk("/api/expenses/?page_size=4")
+        self.assertEqual(ids, expected)
+        self.assertEqual(pages, 7)
+
+    def test_previous_link_returns_prior_page(self):
+        first = self.client.get("/api/expenses/?page_size=4").json()
+        self.assertIsNone(first["previous"])
+        second = self.client.get(first["next"]).json()
+        back = self.client.get(second["previous"]).json()
+        self.assertEqual(back["results"], first["results"])
+
+    def test_cursor_stable_across_inserts(self):
+        first = self.client.get("/api/expenses/?page_size=5").json()
+        Expense.objects.create(user=self.user, category=self.food, title="new", amount=Decimal("1.00"), date=date(2025, 2, 1))
+        ids, _ = self.walk(first["next"])
+        seen = [row["id"] for row in first["results"]] + ids
+        self.assertEqual(len(seen), len(set(seen)))
+        self.assertEqual(len(seen), 25)
+
+    def test_honours_date_filters(self):
+        ids, _ = self.walk("/api/expenses/?page_size=2&start_date=2025-01-03&end_date=2025-01-04")
+        self.assertEqual(len(ids), 6)
+
+    def test_invalid_cursor(self):
+        response = self.client.get("/api/expenses/?cursor=garbage")
+        self.assertEqual(response.status_code, 404)
+
+
+class LedgerTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("ledger", password="x")
+        food = Category.objects.create(user=cls.user, name="Food", transaction_type="EXPENSE")
+        salary = Category.objects.create(user=cls.user, name="Salary", transaction_type="INCOME")
+        other = User.objects.create_user("ledger-other", password="x")
+        # same dates across both tables and several months, so the type tiebreaker and the rollups matter
+        for i in range(12):
+            day = date(2025, 1 + i // 4, 1 + i % 2)
+            Expense.objects.create(user=cls.user, category=food if i % 3 else None, title=f"e{i}", amount=Decimal("12.25") + i, date=day)
+            Income.objects.create(user=cls.user, category=salary, title=f"i{i}", amount=Decimal("20.00"), date=day)
+        Income.objects.create(user=other, title="other", amount=Decimal("99.00"), date=date(2025, 1, 1))
+
+    def expected(self, start=date.min, end=date.max):
+        rows = [("EXPENSE", e.id, e.date, -e.amount) for e in Expense.objects.filter(user=self.user)]
+        rows += [("INCOME", i.id, i.date, i.amount) for i in Income.objects.filter(user=self.user)]
+        rows.sort(key=lambda row: (row[2], row[0], row[1]))
+        balance, entries = Decimal("0"), []
+        for kind, pk, day, signed in rows:
+            balance += signed
+            if start <= day <= end:
+                entries.append((kind, pk, str(balance)))
+        return entries[::-1]
+
+    def walk(self, url):
+        entries, pages = [], 0
+        while url:
+            with CaptureQueriesContext(connection) as ctx:
+                body = self.client.get(url).json()
+            self.assertEqual(len(ctx.captured_queries), 1)
+            entries += [(row["type"], row["id"], row["balance"]) for row in body["results"]]
+            url = body["next"]
+            pages += 1
+        return entries, pages
+
+    def test_pages_merge_both_tables_with_running_balance(self):
+        entries, pages = self.walk("/api/ledger/?page_size=5")
+        self.assertEqual(entries, self.expected())
+        self.assertEqual(pages, 5)
+
+        first = self.client.get("/api/ledger/?page_size=5").json()
+        second = self.client.get(first["next"]).json()
+        self.assertEqual(self.client.get(second["previous"]).json()["results"], first["results"])
+        self.assertEqual(first["results"][0]["category_name"], "Salary")
+
+    def test_date_range_keeps_the_all_time_balance(self):
+        entries, _ = self.walk("/api/ledger/?page_size=3&start_date=2025-02-01&end_date=2025-02-28")
+        self.assertEqual(entries, self.expected(date(2025, 2, 1), date(2025, 2, 28)))
+        self.assertEqual(len(entries), 8)
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.client.get("/api/ledger/?cursor=garbage").status_code, 404)
+        self.assertEqual(self.client.get("/api/ledger/?start_date=soon").status_code, 400)
+
+
+class TransactionSearchTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("searcher", password="x")
+        cls.food = Category.objects.create(user=cls.user, name="Food", transaction_type="EXPENSE")
+        other = User.objects.create_user("searcher-other", password="x")
+        for i, title in enumerate(["Starbucks", "Star Market weekly shop", "Star Market", "Pizza Star", "Bakery"]):
+            Expense.objects.create(user=cls.user, category=cls.food, title=title, amount=Decimal(10 + i), date=date(2025, 1, 1 + i))
+        Income.objects.create(user=cls.user, title="Stardust royalties", amount=Decimal("50.00"), date=date(2025, 2, 1))
+        Expense.objects.create(user=other, category=cls.food, title="Star Market", amount=Decimal("1.00"), date=date(2025, 1, 1))
+
+    def titles(self, query):
+        response = self.client.get("/api/search/?" + query)
+        self.assertEqual(response.status_code, 200, response.content)
+        return [row["title"] for row in response.json()]
+
+    def test_prefix_match_ranked_and_scoped_to_user(self):
+        # whole-word matches first, then shorter titles, then newest
+        self.assertEqual(self.titles("q=star"), ["Pizza Star", "Star Market", "Star Market weekly shop", "Starbucks", "Stardust royalties"])
+        self.assertEqual(self.titles("q=sta+mar"), ["Star Market", "Star Market weekly shop"])
+        self.assertEqual(self.titles("q=star&type=INCOME"), ["Stardust royalties"])
+
+    def test_filters(self):
+        self.assertEqual(self.titles("q=star&min_amount=11&max_amount=12&end_date=2025-01-02"), ["Star Market weekly shop"])
+        self.assertEqual(self.titles(f"q=star&category={self.food.pk}&limit=1"), ["Pizza Star"])
+        response = self.client.get("/api/search/?q=star&min_amount=5&max_amount=1")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get("/api/search/?q=%2A%2A").status_code, 400)
+
+    def test_index_follows_writes(self):
+        bakery = Expense.objects.get(title="Bakery")
+        bakery.title = "Starlight Bakery"
+        bakery.save()
+        Expense.objects.filter(title="Starbucks").delete()
+        # raw inserts (imports, the synthetic data generator) are indexed by the triggers
+        synthetic.insert(Expense, self.user, [(self.food, date(2025, 3, 1), "Star Cafe", Decimal("3.00"))], 10)
+        self.assertEqual(self.titles("q=starl"), ["Starlight Bakery"])
+        self.assertEqual(self.titles("q=starb"), [])
+        self.assertEqual(self.titles("q=star+cafe"), ["Star Cafe"])
+
+    def test_only_recent_candidates_are_ranked(self):
+        for day, title in ((10, "Starfish"), (11, "Starling")):
+            Expense.objects.create(user=self.user, category=self.food, title=title, amount=Decimal("1.00"), date=date(2025, 1, day))
+        self.assertEqual(self.titles("q=star&limit=1"), ["Pizza Star"])
+        # the whole-word match is older than the newest CANDIDATES prefix matches
+        with unittest.mock.patch.object(search, "CANDIDATES", 2):
+            self.assertEqual(self.titles("q=star&limit=1"), ["Starling"])
+
+    @unittest.skipUnless(connection.vendor == "sqlite", "FTS5 triggers are SQLite only")
+    def test_triggers_survive_migrations(self):
+        # a migration that remakes expenses_expense or expenses_income drops them
+        self.assertEqual(search.check_triggers(databases=["default"]), [])
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TRIGGER expenses_income_search_update")
+        self.assertEqual([error.id for error in search.check_triggers(databases=["default"])], ["expenses.E001"])
+
+
+class MonthlyRollupTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("roller", password="x")
+        cls.food = Category.objects.create(user=cls.user, name="Food", transaction_type="EXPENSE")
+        cls.rent = Category.objects.create(user=cls.user, name="Rent", transaction_type="EXPENSE")
+        cls.salary = Category.objects.create(user=cls.user, name="Salary", transaction_type="INCOME")
+
+
+    def bucket(self, category, month, transaction_type="EXPENSE"):
+        return MonthlyRollup.objects.filter(
+            user=self.user, category=category, month=month, transaction_type=transaction_type,
+        ).values_list("total", "count").first()
+
+    def test_create_update_delete(self):
+        expense = Expense.objects.create(user=self.user, category=self.food, title="a", amount=Decimal("10.00"), date=date(2025, 3, 4))
+        Expense.objects.create(user=self.user, category=self.food, title="b", amount=Decimal("5.50"), date=date(2025, 3, 20))
+        self.assertEqual(self.bucket(self.food, date(2025, 3, 1)), (Decimal("15.50"), 2))
+
+        expense.category = self.rent
+        expense.date = date(2025, 4, 1)
+        expense.amount = Decimal("12.00")
+        expense.save()
+        self.assertEqual(self.bucket(self.food, date(2025, 3, 1)), (Decimal("5.50"), 1))
+        self.assertEqual(self.bucket(self.rent, date(2025, 4, 1)), (Decimal("12.00"), 1))
+
+        expense.delete()
+        self.assertIsNone(self.bucket(self.rent, date(2025, 4, 1)))
+        self.assertEqual(rollups.verify(), {})
+
+    def test_income_tracked_separately(self):
+        Income.objects.create(user=self.user, category=self.salary, title="pay", amount=Decimal("900.00"), date=date(2025, 3, 1))
+        self.assertEqual(self.bucket(self.salary, date(2025, 3, 1), "INCOME"), (Decimal("900.00"), 1))
+        self.assertEqual(rollups.verify(), {})
+
+    def test_category_delete_moves_to_uncategorised(self):
+        Expense.objects.create(user=self.user, category=self.food, title="a", amount=Decimal("3.00"), date=date(2025, 3, 4))
+        Expense.objects.create(user=self.user, category=None, title="b", amount=Decimal("4.00"), date=date(2025, 3, 5))
+        self.food.delete()
+        self.assertEqual(self.bucket(None, date(2025, 3, 1)), (Decimal("7.00"), 2))
+        self.assertEqual(rollups.verify(), {})
+
+    def test_endpoints_match_raw_tables(self):
+        for i in range(12):
+            Expense.objects.create(
+                user=self.user, category=self.food if i % 2 else self.rent, title=f"e{i}",
+                amount=Decimal("2.25") * (i + 1), date=date(2025, 1 + i % 3, 1 + i),
+            )
+        stats = self.client.get("/api/expenses/summary_stats/?start_date=2025-02-01&end_date=2025-03-31").json()
+        raw = Expense.objects.filter(date__gte=date(2025, 2, 1), date__lte=date(2025, 3, 31))
+        self.assertEqual(Decimal(str(stats["total"])), raw.aggregate(Sum("amount"))["amount__sum"])
+        self.assertEqual(stats["count"], raw.count())
+
+        analytics = self.client.get("/api/expenses/analytics/").json()
+        self.assertEqual(
+            {row["category__name"]: Decimal(row["total"]) for row in analytics["by_category"]},
+            dict(Expense.objects.values_list("category__name").annotate(Sum("amount"))),
+        )
+
+    def test_rebuild_command(self):
+        Expense.objects.create(user=self.user, category=self.food, title="a", amount=Decimal("3.00"), date=date(2025, 3, 4))
+        MonthlyRollup.objects.update(total=Decimal("99.00"))
+        with self.assertRaises(CommandError):
+            call_command("rebuild_rollups", "--verify", stdout=StringIO())
+        call_command("rebuild_rollups", stdout=StringIO())
+        call_command("rebuild_rollups", "--verify", stdout=StringIO())
+        self.assertEqual(self.bucket(self.food, date(2025, 3, 1)), (Decimal("3.00"), 1))
+
+
+class CsvExportTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("exporter", password="x")
+        food = Category.objects.create(user=cls.user, name="Food", transaction_type="EXPENSE")
+        Expense.objects.create(user=cls.user, category=food, title="Lunch, big", amount=Decimal("12.50"), date=date(2025, 3, 2))
+        Expense.objects.create(user=cls.user, category=None, title="Misc", amount=Decimal("1.00"), date=date(2025, 3, 5))
+        Income.objects.create(user=cls.user, category=None, title="Pay", amount=Decimal("500.00"), date=date(2025, 3, 3))
+
+
+    def fetch(self, url):
+        response = self.client.get(url)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Type"], "text/csv")
+        return b"".join(response.streaming_content).decode().splitlines()
+
+    def test_expense_export(self):
+        self.assertEqual(self.fetch("/api/expenses/export_csv/"), [
+            "Date,Title,Category,Amount",
+            "2025-03-05,Misc,N/A,1.00",
+            '2025-03-02,"Lunch, big",Food,12.50',
+        ])
+
+    def test_income_export_honours_dates(self):
+        self.assertEqual(self.fetch("/api/income/export_csv/?end_date=2025-03-02"), ["Date,Title,Category,Amount"])
+        self.assertEqual(len(self.fetch("/api/income/export_csv/?start_date=2025-03-03")), 2)
+
+    def test_ledger_export_merges_by_date(self):
+        self.assertEqual(self.fetch("/api/ledger/export_csv/"), [
+            "Date,Type,Title,Category,Amount",
+            "2025-03-05,Expense,Misc,N/A,1.00",
+            "2025-03-03,Income,Pay,N/A,500.00",
+            '2025-03-02,Expense,"Lunch, big",Food,12.50',
+        ])
+
+
+class BulkEndpointTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("importer", password="x")
+        cls.other = User.objects.create_user("someone", password="x")
+        cls.food = Category.objects.create(user=cls.user, name="Food", transaction_type="EXPENSE")
+        cls.shared = Category.objects.create(user=None, name="Misc", transaction_type="EXPENSE")
+        cls.foreign = Category.objects.create(user=cls.other, name="Theirs", transaction_type="EXPENSE")
+        cls.salary = Category.objects.create(user=cls.user, name="Salary", transaction_type="INCOME")
+
+
+    def test_create_reports_row_errors_without_aborting(self):
+        rows = [
+            {"title": f"t{i}", "amount": "1.50", "date": "2025-05-01", "category": self.food.id}
+            for i in range(200)
+        ]
+        rows[3]["category"] = self.foreign.id
+        rows[7]["amount"] = "nope"
+        rows.append({"title": "shared", "amount": "2.00", "date": "2025-05-02", "category": self.shared.id})
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post("/api/expenses/bulk/", rows, format="json")
+        self.assertEqual(response.status_code, 201)
+        body = response.json()
+        self.assertEqual([e["index"] for e in body["errors"]], [3, 7])
+        self.assertIn("category", body["errors"][0]["errors"])
+        self.assertEqual(len(body["created"]), 199)
+        self.assertEqual(Expense.objects.filter(user=self.user).count(), 199)
+        self.assertLess(len(ctx.captured_queries), 20)
+        self.assertEqual(rollups.verify(), {})
+
+    def test_update(self):
+        expense = Expense.objects.create(user=self.user, category=self.food, title="a", amount=Decimal("1.00"), date=date(2025, 5, 1))
+        theirs = Expense.objects.create(user=self.other, category=self.foreign, title="b", amount=Decimal("1.00"), date=date(2025, 5, 1))
+        response = self.client.patch("/api/expenses/bulk/", [
+            {"id": expense.id, "amount": "9.00", "category": self.shared.id, "date": "2025-06-03"},
+            {"id": theirs.id, "amount": "9.00"},
+        ], format="json")
+        self.assertEqual(response.json()["updated"], [expense.id])
+        self.assertEqual(response.json()["errors"][0]["index"], 1)
+        expense.refresh_from_db()
+        self.assertEqual((expense.amount, expense.category_id, expense.date), (Decimal("9.00"), self.shared.id, date(2025, 6, 3)))
+        self.assertEqual(rollups.verify(), {})
+
+    def test_update_rejects_repeated_ids(self):
+        expense = Expense.objects.create(user=self.user, category=self.food, title="a", amount=Decimal("10.00"), date=date(2025, 5, 1))
+        response = self.client.patch("/api/expenses/bulk/", [
+            {"id": expense.id, "amount": "20.00"},
+            {"id": expense.id, "amount": "30.00"},
+        ], format="json")
+        self.assertEqual(response.json()["updated"], [expense.id])
+        self.assertEqual(response.json()["errors"], [{"index": 1, "errors": {"id": ["Repeated in this batch."]}}])
+        expense.refresh_from_db()
+        self.assertEqual(expense.amount, Decimal("20.00"))
+        rollup = MonthlyRollup.objects.get(user=self.user, category=self.food, month=date(2025, 5, 1))
+        self.assertEqual((rollup.total, rollup.count), (Decimal("20.00"), 1))
+        self.assertEqual(rollups.verify(), {})
+
+    def test_malformed_ids_are_row_errors(self):
+        # pk 1, which a JSON true would address if bools passed as ids
+        expense = Expense.objects.create(pk=1, user=self.user, category=self.food, title="a", amount=Decimal("1.00"), date=date(2025, 5, 1))
+        bad = [[expense.id], {"a": expense.id}, True]
+        response = self.client.patch("/api/expenses/bulk/", [{"id": pk, "amount": "9.00"} for pk in bad], format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["errors"], [{"index": i, "errors": {"id": ["Invalid id."]}} for i in range(3)])
+
+        response = self.client.delete("/api/expenses/bulk/", {"ids": bad}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"deleted": [], "errors": [{"id": pk, "errors": "Invalid id."} for pk in bad]})
+        expense.refresh_from_db()
+        self.assertEqual(expense.amount, Decimal("1.00"))
+
+    def test_delete(self):
+        mine = Income.objects.create(user=self.user, category=self.salary, title="a", amount=Decimal("1.00"), date=date(2025, 5, 1))
+        theirs = Income.objects.create(user=self.other, category=None, title="b", amount=Decimal("1.00"), date=date(2025, 5, 1))
+        response = self.client.delete("/api/income/bulk/", {"ids": [mine.id, theirs.id]}, format="json")
+        self.assertEqual(response.json()["deleted"], [mine.id])
+        self.assertEqual(response.json()["errors"], [{"id": theirs.id, "errors": "Not found."}])
+        self.assertTrue(Income.objects.filter(pk=theirs.id).exists())
+        self.assertEqual(rollups.verify(), {})
+
+    def test_rejects_non_list(self):
+        response = self.client.post("/api/expenses/bulk/", {"title": "x"}, format="json")
+        self.assertEqual(response.status_code, 400)
+
+
+class ResponseCacheTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("poller", password="x")
+        cls.other = User.objects.create_user("bystander", password="x")
+        cls.food = Category.objects.create(user=cls.user, name="Food", transaction_type="EXPENSE")
+        Expense.objects.create(user=cls.user, category=cls.food, title="a", amount=Decimal("4.00"), date=now().date())
+
+    def test_hit_runs_no_queries(self):
+        first = self.client.get("/api/expenses/summary_stats/")
+        self.assertEqual(first["X-Cache"], "MISS")
+        with self.assertNumQueries(0):
+            second = self.client.get("/api/expenses/summary_stats/")
+        self.assertEqual(second["X-Cache"], "HIT")
+        self.assertEqual(first.json(), second.json())
+        self.assertEqual(caching.stats()["ExpenseViewSet.summary_stats"], {"hits": 1, "misses": 1})
+
+    def test_keyed_by_query_params_and_user(self):
+        self.client.get("/api/expenses/total/")
+        self.assertEqual(self.client.get("/api/expenses/total/?start_date=2000-01-01")["X-Cache"], "MISS")
+        self.client.force_authenticate(self.other)
+        response = self.client.get("/api/expenses/total/")
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertEqual(response.json(), {"total_expenses": 0})
+
+    def test_writes_invalidate(self):
+        total = lambda: Decimal(str(self.client.get("/api/expenses/total/").json()["total_expenses"]))
+        self.assertEqual(total(), Decimal("4.00"))
+        self.client.post("/api/expenses/", {"title": "b", "category": self.food.id, "amount": "6.00", "date": "2025-01-01"})
+        self.assertEqual(total(), Decimal("10.00"))
+
+        self.client.get("/api/budgets/progress/")
+        self.client.post("/api/budgets/", {"category": self.food.id, "amount": "50.00"})
+        progress = self.client.get("/api/budgets/progress/")
+        self.assertEqual(progress["X-Cache"], "MISS")
+        self.assertEqual(progress.json()[0]["budget_limit"], "50.00")
+
+    def test_other_users_writes_keep_cache(self):
+        self.client.get("/api/income/summary/")
+        Expense.objects.create(user=self.other, category=None, title="x", amount=Decimal("1.00"), date=now().date())
+        caching.bump_version(self.other.pk)
+        self.assertEqual(self.client.get("/api/income/summary/")["X-Cache"], "HIT")
+
+    def test_stats_endpoint_is_admin_only(self):
+        self.assertEqual(self.client.get("/api/cache/stats/").status_code, 403)
+        self.user.is_staff = True
+        self.assertEqual(self.client.get("/api/cache/stats/").status_code, 200)
+
+
+class ConditionalGetTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("mobile", password="x")
+        cls.food = Category.objects.create(user=cls.user, name="Food", transaction_type="EXPENSE")
+        Expense.objects.create(user=cls.user, category=cls.food, title="a", amount=Decimal("4.00"), date=date(2025, 1, 1))
+
+    def test_matching_etag_skips_the_view(self):
+        first = self.client.get("/api/expenses/")
+        etag = first["ETag"]
+        self.assertTrue(etag.startswith('"'))
+
+        with self.assertNumQueries(0):
+            second = self.client.get("/api/expenses/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second.content, b"")
+        self.assertEqual(second["ETag"], etag)
+
+    def test_etag_differs_per_url(self):
+        self.assertNotEqual(self.client.get("/api/expenses/")["ETag"], self.client.get("/api/category/")["ETag"])
+
+    def test_write_changes_etag(self):
+        etag = self.client.get("/api/category/")["ETag"]
+        self.client.post("/api/category/", {"name": "Rent", "transaction_type": "EXPENSE"})
+        response = self.client.get("/api/category/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_if_modified_since_is_not_honoured(self):
+        # whole seconds cannot tell apart writes made within the same second
+        first = self.client.get("/api/budgets/progress/")
+        self.assertNotIn("Last-Modified", first)
+        response = self.client.get("/api/budgets/progress/", HTTP_IF_MODIFIED_SINCE="Thu, 01 Jan 2099 00:00:00 GMT")
+        self.assertEqual(response.status_code, 200)
+
+    def test_shared_category_write_changes_etag(self):
+        shared = Category.objects.create(user=None, name="Misc", transaction_type="EXPENSE")
+        Expense.objects.create(user=self.user, category=shared, title="b", amount=Decimal("1.00"), date=date(2025, 1, 2))
+        etag = self.client.get("/api/expenses/")["ETag"]
+        shared.name = "Sundries"
+        shared.save()
+        response = self.client.get("/api/expenses/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("Sundries", [row["category_name"] for row in response.json()])
+
+    def test_no_etag_on_writes(self):
+        response = self.client.post("/api/category/", {"name": "Gym", "transaction_type": "EXPENSE"})
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn("ETag", response)
+
+
+class DeltaSyncTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("syncer", password="x")
+        cls.food = Category.objects.create(user=cls.user, name="Food", transaction_type="EXPENSE")
+        cls.lunch = Expense.objects.create(user=cls.user, category=cls.food, title="lunch", amount=Decimal("4.00"), date=date(2025, 1, 1))
+
+    def sync(self, token=None):
+        response = self.client.get("/api/sync/" + (f"?since={token}" if token else ""))
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def age(self, seconds):
+        # push existing rows out of the overlap window
+        past = now() - timedelta(seconds=seconds)
+        for model in (Expense, Income, Category, Budget):
+            model.objects.update(updated_at=past)
+        Tombstone.objects.update(deleted_at=past)
+
+    def test_snapshot_then_delta(self):
+        snapshot = self.sync()
+        self.assertTrue(snapshot["reset"])
+        self.assertEqual([row["id"] for row in snapshot["expenses"]["upserts"]], [self.lunch.id])
+
+        self.age(60)
+        token = str(int((now() - timedelta(seconds=30)).timestamp() * 1_000_000))
+        self.assertEqual(self.sync(token)["expenses"], {"upserts": [], "deletes": []})
+
+        dinner = Expense.objects.create(user=self.user, category=self.food, title="dinner", amount=Decimal("9.00"), date=date(2025, 1, 2))
+        lunch_id = self.lunch.id
+        self.lunch.delete()
+        budget = Budget.objects.create(user=self.user, category=self.food, amount=Decimal("100.00"))
+        delta = self.sync(token)
+        self.assertFalse(delta["reset"])
+        self.assertEqual([row["id"] for row in delta["expenses"]["upserts"]], [dinner.id])
+        self.assertEqual(delta["expenses"]["deletes"], [lunch_id])
+        self.assertEqual([row["id"] for row in delta["budgets"]["upserts"]], [budget.id])
+        self.assertEqual(delta["categories"]["upserts"], [])
+
+    def test_category_delete_touches_transactions(self):
+        self.age(60)
+        token = str(int((now() - timedelta(seconds=30)).timestamp() * 1_000_000))
+        Budget.objects.create(user=self.user, category=self.food, amount=Decimal("100.00"))
+        food_id = self.food.id
+        self.food.delete()
+        delta = self.sync(token)
+        self.assertEqual(delta["categories"]["deletes"], [food_id])
+        self.assertEqual(len(delta["budgets"]["deletes"]), 1)
+        self.assertEqual(delta["expenses"]["upserts"][0]["category"], None)
+
+    def test_bulk_delete_leaves_tombstones(self):
+        self.client.delete("/api/expenses/bulk/", {"ids": [self.lunch.id]}, format="json")
+        self.assertEqual(self.sync("1")["expenses"]["deletes"], [])
+        self.assertTrue(Tombstone.objects.filter(kind="expense", object_id=self.lunch.id).exists())
+
+    def test_old_token_resets(self):
+        self.assertTrue(self.sync("1")["reset"])
+
+    def test_invalid_token(self):
+        self.assertEqual(self.client.get("/api/sync/?since=abc").status_code, 400)
+
+
+class AnalyticsSeriesTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("analyst", password="x")
+        food = Category.objects.create(user=cls.user, name="Food", transaction_type="EXPENSE")
+        rent = Category.objects.create(user=cls.user, name="Rent", transaction_type="EXPENSE")
+        for day, category, amount in [
+            (date(2024, 3, 10), food, "30.00"),
+            (date(2025, 1, 5), food, "10.00"),
+            (date(2025, 1, 6), rent, "100.00"),
+            (date(2025, 3, 2), food, "60.00"),
+            (date(2025, 3, 20), food, "20.00"),
+        ]:
+            Expense.objects.create(user=cls.user, category=category, title="t", amount=Decimal(amount), date=day)
+
+    def analytics(self, query=""):
+        response = self.client.get("/api/expenses/analytics/" + query)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_months_of_different_years_stay_apart_and_gaps_fill(self):
+        # the series and its previous-year window
+        with self.assertNumQueries(2):
+            data = self.analytics("?start_date=2025-01-01&end_date=2025-04-30")
+        self.assertEqual(
+            [(p["year"], p["month"], Decimal(str(p["total"]))) for p in data["by_month"]],
+            [(2025, 1, Decimal("110")), (2025, 2, Decimal("0")), (2025, 3, Decimal("80")), (2025, 4, Decimal("0"))],
+        )
+        march = data["by_month"][2]
+        self.assertEqual(Decimal(str(march["previous_year"])), Decimal("30"))
+        self.assertEqual(Decimal(str(march["yoy_change"])), Decimal("166.7"))
+        self.assertEqual(Decimal(str(march["rolling_average"])), Decimal("63.33"))
+
+    def test_mid_month_start_excludes_earlier_rows(self):
+        data = self.analytics("?start_date=2025-03-15&end_date=2025-03-31")
+        march = data["by_month"][0]
+        self.assertEqual(Decimal(str(march["total"])), Decimal("20"))
+        # the previous-year column still compares against the whole month
+        self.assertEqual(Decimal(str(march["previous_year"])), Decimal("30"))
+        series = {row["category__name"]: [Decimal(str(v)) for v in row["totals"]] for row in data["category_series"]}
+        self.assertEqual(series, {"Food": [Decimal("20")]})
+
+    def test_category_series_align_with_points(self):
+        data = self.analytics("?start_date=2025-01-01&end_date=2025-03-31")
+        series = {row["category__name"]: [Decimal(str(v)) for v in row["totals"]] for row in data["category_series"]}
+        self.assertEqual(series["Food"], [Decimal("10"), Decimal("0"), Decimal("80")])
+        self.assertEqual(series["Rent"], [Decimal("100"), Decimal("0"), Decimal("0")])
+        self.assertEqual(data["by_category"][0]["category__name"], "Rent")
+
+    def test_week_granularity_reads_raw_rows(self):
+        with self.assertNumQueries(1):
+            data = self.analytics("?granularity=week&start_date=2025-03-01&end_date=2025-03-23&window=2")
+        self.assertNotIn("by_month", data)
+        self.assertEqual(
+            [(p["period"], Decimal(str(p["total"]))) for p in data["by_period"]],
+            [("2025-02-24", Decimal("60")), ("2025-03-03", Decimal("0")), ("2025-03-10", Decimal("0")), ("2025-03-17", Decimal("20"))],
+        )
+        self.assertEqual(Decimal(str(data["by_period"][1]["rolling_average"])), Decimal("30.00"))
+
+    def test_full_history_without_bounds(self):
+        data = self.analytics()
+        self.assertEqual(len(data["by_month"]), 13)
+        self.assertEqual(data["by_month"][0]["period"], "2024-03-01")
+
+    def test_rejects_bad_parameters(self):
+        for query in ("?granularity=year", "?window=0", "?start_date=nope", "?granularity=day&start_date=2000-01-01&end_date=2025-01-01"):
+            self.assertEqual(self.client.get("/api/expenses/analytics/" + query).status_code, 400, query)
+
+
+class SummaryEngineTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("summarist", password="x")
+        food = Category.objects.create(user=cls.user, name="Food", transaction_type="EXPENSE")
+        shared_food = Category.objects.create(user=None, name="Food", transaction_type="EXPENSE")
+        salary = Category.objects.create(user=cls.user, name="Salary", transaction_type="INCOME")
+        for day, category, amount in [
+            (date(2025, 1, 5), food, "0.10"),
+            (date(2025, 1, 6), shared_food, "0.20"),
+            (date(2025, 2, 1), None, "5.00"),
+            (date(2025, 3, 1), food, "100.05"),
+        ]:
+            Expense.objects.create(user=cls.user, category=category, title="t", amount=Decimal(amount), date=day)
+        Income.objects.create(user=cls.user, category=salary, title="pay", amount=Decimal("1000.00"), date=date(2025, 1, 31))
+        Income.objects.create(user=cls.user, category=None, title="gift", amount=Decimal("50.00"), date=date(2025, 3, 2))
+
+    def test_summary_stats_in_one_query(self):
+        with self.assertNumQueries(1):
+            data = self.client.get("/api/expenses/summary_stats/").json()
+        self.assertEqual(data["total"], 105.35)
+        self.assertEqual(data["count"], 4)
+        self.assertEqual(Decimal(str(data["average"])), Decimal("26.34"))
+        self.assertEqual((Decimal(str(data["min"])), Decimal(str(data["max"]))), (Decimal("0.10"), Decimal("100.05")))
+        self.assertEqual(Decimal(str(data["median"])), Decimal("2.60"))
+        self.assertEqual(
+            [(row["category__name"], Decimal(str(row["total"]))) for row in data["by_category"]],
+            [("Food", Decimal("100.35")), (None, Decimal("5.00"))],
+        )
+
+    def test_odd_count_median_and_date_filter(self):
+        data = self.client.get("/api/expenses/summary_stats/?start_date=2025-01-06").json()
+        self.assertEqual(data["count"], 3)
+        self.assertEqual(Decimal(str(data["median"])), Decimal("5.00"))
+
+    def test_income_summary_honours_dates(self):
+        with self.assertNumQueries(1):
+            data = self.client.get("/api/income/summary/?end_date=2025-02-28").json()
+        self.assertEqual(Decimal(str(data["total_income"])), Decimal("1000.00"))
+        self.assertEqual(Decimal(str(data["total_expense"])), Decimal("5.30"))
+        self.assertEqual(Decimal(str(data["net_income"])), Decimal("994.70"))
+        self.assertEqual(data["income"]["count"], 1)
+
+    def test_empty_range(self):
+        data = self.client.get("/api/income/summary/?start_date=2030-01-01").json()
+        self.assertEqual(data["income"]["count"], 0)
+        self.assertIsNone(data["income"]["median"])
+
+    def test_bad_dates(self):
+        self.assertEqual(self.client.get("/api/expenses/summary_stats/?start_date=x").status_code, 400)
+
+
+class CategoryResolverTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("writer", password="x")
+        cls.other = User.objects.create_user("someone", password="x")
+        cls.food = Category.objects.create(user=cls.user, name="Food", transaction_type="EXPENSE")
+        cls.shared = Category.objects.create(user=None, name="Misc", transaction_type="EXPENSE")
+        cls.foreign = Category.objects.create(user=cls.other, name="Theirs", transaction_type="EXPENSE")
+
+    def setUp(self):
+        super().setUp()
+        categories.clear()
+
+    def post(self, category, title="t"):
+        return self.client.post(
+            "/api/expenses/", {"title": title, "category": category, "amount": "3.00", "date": "2025-05-01"}, format="json",
+        )
+
+    def test_writes_skip_the_category_table(self):
+        self.assertEqual(self.post(self.food.id).status_code, 201)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.post(self.shared.id)
+        self.assertEqual(response.json()["category_name"], "Misc")
+        self.assertFalse([q for q in ctx.captured_queries if "expenses_category" in q["sql"]])
+        rows = self.client.get("/api/expenses/").json()
+        self.assertEqual(sorted(row["category_name"] for row in rows), ["Food", "Misc"])
+
+    def test_rejects_foreign_and_unknown_categories(self):
+        self.assertIn("category", self.post(self.foreign.id).json())
+        self.assertIn("category", self.post(10 ** 9).json())
+        self.assertIn("category", self.post("abc").json())
+
+    def test_category_writes_invalidate(self):
+        self.assertEqual(self.post(self.food.id).status_code, 201)
+        created = self.client.post("/api/category/", {"name": "Rent", "transaction_type": "EXPENSE"}, format="json").json()
+        self.assertEqual(self.post(created["id"]).json()["category_name"], "Rent")
+
+        self.client.patch(f"/api/category/{self.food.id}/", {"name": "Groceries"}, format="json")
+        self.assertEqual(self.post(self.food.id).json()["category_name"], "Groceries")
+
+        self.client.delete(f"/api/category/{created['id']}/")
+        self.assertIn("category", self.post(created["id"]).json())
+
+    def test_uncategorised_income_has_no_category_name(self):
+        response = self.client.post("/api/income/", {"title": "gift", "amount": "5.00", "date": "2025-05-01"}, format="json")
+        self.assertEqual(response.status_code, 201)
+        self.assertIsNone(response.json()["category"])
+        self.assertNotIn("category_name", response.json())
+
+
+class FastListTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("reader", password="x")
+        food = Category.objects.create(user=cls.user, name="Food", transaction_type="EXPENSE")
+        salary = Category.objects.create(user=cls.user, name="Salary", transaction_type="INCOME")
+        for i in range(30):
+            Expense.objects.create(
+                user=cls.user, category=food, title=f"e{i} \u00e9\"", amount=Decimal("1.05") * i, date=date(2025, 1, 1) + timedelta(days=i % 7),
+            )
+            Income.objects.create(
+                user=cls.user, category=salary if i % 2 else None, title=f"i{i}", amount=Decimal("100.10") + i, date=date(2025, 2, 1),
+            )
+
+    def assertSameAsSerializer(self, url):
+        fast = self.client.get(url)
+        for viewset in (ExpenseViewSet, IncomeViewSet):
+            viewset.fast_list = False
+        try:
+            slow = self.client.get(url)
+        finally:
+            for viewset in (ExpenseViewSet, IncomeViewSet):
+                viewset.fast_list = True
+        self.assertEqual(fast.status_code, 200)
+        self.assertEqual(fast.content, slow.content)
+        return fast
+
+    def test_byte_identical(self):
+        for url in ("/api/expenses/", "/api/income/", "/api/expenses/?start_date=2025-01-03", "/api/income/?ordering=ignored"):
+            with self.subTest(url=url):
+                self.assertSameAsSerializer(url)
+        rows = self.client.get("/api/income/").json()
+        self.assertNotIn("category_name", [row for row in rows if row["category"] is None][0])
+
+    def test_paginated_pages_match(self):
+        first = self.assertSameAsSerializer("/api/expenses/?page_size=7").json()
+        self.assertEqual(len(first["results"]), 7)
+        self.assertSameAsSerializer(first["next"].replace("http://testserver", ""))
+
+    def test_one_query(self):
+        with self.assertNumQueries(1):
+            self.client.get("/api/income/")
+
+
+class AsyncViewTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("async", password="x")
+        cls.token = Token.objects.create(user=cls.user)
+        food = Category.objects.create(user=cls.user, name="Food", transaction_type="EXPENSE")
+        salary = Category.objects.create(user=cls.user, name="Salary", transaction_type="INCOME")
+        today = now().date()
+        for i in range(12):
+            Expense.objects.create(user=cls.user, category=food if i % 3 else None, title=f"e{i}", amount=Decimal("2.35") * (i + 1), date=today - timedelta(days=i))
+        Income.objects.create(user=cls.user, category=salary, title="pay", amount=Decimal("900.00"), date=today)
+        Budget.objects.create(user=cls.user, category=food, amount=Decimal("50.00"))
+
+    def setUp(self):
+        super().setUp()
+        self.async_client = AsyncClient()
+
+    def aget(self, url, **headers):
+        return self.async_client.get(url, headers={"authorization": f"Token {self.token.key}", **headers})
+
+    async def test_same_json_as_sync_views(self):
+        for sync_url, async_url in [
+            ("/api/expenses/", "/api/async/expenses/"),
+            ("/api/income/?start_date=2000-01-01", "/api/async/income/?start_date=2000-01-01"),
+            ("/api/expenses/summary_stats/", "/api/async/expenses/summary_stats/"),
+            ("/api/income/summary/", "/api/async/income/summary/"),
+            ("/api/budgets/progress/", "/api/async/budgets/progress/"),
+        ]:
+            with self.subTest(url=async_url):
+                expected = await sync_to_async(self.client.get)(sync_url)
+                response = await self.aget(async_url)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.content, expected.content)
+
+    async def test_pagination(self):
+        first = (await self.aget("/api/async/expenses/?page_size=5")).json()
+        second = (await self.aget(first["next"])).json()
+        self.assertEqual(len(first["results"] + second["results"]), 10)
+        self.assertEqual((await self.aget("/api/async/expenses/?cursor=bad")).status_code, 404)
+
+    async def test_auth_cache_and_conditional_get(self):
+        self.assertEqual((await AsyncClient().get("/api/async/income/summary/")).status_code, 401)
+
+        first = await self.aget("/api/async/income/summary/")
+        second = await self.aget("/api/async/income/summary/", if_none_match=first["ETag"])
+        third = await self.aget("/api/async/income/summary/")
+        self.assertEqual((first["X-Cache"], second.status_code, third["X-Cache"]), ("MISS", 304, "HIT"))
+        self.assertEqual((await self.aget("/api/async/income/summary/?end_date=x")).status_code, 400)
+
+
+class DatabaseProfileTests(unittest.TestCase):
+    # plain unittest: the stress test opens its own connections from threads
+
+
+    def test_production_profile(self):
+        databases = database.sqlite_databases("/srv/db.sqlite3", "production")
+        self.assertIn("journal_mode=WAL", databases["default"]["OPTIONS"]["init_command"])
+        self.assertEqual(databases["default"]["OPTIONS"]["transaction_mode"], "IMMEDIATE")
+        self.assertEqual(databases["replica"]["NAME"], "file:///srv/db.sqlite3?mode=ro")
+        self.assertEqual(database.sqlite_databases("/srv/db.sqlite3")["default"]["NAME"], "/srv/db.sqlite3")
+        with self.assertRaises(ValueError):
+            database.sqlite_databases("/srv/db.sqlite3", "fast")
+
+    def test_router_keeps_transactions_on_the_writer(self):
+        router = database.ReadWriteRouter()
+        self.assertEqual(router.db_for_read(Expense), "replica")
+        self.assertEqual(router.db_for_write(Expense), "default")
+        self.assertFalse(router.allow_migrate("replica", "expenses"))
+
+    def test_concurrent_writers_never_see_locks(self):
+        with tempfile.TemporaryDirectory() as directory:
+            result = database.stress(directory, "production", writers=6, readers=4, seconds=1)
+        self.assertEqual(result["errors"], {})
+        self.assertTrue(result["consistent"])
+        self.assertGreater(result["writes"], 0)
+
+
+class BudgetPeriodTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("planner", password="x")
+        cls.food = Category.objects.create(user=cls.user, name="Food", transaction_type="EXPENSE")
+        rent = Category.objects.create(user=cls.user, name="Rent", transaction_type="EXPENSE")
+        cls.food_budget = Budget.objects.create(user=cls.user, category=cls.food, amount=Decimal("100.00"))
+        Budget.objects.create(user=cls.user, category=rent, amount=Decimal("900.00"))
+        for day, amount in [
+            (date(2025, 1, 10), "0.10"), (date(2025, 1, 20), "0.20"), (date(2025, 2, 5), "33.33"),
+            (date(2025, 3, 31), "50.00"), (date(2025, 4, 1), "7.00"),
+        ]:
+            Expense.objects.create(user=cls.user, category=cls.food, title="t", amount=Decimal(amount), date=day)
+
+    def progress(self, query, status_code=200):
+        response = self.client.get(f"/api/budgets/progress/?{query}")
+        self.assertEqual(response.status_code, status_code)
+        return response.json()
+
+    def test_month_is_exact(self):
+        food, rent = self.progress("month=2025-01")
+        self.assertEqual(
+            (food["budget_limit"], food["actual_limit"], food["remaining"], food["percent"]),
+            ("100.00", "0.30", "99.70", 0.3),
+        )
+        self.assertEqual((rent["actual_limit"], rent["percent"]), ("0.00", 0))
+
+    def test_quarter_and_custom_range(self):
+        food = self.progress("quarter=2025-Q1")[0]
+        self.assertEqual((food["budget_limit"], food["actual_limit"]), ("300.00", "83.63"))
+        # 14 of February's 28 days plus the whole of March
+        food = self.progress("start_date=2025-02-15&end_date=2025-03-31")[0]
+        self.assertEqual((food["budget_limit"], food["actual_limit"]), ("150.00", "50.00"))
+
+    def test_a_year_of_history_in_one_query(self):
+        with self.assertNumQueries(1):
+            food = self.progress("month=2025-04&history=12")[0]
+        self.assertEqual(len(food["history"]), 12)
+        self.assertEqual(food["history"][0]["month"], "2024-05-01")
+        self.assertEqual(
+            [(point["month"], point["actual_limit"]) for point in food["history"][-4:]],
+            [("2025-01-01", "0.30"), ("2025-02-01", "33.33"), ("2025-03-01", "50.00"), ("2025-04-01", "7.00")],
+        )
+        self.assertEqual(food["actual_limit"], "7.00")
+
+    def test_pagination_and_bad_params(self):
+        page = self.progress("month=2025-01&limit=1")
+        self.assertEqual((page["count"], [row["id"] for row in page["results"]]), (2, [self.food_budget.id]))
+        for query in ("month=2025-13", "quarter=2025-Q5", "start_date=2025-02-01", "history=100"):
+            self.progress(query, status_code=400)
+
+
+class BudgetAlertTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("spender", password="x")
+        cls.food = Category.objects.create(user=cls.user, name="Food", transaction_type="EXPENSE")
+        cls.fun = Category.objects.create(user=cls.user, name="Fun", transaction_type="EXPENSE")
+        cls.budget = Budget.objects.create(user=cls.user, category=cls.food, amount=Decimal("100.00"))
+
+    def spend(self, amount, category=None, day="2025-05-10"):
+        response = self.client.post("/api/expenses/", {
+            "title": "t", "category": (category or self.food).id, "amount": amount, "date": day,
+        }, format="json")
+        self.assertEqual(response.status_code, 201)
+        return response.json()["id"]
+
+    def test_writes_only_enqueue(self):
+        self.spend("50.00")
+        self.spend("40.00")
+        self.spend("5.00", day="2025-06-01")
+        self.spend("500.00", category=self.fun)
+        self.assertEqual(AlertEvent.objects.count(), 3)
+        self.assertFalse(BudgetAlert.objects.exists())
+
+        self.assertEqual(alerts.drain(), 3)
+        self.assertFalse(AlertEvent.objects.exists())
+        alert = BudgetAlert.objects.get()
+        self.assertEqual((alert.month, alert.threshold, alert.spent), (date(2025, 5, 1), 80, Decimal("90.00")))
+
+    def test_rows_re_enqueued_during_a_batch_stay_queued(self):
+        self.spend("10.00", day="2025-05-10")
+        self.spend("10.00", day="2025-06-10")
+        may, june = AlertEvent.objects.order_by("month")
+        AlertEvent.objects.filter(pk=may.pk).update(enqueued_at=datetime(2025, 7, 1, 10, 0, tzinfo=dt_timezone.utc))
+        AlertEvent.objects.filter(pk=june.pk).update(enqueued_at=datetime(2025, 7, 1, 10, 5, tzinfo=dt_timezone.utc))
+        # stamped before the batch was read, committed after: newer than May's
+        # old stamp, older than June's
+        restamped = datetime(2025, 7, 1, 10, 2, tzinfo=dt_timezone.utc)
+        bulk_create = BudgetAlert.objects.bulk_create
+
+        def concurrent_write(*args, **kwargs):
+            AlertEvent.objects.filter(pk=may.pk).update(enqueued_at=restamped)
+            return bulk_create(*args, **kwargs)
+
+        with unittest.mock.patch.object(BudgetAlert.objects, "bulk_create", concurrent_write):
+            self.assertEqual(alerts.process(), 2)
+        self.assertEqual(list(AlertEvent.objects.values_list("pk", "enqueued_at")), [(may.pk, restamped)])
+
+    def test_each_threshold_fires_once_per_month(self):
+        self.spend("79.99")
+        alerts.drain()
+        self.assertFalse(BudgetAlert.objects.exists())
+
+        expense_id = self.spend("30.00")
+        alerts.drain()
+        self.assertEqual(sorted(BudgetAlert.objects.values_list("threshold", flat=True)), [80, 100])
+
+        self.client.delete(f"/api/expenses/{expense_id}/")
+        self.spend("30.00")
+        alerts.drain()
+        self.assertEqual(BudgetAlert.objects.count(), 2)
+
+    def test_bulk_writes_enqueue_once_per_bucket(self):
+        rows = [{"title": f"t{i}", "amount": "10.00", "date": "2025-05-02", "category": self.food.id} for i in range(10)]
+        self.client.post("/api/expenses/bulk/", rows, format="json")
+        self.assertEqual(AlertEvent.objects.count(), 1)
+        call_command("process_alerts", "--once", stdout=StringIO())
+        self.assertEqual(sorted(BudgetAlert.objects.values_list("threshold", flat=True)), [80, 100])
+
+    def test_alert_api(self):
+        self.spend("120.00")
+        alerts.drain()
+        listed = self.client.get("/api/alerts/?unread=true").json()
+        self.assertEqual(sorted((row["threshold"], row["category_name"]) for row in listed), [(80, "Food"), (100, "Food")])
+
+        self.assertEqual(self.client.post(f"/api/alerts/{listed[0]['id']}/read/").status_code, 204)
+        self.assertEqual(len(self.client.get("/api/alerts/?unread=true").json()), 1)
+        self.assertEqual(self.client.post("/api/alerts/read_all/").json(), {"marked": 1})
+        self.assertEqual(self.client.get("/api/alerts/?unread=true").json(), [])
+
+
+class JobTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("exporter", password="x")
+        food = Category.objects.create(user=cls.user, name="Food", transaction_type="EXPENSE")
+        for i in range(5):
+            Expense.objects.create(user=cls.user, title=f"e{i}", category=food, amount=Decimal("1.50") * (i + 1), date=date(2025, 5, i + 1))
+        Income.objects.create(user=cls.user, title="pay", amount=Decimal("900.00"), date=date(2025, 5, 3))
+
+    def setUp(self):
+        super().setUp()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        override = self.settings(MEDIA_ROOT=media.name)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_export_job_roundtrip(self):
+        response = self.client.post("/api/jobs/", {"kind": "export", "params": {"source": "ledger"}}, format="json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.json()["status"], response.json()["download_url"]), ("queued", None))
+        job_id = response.json()["id"]
+
+        self.assertEqual(jobs.work(processes=0, once=True), 1)
+        job = self.client.get(f"/api/jobs/{job_id}/").json()
+        self.assertEqual((job["status"], job["progress"], job["result"]["rows"]), ("succeeded", 100, 6))
+
+        download = self.client.get(job["download_url"])
+        self.assertEqual(download["Content-Type"], "application/gzip")
+        exported = gzip.decompress(b"".join(download.streaming_content)).decode()
+        expected = b"".join(self.client.get("/api/ledger/export_csv/").streaming_content).decode()
+        self.assertEqual(exported, expected)
+        self.assertEqual(len(list(csv.reader(exported.splitlines()))), 7)
+
+    def test_invalid_params_and_other_users(self):
+        response = self.client.post("/api/jobs/", {"kind": "export", "params": {"source": "nope"}}, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.post("/api/jobs/", {"kind": "nope"}, format="json").status_code, 400)
+
+        job = jobs.enqueue(self.user, "export", {"source": "expenses"})
+        self.assertEqual(self.client.get(f"/api/jobs/{job.pk}/download/").status_code, 404)
+        self.client.force_authenticate(User.objects.create_user("other", password="x"))
+        self.assertEqual(self.client.get(f"/api/jobs/{job.pk}/").status_code, 404)
+
+    def test_retries_with_backoff_then_fails(self):
+        calls = []
+
+        @jobs.handler("flaky")
+        def flaky(job, progress):
+            calls.append(job.attempts)
+            raise RuntimeError("boom")
+        self.addCleanup(jobs.HANDLERS.pop, "flaky")
+
+        job = jobs.enqueue(self.user, "flaky", max_attempts=2)
+        jobs.work(processes=0, once=True)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, calls), (Job.Status.QUEUED, 1, [1]))
+        self.assertIn("RuntimeError: boom", job.error)
+        self.assertGreater(job.run_after, now() + timedelta(seconds=jobs.RETRY_DELAY - 5))
+
+        # not due yet
+        self.assertEqual(jobs.work(processes=0, once=True), 0)
+        Job.objects.filter(pk=job.pk).update(run_after=now())
+        jobs.work(processes=0, once=True)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, calls), (Job.Status.FAILED, 2, [1, 2]))
+        self.assertIsNotNone(job.finished_at)
+
+    def test_stale_running_jobs_are_requeued(self):
+        job = jobs.enqueue(self.user, "rebuild_rollups")
+        jobs.claim(1)
+        Job.objects.filter(pk=job.pk).update(heartbeat_at=now() - timedelta(seconds=jobs.STALE_AFTER + 1))
+        self.assertEqual(jobs.requeue_stale(), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.Status.QUEUED, 1))
+
+    def test_rollup_rebuild_reports_outside_its_transaction(self):
+        # TestCase holds a transaction of its own; the rebuild must not add to it
+        depth, calls = len(connection.atomic_blocks), []
+        rollups.rebuild(self.user, progress=lambda done, total, message: calls.append((done, total, len(connection.atomic_blocks) - depth)))
+        self.assertEqual(calls, [(1, 3, 0), (2, 3, 0), (1, 1, 0)])
+
+
+class RecurringTransactionTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("subscriber", password="x")
+        cls.rent = Category.objects.create(user=cls.user, name="Rent", transaction_type="EXPENSE")
+        cls.salary = Category.objects.create(user=cls.user, name="Salary", transaction_type="INCOME")
+
+    def schedule(self, **fields):
+        row = {"transaction_type": "EXPENSE", "title": "Rent", "category": self.rent.id, "amount": "1200.00",
+               "frequency": "monthly", "start_date": "2025-01-31", **fields}
+        response = self.client.post("/api/recurring/", row, format="json")
+        self.assertEqual(response.status_code, 201, response.content)
+        return response.json()
+
+    def test_occurrence_dates(self):
+        rule = RecurringTransaction(frequency="monthly", interval=1, start_date=date(2024, 1, 31))
+        self.assertEqual(
+            [recurring.occurrence(rule, n) for n in range(4)],
+            [date(2024, 1, 31), date(2024, 2, 29), date(2024, 3, 31), date(2024, 4, 30)],
+        )
+        rule = RecurringTransaction(frequency="weekly", interval=2, start_date=date(2025, 1, 1))
+        self.assertEqual(recurring.index_on_or_after(rule, date(2025, 1, 16)), 2)
+        for frequency in ("daily", "weekly", "monthly", "yearly"):
+            rule = RecurringTransaction(frequency=frequency, interval=3, start_date=date(2024, 2, 29))
+            for day in (date(2024, 2, 29), date(2024, 3, 1), date(2026, 7, 15), date(2033, 3, 1)):
+                n = recurring.index_on_or_after(rule, day)
+                self.assertGreaterEqual(recurring.occurrence(rule, n), day)
+                self.assertTrue(n == 0 or recurring.occurrence(rule, n - 1) < day)
+
+    def test_materialize_is_idempotent(self):
+        self.schedule(end_date="2025-04-30")
+        self.schedule(transaction_type="INCOME", title="Pay", category=self.salary.id, amount="3000.00",
+                      frequency="weekly", interval=2, start_date="2025-03-07")
+
+        stats = recurring.materialize(date(2025, 3, 31))
+        self.assertEqual((stats["rules"], stats["created"], stats["complete"]), (2, 5, True))
+        self.assertEqual(
+            list(Expense.objects.filter(user=self.user).order_by("date").values_list("date", flat=True)),
+            [date(2025, 1, 31), date(2025, 2, 28), date(2025, 3, 31)],
+        )
+        self.assertEqual(recurring.materialize(date(2025, 3, 31))["created"], 0)
+
+        call_command("materialize_recurring", "--date", "2025-12-31", stdout=StringIO())
+        self.assertEqual(Expense.objects.filter(user=self.user).count(), 4)
+        self.assertEqual(Income.objects.filter(user=self.user).count(), 22)
+        self.assertEqual(rollups.verify(self.user), {})
+        self.assertIsNone(self.client.get("/api/recurring/").json()[0]["next_date"])
+
+    def test_catch_up_is_batched_and_resumable(self):
+        self.schedule(frequency="daily", start_date="2025-01-01")
+        first = recurring.materialize(date(2025, 1, 31), max_catch_up=7, seconds=0)
+        self.assertEqual((first["created"], first["complete"]), (0, False))
+        recurring.materialize(date(2025, 1, 31), max_catch_up=7)
+        self.assertEqual(Expense.objects.filter(user=self.user).count(), 31)
+        self.assertEqual(len(set(Expense.objects.values_list("date", flat=True))), 31)
+
+    def test_changing_the_schedule_resumes_after_written_rows(self):
+        rule = self.schedule(start_date="2025-01-15")
+        recurring.materialize(date(2025, 3, 20))
+        response = self.client.patch(f"/api/recurring/{rule['id']}/", {"frequency": "weekly"}, format="json")
+        self.assertEqual(response.json()["next_date"], "2025-03-19")
+        response = self.client.patch(f"/api/recurring/{rule['id']}/", {"amount": "1300.00"}, format="json")
+        self.assertEqual(response.json()["next_date"], "2025-03-19")
+
+    def test_validation(self):
+        row = {"transaction_type": "EXPENSE", "title": "x", "category": self.salary.id, "amount": "1.00",
+               "frequency": "monthly", "start_date": "2025-01-01"}
+        self.assertEqual(self.client.post("/api/recurring/", row, format="json").status_code, 400)
+        row.update(category=self.rent.id, end_date="2024-12-31")
+        self.assertEqual(self.client.post("/api/recurring/", row, format="json").status_code, 400)
+        row.update(end_date=None, interval=0)
+        self.assertEqual(self.client.post("/api/recurring/", row, format="json").status_code, 400)
+
+
+STATEMENT_CSV = """Posted Date;Description;Amount;Category
+2025-03-01;STARBUCKS  #123;-4.50;
+2025-03-01;Starbucks #123;-4.50;
+2025-03-02;ACME PAYROLL;"2,500.00";
+2025-03-03;Corner Shop;(12.00);Groceries
+2025-03-04;Mystery;abc;
+"""
+
+STATEMENT_OFX = """OFXHEADER:100
+DATA:OFXSGML
+
+<OFX><BANKMSGSRSV1><STMTTRNRS><STMTRS><BANKTRANLIST>
+<STMTTRN><TRNTYPE>DEBIT<DTPOSTED>20250305120000<TRNAMT>-30.00<FITID>1<NAME>Shell &amp; Co
+</STMTTRN>
+<STMTTRN>
+<TRNTYPE>CREDIT
+<DTPOSTED>20250306
+<TRNAMT>100.00
+<FITID>2
+<MEMO>Refund
+</STMTTRN>
+</BANKTRANLIST></STMTRS></STMTTRNRS></BANKMSGSRSV1></OFX>
+"""
+
+
+class StatementImportTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("importer", password="x")
+        cls.coffee = Category.objects.create(user=cls.user, name="Coffee", transaction_type="EXPENSE")
+        cls.groceries = Category.objects.create(user=cls.user, name="Groceries", transaction_type="EXPENSE")
+        cls.salary = Category.objects.create(user=cls.user, name="Salary", transaction_type="INCOME")
+        CategoryRule.objects.create(user=cls.user, pattern="starbucks", category=cls.coffee)
+        CategoryRule.objects.create(user=cls.user, pattern="payroll", category=cls.salary)
+
+    def upload(self, content, name="statement.csv", **fields):
+        return self.client.post("/api/import/", {"file": SimpleUploadedFile(name, content.encode()), **fields}, format="multipart")
+
+    def test_csv_import_categorizes_and_dedupes(self):
+        response = self.upload(STATEMENT_CSV)
+        self.assertEqual(response.status_code, 201)
+        stats = response.json()
+        self.assertEqual((stats["rows"], stats["created"], stats["duplicates"]), (5, {"expense": 3, "income": 1}, 0))
+        self.assertEqual(stats["errors"], [{"line": 6, "error": "Invalid amount 'abc'"}])
+        self.assertEqual(
+            sorted(Expense.objects.filter(user=self.user).values_list("title", "amount", "category__name")),
+            [("Corner Shop", Decimal("12.00"), "Groceries"), ("STARBUCKS #123", Decimal("4.50"), "Coffee"),
+             ("Starbucks #123", Decimal("4.50"), "Coffee")],
+        )
+        self.assertEqual(Income.objects.get(user=self.user).category, self.salary)
+
+        # both coffees already exist, however the rows are split into chunks
+        with open(self.write_temp(STATEMENT_CSV + "2025-03-01;starbucks #123;-4.50;\n"), "rb") as stream:
+            stats = statements.import_statement(self.user, stream, "csv", chunk_size=1)
+        self.assertEqual((stats["created"], stats["duplicates"]), ({"expense": 1, "income": 0}, 4))
+        self.assertEqual(Expense.objects.filter(user=self.user, title__iexact="starbucks #123").count(), 3)
+        self.assertEqual(rollups.verify(self.user), {})
+
+    def test_ofx_import(self):
+        response = self.upload(STATEMENT_OFX, name="march.ofx")
+        self.assertEqual(response.json()["created"], {"expense": 1, "income": 1})
+        expense = Expense.objects.get(user=self.user)
+        self.assertEqual((expense.title, expense.date, expense.amount), ("Shell & Co", date(2025, 3, 5), Decimal("30.00")))
+        self.assertEqual(self.upload(STATEMENT_OFX, name="march.ofx").json()["duplicates"], 2)
+
+    def test_bad_files(self):
+        response = self.upload("when,what\n2025-01-01,x\n")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("Missing column(s)", response.json()["detail"])
+        self.assertEqual(self.upload("", transaction_type="nope").status_code, 400)
+
+    def test_large_files_import_in_a_job(self):
+        with tempfile.TemporaryDirectory() as media, self.settings(MEDIA_ROOT=media, EXPENSES_IMPORT_INLINE_BYTES=10):
+            response = self.upload(STATEMENT_CSV)
+            self.assertEqual(response.status_code, 202)
+            jobs.work(processes=0, once=True)
+            job = Job.objects.get(pk=response.json()["id"])
+            self.assertEqual((job.status, job.result["created"], job.file.name), ("succeeded", {"expense": 3, "income": 1}, ""))
+
+    def test_long_imports_keep_their_job_alive(self):
+        # every chunk finds the heartbeat of the previous one aged past STALE_AFTER
+        # unless the import reported progress in between
+        content = "Date,Description,Amount\n" + "".join(f"2025-03-01,Row {n},-1.00\n" for n in range(statements.CHUNK_SIZE + 1))
+        requeued, write_chunk = [], statements.write_chunk
+
+        def slow_chunk(*args):
+            requeued.append(jobs.requeue_stale())
+            write_chunk(*args)
+            Job.objects.filter(status=Job.Status.RUNNING).update(heartbeat_at=now() - timedelta(seconds=jobs.STALE_AFTER + 1))
+
+        with tempfile.TemporaryDirectory() as media, self.settings(MEDIA_ROOT=media, EXPENSES_IMPORT_INLINE_BYTES=10), \
+                unittest.mock.patch.object(jobs, "PROGRESS_INTERVAL", 0), unittest.mock.patch.object(statements, "write_chunk", slow_chunk):
+            job_id = self.upload(content).json()["id"]
+            jobs.work(processes=0, once=True)
+        job = Job.objects.get(pk=job_id)
+        self.assertEqual(requeued, [0, 0])
+        self.assertEqual((job.status, job.attempts, job.result["created"]["expense"]), ("succeeded", 1, statements.CHUNK_SIZE + 1))
+
+    def write_temp(self, content):
+        handle = tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False)
+        self.addCleanup(os.unlink, handle.name)
+        with handle:
+            handle.write(content)
+        return handle.name
+
+
+class CategoryRuleTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("ruler", password="x")
+        cls.coffee = Category.objects.create(user=cls.user, name="Coffee", transaction_type="EXPENSE")
+        cls.travel = Category.objects.create(user=cls.user, name="Travel", transaction_type="EXPENSE")
+        cls.rent = Category.objects.create(user=cls.user, name="Rent", transaction_type="EXPENSE")
+        cls.salary = Category.objects.create(user=cls.user, name="Salary", transaction_type="INCOME")
+
+    def setUp(self):
+        super().setUp()
+        rules.clear()
+
+    def rule(self, pattern, category, priority=100, **fields):
+        return CategoryRule.objects.create(user=self.user, pattern=pattern, category=category, priority=priority, **fields)
+
+    def test_matcher_picks_the_best_rule(self):
+        Keyword, Regex = CategoryRule.Kind.KEYWORD, CategoryRule.Kind.REGEX
+        matcher = rules.Matcher([
+            (Keyword, "uber eats", 1, None, None),
+            (Keyword, "uber", 2, None, None),
+            (Regex, r"\bflight\s+\d+", 3, None, None),
+            (Regex, r"(a)\1", 4, None, None),  # no literal to wait for: always searched
+            (Keyword, "rent", 5, Decimal("500"), None),
+            (Keyword, "rental", 6, None, None),
+        ])
+        self.assertEqual(matcher("UBER trip"), 2)
+        self.assertEqual(matcher("Uber Eats order"), 1)
+        # "rental" is itself a longer keyword but "rent" outranks it only with the amount
+        self.assertEqual(matcher("car rental", Decimal("40")), 6)
+        self.assertEqual(matcher("car rental", Decimal("900")), 5)
+        self.assertEqual(matcher("Flight 42 to Oslo"), 3)
+        self.assertEqual(matcher("baaad"), 4)
+        self.assertIsNone(matcher("groceries"))
+
+        self.assertEqual(
+            [rules.required_literal(p) for p in (r"^POS\s+Uber\b", r"tax(i|es)", "uber|lyft", r"\d+ab")],
+            ["uber", "tax", None, None],
+        )
+        words = ["uber", "uber eats", "ub", "rent", "rental"]
+        pattern = re.compile(rules.trie_pattern(words))
+        self.assertEqual([pattern.fullmatch(word) is not None for word in words], [True] * 5)
+
+    def test_new_transactions_are_categorized_and_rule_changes_apply(self):
+        starbucks = self.rule("starbucks", self.coffee)
+        self.rule("payroll", self.salary)
+        response = self.client.post("/api/expenses/", {"title": "STARBUCKS #9", "amount": "4.50", "date": "2025-05-01"}, format="json")
+        self.assertEqual((response.status_code, response.json()["category_name"]), (201, "Coffee"))
+        response = self.client.post("/api/income/", {"title": "ACME payroll", "amount": "900", "date": "2025-05-01"}, format="json")
+        self.assertEqual(response.json()["category"], self.salary.pk)
+        # an explicit category wins; an expense nothing matches still needs one
+        response = self.client.post("/api/expenses/", {"title": "starbucks", "category": self.travel.pk, "amount": "1", "date": "2025-05-01"}, format="json")
+        self.assertEqual(response.json()["category"], self.travel.pk)
+        response = self.client.post("/api/expenses/", {"title": "kiosk", "amount": "1", "date": "2025-05-01"}, format="json")
+        self.assertEqual((response.status_code, response.json()), (400, {"category": ["This field is required."]}))
+
+        response = self.client.patch(f"/api/category-rules/{starbucks.pk}/", {"category": self.travel.pk}, format="json")
+        self.assertEqual(response.status_code, 200)
+        response = self.client.post("/api/expenses/", {"title": "starbucks", "amount": "2", "date": "2025-05-02"}, format="json")
+        self.assertEqual(response.json()["category"], self.travel.pk)
+
+        response = self.client.post("/api/expenses/bulk/", [
+            {"title": "Starbucks", "amount": "3", "date": "2025-05-03"},
+            {"title": "kiosk", "amount": "3", "date": "2025-05-03"},
+        ], format="json")
+        self.assertEqual(response.json()["errors"], [{"index": 1, "errors": {"category": ["This field is required."]}}])
+        self.assertEqual(Expense.objects.get(pk=response.json()["created"][0]).category, self.travel)
+        self.assertEqual(rollups.verify(self.user), {})
+
+    def test_rule_validation(self):
+        post = lambda **data: self.client.post("/api/category-rules/", {"category": self.coffee.pk, **data}, format="json")
+        self.assertEqual(post(kind="regex", pattern="caf(e").status_code, 400)
+        self.assertEqual(post(pattern="cafe", min_amount="10", max_amount="5").status_code, 400)
+        self.assertEqual(post(pattern="  ").status_code, 400)
+        response = post(kind="regex", pattern=r"caf(e|é)", min_amount="1")
+        self.assertEqual((response.status_code, response.json()["kind"]), (201, "regex"))
+
+    def test_recategorize_history_in_a_job(self):
+        uncategorized = Category.objects.create(user=self.user, name="Misc", transaction_type="EXPENSE")
+        rows = [
+            Expense.objects.create(user=self.user, title=title, category=category, amount=Decimal(amount), date=date(2025, 4, day))
+            for title, category, amount, day in (
+                ("Starbucks", uncategorized, "4", 1), ("Landlord", uncategorized, "1200", 2),
+                ("Landlord", uncategorized, "20", 3), ("Starbucks", self.travel, "5", 20),
+            )
+        ]
+        pay = Income.objects.create(user=self.user, title="Payroll April", amount=Decimal("900"), date=date(2025, 4, 1))
+        self.rule("starbucks", self.coffee)
+        self.rule("landlord", self.rent, min_amount=Decimal("1000"))
+        self.rule("payroll", self.salary)
+
+        with tempfile.TemporaryDirectory() as media, self.settings(MEDIA_ROOT=media):
+            response = self.client.post("/api/category-rules/apply/", {"overwrite": True, "end_date": "2025-04-10"}, format="json")
+            self.assertEqual((response.status_code, response.json()["kind"]), (202, "recategorize"))
+            jobs.work(processes=0, once=True)
+        job = Job.objects.get(pk=response.json()["id"])
+        self.assertEqual((job.status, job.result["updated"]), ("succeeded", 3))
+        self.assertEqual(
+            [Expense.objects.get(pk=row.pk).category for row in rows], [self.coffee, self.rent, uncategorized, self.travel],
+        )
+        pay.refresh_from_db()
+        self.assertEqual(pay.category, self.salary)
+        self.assertEqual(rollups.verify(self.user), {})
+        self.assertEqual(self.client.post("/api/category-rules/apply/", {"end_date": "soon"}, format="json").status_code, 400)
+
+
+class TokenAuthenticationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("tokened", password="secret-pass")
+        cls.token = Token.objects.create(user=cls.user)
+
+    def setUp(self):
+        caching.get_cache().clear()
+        authentication.clear()
+        self.client = APIClient()
+
+    def get(self, key=None):
+        return self.client.get("/api/category/", HTTP_AUTHORIZATION=f"Token {key or self.token.key}")
+
+    def test_cached_lookups_skip_the_database(self):
+        self.assertEqual(self.get().status_code, 200)
+        with CaptureQueriesContext(connection) as ctx:
+            request = APIRequestFactory().get("/", HTTP_AUTHORIZATION=f"Token {self.token.key}")
+            user, token = authentication.CachedTokenAuthentication().authenticate(request)
+        self.assertEqual((user, token.key, len(ctx.captured_queries)), (self.user, self.token.key, 0))
+        self.assertEqual(self.get("nope").status_code, 401)
+
+        with self.settings(EXPENSES_AUTH_CACHE_SIZE=1):
+            other = Token.objects.create(user=User.objects.create_user("second"))
+            self.assertEqual(self.get(other.key).status_code, 200)
+            with CaptureQueriesContext(connection) as ctx:
+                authentication.CachedTokenAuthentication().authenticate_credentials(self.token.key)
+            self.assertEqual(len(ctx.captured_queries), 2)  # evicted by the other token
+
+    def test_revocation_and_deactivation_apply_at_once(self):
+        self.assertEqual(self.get().status_code, 200)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.get().status_code, 401)
+        self.user.is_active = True
+        self.user.save()
+        self.assertEqual(self.get().status_code, 200)
+        Token.objects.filter(user=self.user).delete()
+        self.assertEqual(self.get().status_code, 401)
+
+    def test_revocation_during_a_lookup_is_not_cached(self):
+        store = authentication.CachedTokenAuthentication.store
+
+        def revoke_then_store(auth, key, token, stamp):
+            Token.objects.filter(key=key).delete()
+            return store(auth, key, token, stamp)
+
+        with unittest.mock.patch.object(authentication.CachedTokenAuthentication, "store", revoke_then_store):
+            self.assertEqual(self.get().status_code, 200)
+        self.assertEqual(self.get().status_code, 401)
+
+    def test_expiry_and_rotation(self):
+        self.assertEqual(self.get().status_code, 200)
+        Token.objects.filter(pk=self.token.pk).update(created=now() - timedelta(days=31))
+        authentication.clear()
+        with self.settings(EXPENSES_TOKEN_TTL=30 * 24 * 3600):
+            response = self.get()
+            self.assertEqual((response.status_code, response.json()["detail"]), (401, "Token has expired."))
+            fresh = self.client.post("/api/login", {"username": "tokened", "password": "secret-pass"}).json()["token"]
+        self.assertNotEqual(fresh, self.token.key)
+        self.assertEqual(self.get(fresh).status_code, 200)
+
+        response = self.client.post("/api/token/rotate/", HTTP_AUTHORIZATION=f"Token {fresh}")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((self.get(fresh).status_code, self.get(response.json()["token"]).status_code), (401, 200))
+
+
+class InstrumentationTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("measured", password="x", is_staff=True)
+        food = Category.objects.create(user=cls.user, name="Food", transaction_type="EXPENSE")
+        for i in range(3):
+            Expense.objects.create(user=cls.user, title=f"e{i}", category=food, amount=Decimal("2.00"), date=date(2025, 5, i + 1))
+        cls.token = Token.objects.create(user=cls.user)
+
+    def setUp(self):
+        super().setUp()
+        instrumentation.reset()
+
+    def test_server_timing_and_route_histograms(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get("/api/budgets/progress/")
+        timing = dict(entry.split(";", 1) for entry in response["Server-Timing"].split(", "))
+        self.assertEqual(set(timing), {"db", "serialize", "render", "total", "size"})
+        self.assertIn(f'desc="{len(ctx.captured_queries)} queries"', timing["db"])
+        self.assertEqual(timing["size"], f'desc="{len(response.content)} bytes"')
+
+        for _ in range(2):
+            self.client.get("/api/category/")
+        rows = {row["route"]: row for row in self.client.get("/api/perf/stats/").json()}
+        self.assertEqual(rows["GET /api/category/"]["requests"], 2)
+        self.assertEqual(rows["GET /api/budgets/progress/"]["requests"], 1)
+        self.assertGreater(rows["GET /api/category/"]["serialize_ms"], 0)
+
+        output = StringIO()
+        call_command("perf_stats", "--route", "category", "--reset", stdout=output)
+        self.assertIn("GET /api/category/", output.getvalue())
+        self.assertNotIn("budgets", output.getvalue())
+        self.assertEqual(instrumentation.collected(), {})
+
+    def test_slow_queries_are_logged(self):
+        client = APIClient()
+        with self.settings(EXPENSES_SLOW_QUERY_MS=0), self.assertLogs("expenses.slow_queries", "WARNING") as logs:
+            client.get("/api/category/", HTTP_AUTHORIZATION=f"Token {self.token.key}")
+        self.assertIn("GET /api/category/", logs.output[0])
+        self.assertIn("expenses_category", "".join(logs.output))
+        self.assertIn("authtoken_token", "".join(logs.output))
+        self.assertNotIn(self.token.key, "".join(logs.output))
+
+    async def test_async_requests_stay_async(self):
+        async def view(request):
+            return HttpResponse("ok")
+
+        middleware = instrumentation.InstrumentationMiddleware(view)
+        self.assertTrue(iscoroutinefunction(middleware))
+        self.assertIn("total;dur=", (await middleware(RequestFactory().get("/"))).get("Server-Timing"))
+
+        response = await AsyncClient().get("/api/async/expenses/", headers={"authorization": f"Token {self.token.key}"})
+        queries = int(re.search(r'desc="(\d+) queries"', response["Server-Timing"]).group(1))
+        self.assertGreater(queries, 0)
+
+    def test_dead_workers_are_pruned(self):
+        cache = caching.get_cache()
+        finished = subprocess.Popen(["true"])
+        finished.wait()
+        cache.add(instrumentation.SLOTS_KEY, 0, timeout=None)
+        slot = cache.incr(instrumentation.SLOTS_KEY)
+        routes = {"GET /gone/": instrumentation.new_route()}
+        routes["GET /gone/"]["total_ms"].observe(5)
+        cache.set(instrumentation.slot_key(slot), {"pid": finished.pid, "host": instrumentation.HOST, "routes": routes})
+        self.client.get("/api/category/")
+        instrumentation.flush()
+
+        self.assertEqual(set(instrumentation.collected()), {"GET /api/category/"})
+        self.assertIsNone(cache.get(instrumentation.slot_key(slot)))
+        self.assertIsNotNone(cache.get(instrumentation.slot_key(instrumentation.claim_slot(cache))))
+
+    def test_histogram_percentiles(self):
+        histogram = instrumentation.Histogram(instrumentation.MS_BOUNDS)
+        for value in [3] * 90 + [40] * 9 + [12000]:
+            histogram.observe(value)
+        self.assertEqual((histogram.percentile(50), histogram.percentile(95), histogram.percentile(99.5)), (5, 50, 12000))
+
+
+class SyntheticDataTests(TestCase):
+
+    def generate(self, prefix):
+        synthetic.generate(users=2, rows=300, years=1, seed=7, prefix=prefix, end=date(2025, 6, 30), chunk_size=100)
+        return list(
+            Expense.objects.filter(user__username__startswith=f"{prefix}-")
+            .order_by("user__username", "id").values_list("category__name", "date", "title", "amount")
+        )
+
+    def test_generated_data_is_reproducible_and_consistent(self):
+        rows = self.generate("one")
+        self.assertEqual(len(rows), 300)
+        self.assertEqual(rows, self.generate("two"))
+        self.assertTrue(all(date(2024, 6, 30) <= row[1] <= date(2025, 6, 30) for row in rows))
+        self.assertEqual(Income.objects.filter(user__username="one-0", title="Payroll").count(), 12)
+        self.assertEqual(rollups.verify(), {})
+
+        self.assertEqual(synthetic.clear("one"), 2)
+        self.assertFalse(Expense.objects.filter(user__username__startswith="one-").exists())
+        self.assertEqual(rollups.verify(), {})
+
+    def test_replay_and_baseline_comparison(self):
+        self.generate(synthetic.PREFIX)
+        users = User.objects.filter(username__startswith=f"{synthetic.PREFIX}-")
+        with self.settings(EXPENSES_CACHE_TIMEOUT=0):
+            results = benchmarks.replay(users, list(benchmarks.TRAFFIC), requests=2)
+        self.assertEqual({result["errors"] for result in results.values()}, {0})
+        self.assertLessEqual(results["expenses list"]["p50_ms"], results["expenses list"]["p99_ms"])
+
+        slower = {name: {**result, "p95_ms": result["p95_ms"] / 2} for name, result in results.items()}
+        changes = benchmarks.compare(results, slower, tolerance=50)
+        self.assertTrue(all(change["regressed"] for change in changes.values()))
+        self.assertFalse(any(change["regressed"] for change in benchmarks.compare(results, results, 0).values()))
+
+        output = StringIO()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "baseline.json")
+            call_command("benchmark_api", "budget progress", "--requests", "2", "--save", path, stdout=output)
+            call_command("benchmark_api", "budget progress", "--requests", "2", "--baseline", path, "--tolerance", "1000", stdout=output)
+        self.assertIn("Baseline written", output.getvalue())
@@ -0,0 +1,166 @@
+from collections import defaultdict
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.db.models import Sum
+from django.db.models.functions import TruncDay, TruncMonth, TruncWeek
+
+from . import rollups
+from .models import MonthlyRollup
+
+
+GRANULARITIES = ('month', 'week', 'day')
+TRUNCATE = {'month': TruncMonth, 'week': TruncWeek, 'day': TruncDay}
+MAX_POINTS = 1000
+CENTS = Decimal('0.01')
+
+
+class SeriesError(ValueError):
+    pass
+
+
+def period_start(day, granularity):
+    if granularity == 'month':
+        return day.replace(day=1)
+    if granularity == 'week':
+        return day - timedelta(days=day.weekday())
+    return day
+
+
+def next_period(period, granularity):
+    if granularity == 'month':
+        return (period + timedelta(days=32)).replace(day=1)
+    if granularity == 'week':
+        return period + timedelta(days=7)
+    return period + timedelta(days=1)
+
+
+def shift_year(period, years):
+    return period.replace(year=period.year + years)
+
+
+def parse_date(value):
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise SeriesError(f'Invalid date: {value}')
+
+
+def window_totals(model, user, transaction_type, granularity, lower=None, upper=None):
+    """
+    One grouped query returning {(period, category_name): total} for rows
+    dated ``lower`` to ``upper``. Whole-month ranges are read from the
+    rollup table; anything finer, or a range that cuts through a month, is
+    truncated from the raw rows.
+    """
+    aligned = rollups.month_range(lower and lower.isoformat(), upper and upper.isoformat()) is not None
+    if granularity == 'month' and aligned:
+        queryset = MonthlyRollup.objects.filter(user=user, transaction_type=transaction_type, count__gt=0)
+        if lower:
+            queryset = queryset.filter(month__gte=lower)
+        if upper:
+            queryset = queryset.filter(month__lte=upper)
+        rows = queryset.values_list('month', 'category__name').annotate(total=Sum('total')).order_by()
+    else:
+        queryset = model.objects.filter(user=user)
+        if lower:
+            queryset = queryset.filter(date__gte=lower)
+        if upper:
+            queryset = queryset.filter(date__lte=upper)
+        rows = (
+            queryset.annotate(period=TRUNCATE[granularity]('date'))
+            .values_list('period', 'category__name')
+            .annotate(total=Sum('amount'))
+            .order_by()
+        )
+    return {(period, category): total for period, category, total in rows}
+
+
+def grouped_totals(model, user, transaction_type, granularity, start=None, end=None):
+    """{(period, category_name): total} of the rows from ``start`` to ``end``."""
+    return window_totals(model, user, transaction_type, granularity, start, end)
+
+
+def previous_year_totals(model, user, transaction_type, start=None, end=None):
+    """
+    {month: total} a year before ``start``..``end``, in whole months, for
+    the previous-year column of a monthly series. None without ``start``:
+    the series' own totals then already reach back far enough.
+    """
+    if not start:
+        return None
+    lower = shift_year(start.replace(day=1), -1)
+    upper = shift_year(next_period(end.replace(day=1), 'month'), -1) - timedelta(days=1) if end else None
+    previous = defaultdict(Decimal)
+    for (period, _), total in window_totals(model, user, transaction_type, 'month', lower, upper).items():
+        previous[period] += total
+    return previous
+
+
+def build_series(totals, granularity, start=None, end=None, window=3, previous=None):
+    """
+    Gap-fill grouped totals into a dense series between ``start`` and
+    ``end`` (defaulting to the first/last period with data), adding the
+    trailing rolling average, the previous year's value for monthly series
+    (from ``previous``, {month: total}, when given) and per-category series
+    aligned to the same periods, in a single pass.
+    """
+    by_period = defaultdict(Decimal)
+    for (period, category), total in totals.items():
+        by_period[period] += total
+
+    first = period_start(start, granularity) if start else min(by_period, default=None)
+    last = period_start(end, granularity) if end else max(by_period, default=None)
+    if first is None or last is None or first > last:
+        return {'granularity': granularity, 'window': window, 'points': [], 'by_category': []}
+
+    periods = []
+    period = first
+    while period <= last:
+        periods.append(period)
+        if len(periods) > MAX_POINTS:
+            raise SeriesError(f'Range spans more than {MAX_POINTS} {granularity}s; narrow it or use a coarser granularity.')
+        period = next_period(period, granularity)
+
+    index = {period: i for i, period in enumerate(periods)}
+    categories = {}
+    for (period, category), total in totals.items():
+        if period in index:
+            series = categories.setdefault(category, [Decimal('0')] * len(periods))
+            series[index[period]] += total
+
+    points = []
+    running = Decimal('0')
+    for i, period in enumerate(periods):
+        total = by_period.get(period, Decimal('0'))
+        running += total
+        if i >= window:
+            running -= by_period.get(periods[i - window], Decimal('0'))
+        point = {
+            'period': period,
+            'year': period.year,
+            'month': period.month,
+            # key the dashboard's bar chart already reads
+            'date__month': period.month,
+            'total': total,
+            'rolling_average': (running / min(i + 1, window)).quantize(CENTS),
+        }
+        if granularity == 'month':
+            last_year = (by_period if previous is None else previous).get(shift_year(period, -1), Decimal('0'))
+            point['previous_year'] = last_year
+            point['yoy_change'] = (
+                ((total - last_year) / last_year * 100).quantize(Decimal('0.1')) if last_year else None
+            )
+        points.append(point)
+
+    return {
+        'granularity': granularity,
+        'window': window,
+        'points': points,
+        'by_category': sorted(
+            ({'category__name': name, 'totals': series} for name, series in categories.items()),
+            key=lambda row: -sum(row['totals']),
+        ),
+    }
@@ -1,135 +1,205 @@
-from .models import Expense, Income, Category, Budget
-from .serializers import ExpenseSerializer, IncomeSerializer, CategorySerializer, BudgetSerializer
-from rest_framework import viewsets, permissions
+from .models import Expense, Income, Category, Budget, BudgetAlert, CategoryRule, Job, RecurringTransaction, Tombstone
+from . import alerts, budgets, exports, jobs, ledger, search, statements, summary, timeseries
+from . import authentication, caching, instrumentation
+from .caching import ConditionalGetMixin, bump_version, cached_response
+from .serializers import ExpenseSerializer, IncomeSerializer, CategorySerializer, BudgetSerializer, BudgetAlertSerializer, CategoryRuleSerializer, CategoryRuleApplySerializer, JobSerializer, RecurringTransactionSerializer, StatementImportSerializer, TransactionSearchSerializer, ExpenseBulkSerializer, IncomeBulkSerializer
+from .bulk import BulkTransactionMixin
+from .fastread import FastListMixin
+from .instrumentation import InstrumentedMixin
+from .pagination import KeysetPagination, LedgerPagination
+from rest_framework import mixins, viewsets, permissions, status
 from rest_framework.decorators import action
+from rest_framework.pagination import LimitOffsetPagination
 from django.db.models import Sum, Q
 from rest_framework.response import Response
-from django.db.models.functions import TruncMonth
+from django.conf import settings
+from django.http import FileResponse, Http404
 from django.utils.timezone import now
 from rest_framework.views import APIView
-import csv
-from django.http import HttpResponse
-from datetime import datetime, timedelta
-
-
-class ExpenseViewSet(viewsets.ModelViewSet):
+from rest_framework.authtoken.views import ObtainAuthToken
+from rest_framework.authtoken.models import Token
+from datetime import date, datetime, timedelta
+
+
+def date_range(params):
+    """Parsed start_date/end_date query params; ValueError if malformed."""
+    start_date = params.get("start_date")
+    end_date = params.get("end_date")
+    try:
+        return (
+            date.fromisoformat(start_date) if start_date else None,
+            date.fromisoformat(end_date) if end_date else None,
+        )
+    except ValueError:
+        raise ValueError("start_date and end_date must be YYYY-MM-DD")
+
+
+def filter_by_date(queryset, params):
+    start_date = params.get("start_date")
+    end_date = params.get("end_date")
+
+    if start_date:
+        queryset = queryset.filter(date__gte = start_date)
+    if end_date:
+        queryset = queryset.filter(date__lte = end_date)
+    return queryset
+
+
+def expense_summary_data(stats):
+    stats = stats[Category.CategoryType.EXPENSE]
+    return {
+        'total':float(stats['total']),
+        'count':stats['count'],
+        'average':float(stats['average']),
+        'min':stats['min'],
+        'max':stats['max'],
+        'median':stats['median'],
+        'by_category':stats['by_category']
+    }
+
+
+def income_summary_data(stats):
+    income = stats[Category.CategoryType.INCOME]
+    expense = stats[Category.CategoryType.EXPENSE]
+    return {
+        'total_income':income['total'],
+        'total_expense':expense['total'],
+        'net_income':income['total']-expense['total'],
+        'income':income,
+        'expense':expense,
+    }
+
+
+class ExpenseViewSet(InstrumentedMixin, ConditionalGetMixin, BulkTransactionMixin, FastListMixin, viewsets.ModelViewSet):
     serializer_class = ExpenseSerializer
+    bulk_serializer_class = ExpenseBulkSerializer
+    transaction_type = Category.CategoryType.EXPENSE
+    tombstone_kind = Tombstone.Kind.EXPENSE
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
-        queryset = Expense.objects.filter(user=self.request.user).select_related("category")
-        start_date = self.request.query_params.get("start_date")
-        end_date = self.request.query_params.get("end_date")
-
-        if start_date:
-            queryset = queryset.filter(date__gte = start_date)
-        if end_date:
-            queryset = queryset.filter(date__lte = end_date)
-
-        return queryset.order_by("-date")
+        queryset = Expense.objects.filter(user=self.request.user)
+        return filter_by_date(queryset, self.request.query_params).order_by("-date", "-id")
     
     @action(detail=False,methods=["get"])
     def export_csv(self,request):
-        expenses = self.get_queryset()
-        response = HttpResponse(content_type="text/csv")
-        response["Content-Disposition"] = 'attachment; filename="expenses.csv"'
-
-        writer = csv.writer(response)
-        writer.writerow(['Date', 'Title','Category', 'Amount'])
-
-
-        # write data
-        for e in expenses:
-            writer.writerow([
-                e.date.strftime('%Y-%m-%d'),
-                e.title,
-                e.category.name if e.category else 'N/A',
-                str(e.amount)
-            ])
-        return response
+        return exports.transactions_csv("expenses.csv", self.get_queryset())
     
 
 
     @action(detail=False,methods=["get"])
+    @cached_response
     def summary_stats(self,request):
-        expenses = self.get_queryset()
-
-        total = expenses.aggregate(Sum('amount'))['amount__sum'] or 0
-        count = expenses.count()
-        avg = total/count if count > 0 else 0
-
-
-
-        by_category = expenses.values("category__name").annotate(
-            total=Sum("amount")
-        ).order_by("-total")
-
-        return Response({
-            'total':float(total),
-            'count':count,
-            'average':float(avg),
-            'by_category':list(by_category)
-        })
+        try:
+            start, end = date_range(request.query_params)
+        except ValueError as exc:
+            return Response({'detail': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        stats = summary.summarize(request.user, start, end)
+        return Response(expense_summary_data(stats))
 
     
     
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
+        bump_version(self.request.user.pk)
 
     def perform_update(self, serializer):
         serializer.save(user=self.request.user)
+        bump_version(self.request.user.pk)
 
     def perform_destroy(self, instance):
         if instance.user == self.request.user:
             instance.delete()
+            bump_version(self.request.user.pk)
 
     @action(detail=False, methods=['get'])
+    @cached_response
     def total(self,request):
         total = self.get_queryset().aggregate(Sum('amount'))['amount__sum'] or 0
         return Response({'total_expenses':total})
     
     @action(detail=False,methods=['get'])
+    @cached_response
     def analytics(self,request):
-        user = self.request.user
-
-        category_data =(
-            Expense.objects.filter(user=user).values('category__name').annotate(total=Sum('amount')).order_by('-total')
-        )
-
-        monthly_data = (
-            Expense.objects.filter(user=user).annotate(month=TruncMonth('date')).values('date__month').annotate(total=Sum('amount')).order_by('month')
-        )
-
-
-        return Response({
-            'by_category':category_data,
-            'by_month':monthly_data
-        })
+        params = request.query_params
+        granularity = params.get('granularity', 'month')
+        try:
+            if granularity not in timeseries.GRANULARITIES:
+                raise timeseries.SeriesError(f"granularity must be one of {', '.join(timeseries.GRANULARITIES)}")
+            window = int(params.get('window', 3))
+            if not 1 <= window <= 52:
+                raise timeseries.SeriesError('window must be between 1 and 52')
+            start = timeseries.parse_date(params.get('start_date'))
+            end = timeseries.parse_date(params.get('end_date'))
+            totals = timeseries.grouped_totals(
+                Expense, request.user, Category.CategoryType.EXPENSE, granularity, start, end,
+            )
+            previous = None
+            if granularity == 'month':
+                previous = timeseries.previous_year_totals(
+                    Expense, request.user, Category.CategoryType.EXPENSE, start, end,
+                )
+            series = timeseries.build_series(totals, granularity, start, end, window, previous)
+        except ValueError as exc:
+            return Response({'detail': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+        category_data = [
+            {'category__name': row['category__name'], 'total': sum(row['totals'])}
+            for row in series['by_category']
+        ]
+
+        data = {
+            'granularity': granularity,
+            'window': window,
+            'by_category': category_data,
+            'by_period': series['points'],
+            'category_series': series['by_category'],
+        }
+        if granularity == 'month':
+            data['by_month'] = series['points']
+        return Response(data)
 
 
-class IncomeViewSet(viewsets.ModelViewSet):
+class IncomeViewSet(InstrumentedMixin, ConditionalGetMixin, BulkTransactionMixin, FastListMixin, viewsets.ModelViewSet):
     serializer_class = IncomeSerializer
+    bulk_serializer_class = IncomeBulkSerializer
+    transaction_type = Category.CategoryType.INCOME
+    tombstone_kind = Tombstone.Kind.INCOME
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
-        return Income.objects.filter(user=self.request.user)
+        queryset = Income.objects.filter(user=self.request.user)
+        return filter_by_date(queryset, self.request.query_params).order_by("-date", "-id")
     
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
+        bump_version(self.request.user.pk)
+
+    def perform_update(self, serializer):
+        serializer.save()
+        bump_version(self.request.user.pk)
+
+    def perform_destroy(self, instance):
+        instance.delete()
+        bump_version(self.request.user.pk)
+
+    @action(detail=False,methods=["get"])
+    def export_csv(self,request):
+        return exports.transactions_csv("income.csv", self.get_queryset())
 
     @action(detail=False, methods=['get'])
+    @cached_response
     def summary(self, request):
-        user = self.request.user
-        total_income = Income.objects.filter(user=user).aggregate(Sum('amount'))['amount__sum'] or 0
-        total_expenses = Expense.objects.filter(user=user).aggregate(Sum('amount'))['amount__sum'] or 0
-
-        return Response({
-            'total_income':total_income,
-            'total_expense':total_expenses,
-            'net_income':total_income-total_expenses
-        })
+        try:
+            start, end = date_range(request.query_params)
+        except ValueError as exc:
+            return Response({'detail': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        stats = summary.summarize(request.user, start, end)
+        return Response(income_summary_data(stats))
     
-class CategoryViewSet(viewsets.ModelViewSet):
+class CategoryViewSet(InstrumentedMixin, ConditionalGetMixin, viewsets.ModelViewSet):
     serializer_class = CategorySerializer
     permission_classes = [permissions.IsAuthenticated]
 
@@ -143,9 +213,19 @@ class CategoryViewSet(viewsets.ModelViewSet):
     
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
+        bump_version(self.request.user.pk)
 
+    # category names show up in every summary
+    def perform_update(self, serializer):
+        serializer.save()
+        bump_version(self.request.user.pk)
+
+    def perform_destroy(self, instance):
+        instance.delete()
+        bump_version(self.request.user.pk)
 
-class BudgetViewset(viewsets.ModelViewSet):
+
+class BudgetViewset(InstrumentedMixin, ConditionalGetMixin, viewsets.ModelViewSet):
     serializer_class = BudgetSerializer
     permission_classes = [permissions.IsAuthenticated]
 
@@ -161,41 +241,308 @@ class BudgetViewset(viewsets.ModelViewSet):
             category=category,
             defaults={"amount":amount}
         )
+        bump_version(self.request.user.pk)
 
         serializer.instance = budget
 
+    def perform_update(self, serializer):
+        serializer.save()
+        bump_version(self.request.user.pk)
+
+    def perform_destroy(self, instance):
+        instance.delete()
+        bump_version(self.request.user.pk)
 
 
 
-class BudgetProgressView(APIView):
-    permission_classes = [permissions.IsAuthenticated]
 
+class BudgetProgressView(ConditionalGetMixin, APIView):
+    """
+    Spending against each budget for the current month, or ``month``,
+    ``quarter`` or ``start_date``/``end_date``, plus ``history`` months of
+    per-month progress. Paginated with ``limit``/``offset`` when asked.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = LimitOffsetPagination
 
+    @cached_response
     def get(self,request):
-        user=request.user
-        today= now().date()
+        try:
+            start, end = budgets.parse_period(request.query_params, now().date())
+            history = budgets.parse_history(request.query_params)
+        except ValueError as exc:
+            return Response({'detail': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+        data = budgets.progress(request.user, start, end, history)
+
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(data, request, self)
+        if page is not None:
+            return paginator.get_paginated_response(page)
+        return Response(data)
+
+
+class BudgetAlertViewSet(InstrumentedMixin, ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
+    """Alerts written by ``manage.py process_alerts``, newest first; ``?unread=true`` filters."""
+    serializer_class = BudgetAlertSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        queryset = BudgetAlert.objects.filter(user=self.request.user).select_related("budget__category")
+        if self.request.query_params.get("unread") in ("1", "true"):
+            queryset = queryset.filter(read_at__isnull=True)
+        return queryset.order_by("-created_at", "-id")
+
+    @action(detail=True, methods=["post"])
+    def read(self, request, pk=None):
+        alerts.mark_read(self.get_queryset().filter(pk=self.get_object().pk))
+        bump_version(request.user.pk)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @action(detail=False, methods=["post"])
+    def read_all(self, request):
+        marked = alerts.mark_read(self.get_queryset())
+        bump_version(request.user.pk)
+        return Response({"marked": marked})
+
+
+class CategoryRuleViewSet(InstrumentedMixin, viewsets.ModelViewSet):
+    """
+    Keyword, regex and amount-range rules that categorise new transactions
+    and imported statement rows; the lowest ``priority`` wins. POST to
+    ``apply/`` (``overwrite``, ``start_date``, ``end_date``) queues a
+    ``recategorize`` job that runs them over existing transactions.
+    """
+    serializer_class = CategoryRuleSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return CategoryRule.objects.filter(user=self.request.user).select_related("category").order_by("priority", "id")
 
-        expenses = (Expense.objects.filter(user=user, date__year=today.year, date__month=today.month).values("category_id").annotate(spent=Sum("amount")))
+    def perform_create(self, serializer):
+        serializer.save(user=self.request.user)
 
+    @action(detail=False, methods=["post"])
+    def apply(self, request):
+        serializer = CategoryRuleApplySerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        params = {key: value.isoformat() if isinstance(value, date) else value for key, value in serializer.validated_data.items()}
+        job = jobs.enqueue(request.user, "recategorize", params)
+        return Response(JobSerializer(job, context={"request": request}).data, status=status.HTTP_202_ACCEPTED)
+
+
+class StatementImportView(APIView):
+    """
+    POST a CSV or OFX bank statement as ``file`` (multipart), optionally with
+    ``format``, ``date_format`` (strptime, for CSV) and ``transaction_type``.
+    Files up to EXPENSES_IMPORT_INLINE_BYTES are imported in the request and
+    answered with the import stats; larger ones are queued as an ``import``
+    job (202) to poll under /api/jobs/.
+    """
+    permission_classes = [permissions.IsAuthenticated]
 
-        spent_map = {e["category_id"]:e["spent"] for e in expenses}
+    def post(self, request):
+        serializer = StatementImportSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        upload = serializer.validated_data.pop("file")
+        options = serializer.validated_data
 
-        budgets = Budget.objects.filter(user=user).select_related("category")
+        if upload.size > getattr(settings, "EXPENSES_IMPORT_INLINE_BYTES", 2 * 1024 * 1024):
+            job = jobs.enqueue(request.user, "import", options, file=upload)
+            return Response(JobSerializer(job, context={"request": request}).data, status=status.HTTP_202_ACCEPTED)
 
+        try:
+            stats = statements.import_statement(
+                request.user, upload.file, options["format"], options.get("date_format"), options.get("transaction_type"),
+            )
+        except statements.StatementError as exc:
+            return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(stats, status=status.HTTP_201_CREATED)
 
 
-        data = []
+class RecurringTransactionViewSet(InstrumentedMixin, ConditionalGetMixin, viewsets.ModelViewSet):
+    """Schedules that ``manage.py materialize_recurring`` turns into expenses and income."""
+    serializer_class = RecurringTransactionSerializer
+    permission_classes = [permissions.IsAuthenticated]
 
-        for b in budgets:
-            spent = spent_map.get(b.category_id,0) or 0
-            percent = (float(spent)/float(b.amount)) * 100 if b.amount >0 else 0
-            data.append({
-                "id":b.id,
-                "category":b.category.name,
-                "budget_limit":str(b.amount),
-                "actual_limit":str(spent),
-                "remaining":str(b.amount - spent),
-                "percent":round(percent,1)
-            })
+    def get_queryset(self):
+        return RecurringTransaction.objects.filter(user=self.request.user).select_related("category").order_by("id")
 
+    def perform_create(self, serializer):
+        serializer.save(user=self.request.user)
+        bump_version(self.request.user.pk)
+
+    def perform_update(self, serializer):
+        serializer.save()
+        bump_version(self.request.user.pk)
+
+    def perform_destroy(self, instance):
+        instance.delete()
+        bump_version(self.request.user.pk)
+
+
+class JobViewSet(InstrumentedMixin, mixins.CreateModelMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    Background jobs run by ``manage.py run_jobs``. POST ``{"kind": "export",
+    "params": {"source": "expenses"}}`` queues one; poll it for ``status``
+    and ``progress``, then GET ``download_url`` once it has succeeded.
+    Not conditional: a job's status changes without any write of the user's.
+    """
+    serializer_class = JobSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return Job.objects.filter(user=self.request.user).order_by("-created_at", "-id")
+
+    def perform_create(self, serializer):
+        serializer.save(user=self.request.user)
+
+    @action(detail=True, methods=["get"])
+    def download(self, request, pk=None):
+        job = self.get_object()
+        if job.status != Job.Status.SUCCEEDED or not job.file:
+            raise Http404("This job has no file to download.")
+        return FileResponse(
+            job.file.open("rb"), as_attachment=True,
+            filename=job.file.name.rsplit("/", 1)[-1], content_type="application/gzip",
+        )
+
+
+class LedgerView(ConditionalGetMixin, APIView):
+    """
+    Expenses and income merged newest first, each with the running balance
+    after it. Always paginated by ``cursor``/``page_size``; a page is one
+    query however deep the client is.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = LedgerPagination
+
+    def get(self,request):
+        try:
+            start, end = date_range(request.query_params)
+        except ValueError as exc:
+            return Response({'detail': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        paginator = self.pagination_class()
+        entries = paginator.paginate_queryset(ledger.Ledger(request.user, start, end), request, view=self)
+        with instrumentation.section("serialize"):
+            return paginator.get_paginated_response([ledger.representation(entry) for entry in entries])
+
+
+class TransactionSearchView(ConditionalGetMixin, APIView):
+    """
+    Expenses and income whose title has every word of ``q`` (as a prefix),
+    best match first, optionally narrowed by type, category, date and
+    amount. Only the newest ``search.CANDIDATES`` matches of each type are
+    ranked, so an older whole-word match can lose to newer prefix matches.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self,request):
+        serializer = TransactionSearchSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        params = dict(serializer.validated_data)
+        text, limit = params.pop("q"), params.pop("limit")
+        kind = params.pop("type", None)
+        rows = search.search(request.user, text, (kind,) if kind else tuple(ledger.KINDS), limit, **params)
+        with instrumentation.section("serialize"):
+            return Response([search.representation(row) for row in rows])
+
+
+class LedgerExportView(ConditionalGetMixin, APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self,request):
+        expenses = filter_by_date(Expense.objects.filter(user=request.user), request.query_params)
+        incomes = filter_by_date(Income.objects.filter(user=request.user), request.query_params)
+        return exports.ledger_csv("ledger.csv", expenses, incomes)
+
+
+class SyncView(ConditionalGetMixin, APIView):
+    """
+    Delta sync. Without ``since`` it returns a full snapshot; otherwise only
+    rows changed and tombstones left since that token. Every response carries
+    the token to send next time.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    # a write whose updated_at was stamped before the previous sync but that
+    # committed after it is still picked up; upserts are idempotent
+    overlap = timedelta(seconds=2)
+
+    def get(self,request):
+        user = request.user
+        started = now()
+        since = request.query_params.get("since")
+        reset = not since
+
+        if since:
+            try:
+                since = datetime.fromtimestamp(int(since) / 1_000_000, tz=started.tzinfo)
+            except (ValueError, OverflowError, OSError):
+                return Response({"since": "Invalid sync token."}, status=status.HTTP_400_BAD_REQUEST)
+            retention = timedelta(days=getattr(settings, "EXPENSES_TOMBSTONE_RETENTION_DAYS", 90))
+            # tombstones older than this may be pruned: the client has to start over
+            if since < started - retention:
+                reset = True
+
+        sources = [
+            ("expenses", Tombstone.Kind.EXPENSE, Expense.objects.filter(user=user), ExpenseSerializer),
+            ("income", Tombstone.Kind.INCOME, Income.objects.filter(user=user), IncomeSerializer),
+            ("categories", Tombstone.Kind.CATEGORY, Category.objects.filter(Q(user=user) | Q(user__isnull=True)), CategorySerializer),
+            ("budgets", Tombstone.Kind.BUDGET, Budget.objects.filter(user=user).select_related("category"), BudgetSerializer),
+        ]
+
+        tombstones = {}
+        if not reset:
+            watermark = since - self.overlap
+            for kind, object_id in Tombstone.objects.filter(
+                Q(user=user) | Q(user__isnull=True), deleted_at__gte=watermark,
+            ).values_list("kind", "object_id"):
+                tombstones.setdefault(kind, []).append(object_id)
+
+        data = {"token": str(int(started.timestamp() * 1_000_000)), "reset": reset}
+        with instrumentation.section("serialize"):
+            for name, kind, queryset, serializer_class in sources:
+                if not reset:
+                    queryset = queryset.filter(updated_at__gte=watermark)
+                data[name] = {
+                    "upserts": serializer_class(queryset, many=True, context={"request": request}).data,
+                    "deletes": tombstones.get(kind, []),
+                }
         return Response(data)
+
+
+class LoginView(ObtainAuthToken):
+    """``obtain_auth_token`` that issues a new token once the old one has expired."""
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user = serializer.validated_data["user"]
+        token, _ = Token.objects.get_or_create(user=user)
+        if authentication.expired(token):
+            token = authentication.rotate(user)
+        return Response({"token": token.key})
+
+
+class TokenRotateView(APIView):
+    """POST to swap the caller's token for a new one; the old one stops working at once."""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        return Response({"token": authentication.rotate(request.user).key}, status=status.HTTP_201_CREATED)
+
+
+class CacheStatsView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self,request):
+        return Response(caching.stats())
+
+
+class PerfStatsView(APIView):
+    """Per-route timings collected by ``instrumentation.InstrumentationMiddleware``, slowest in total first."""
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self,request):
+        return Response(instrumentation.report(instrumentation.collected()))